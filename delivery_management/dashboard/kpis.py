@@ -0,0 +1,177 @@
+"""Incremental maintenance of the DeliveryKPI rollup
+
+An order counts once it reaches a final status (delivered, failed or
+cancelled), on the day's row for all orders, for its customer and, when
+it was on a route, for that route's truck and driver. A route adds its km
+once completed. Changes are applied as deltas from the status transitions
+(see ``signals``), so they also undo a count when an order or route leaves
+a final status. ``rebuild`` recomputes the rollup from history with the
+same contributions.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+
+from deliveries.models import DeliveryOrder, Route, RouteStop
+from .models import DeliveryKPI
+
+FINAL_STATUSES = DeliveryOrder.FINAL_STATUSES
+
+Row = Tuple[date, str, int]  # (date, dimension, key)
+
+
+def order_facts(orders) -> Iterable[tuple]:
+    """(id, status, requested date, customer, created, delivered at, truck, driver) per order of the queryset
+
+    Truck and driver are those of the order's latest route, if any.
+    """
+    latest_stop = RouteStop.objects.filter(delivery_order=OuterRef('pk')).order_by('-route_id')
+    return orders.annotate(
+        route_truck=Subquery(latest_stop.values('route__truck_id')[:1]),
+        route_driver=Subquery(latest_stop.values('route__driver_id')[:1]),
+    ).values_list(
+        'id', 'status', 'requested_delivery_date', 'customer_id', 'created_at', 'actual_delivery_time',
+        'route_truck', 'route_driver'
+    )
+
+
+def order_rows(requested_date, customer_id, truck_id, driver_id) -> list:
+    rows = [(requested_date, 'all', 0), (requested_date, 'customer', customer_id)]
+    if truck_id is not None:
+        rows.append((requested_date, 'truck', truck_id))
+    if driver_id is not None:
+        rows.append((requested_date, 'driver', driver_id))
+    return rows
+
+
+def order_counters(status: Optional[str], requested_date, created_at, delivered_at) -> Dict[str, float]:
+    """What an order in ``status`` adds to each of its rows"""
+    if status not in FINAL_STATUSES:
+        return {}
+    counters = {status: 1}
+    if status == 'delivered' and delivered_at is not None:
+        deadline = timezone.make_aware(datetime.combine(requested_date + timedelta(days=1), time.min))
+        counters['timed_deliveries'] = 1
+        counters['lead_minutes'] = (delivered_at - created_at).total_seconds() / 60
+        counters['delay_minutes'] = (delivered_at - deadline).total_seconds() / 60
+    return counters
+
+
+def route_rows(route) -> list:
+    return [(route.date, 'all', 0), (route.date, 'truck', route.truck_id), (route.date, 'driver', route.driver_id)]
+
+
+def _subtract(new: Dict[str, float], old: Dict[str, float]) -> Dict[str, float]:
+    delta = dict(new)
+    for field, value in old.items():
+        delta[field] = delta.get(field, 0) - value
+    return {field: value for field, value in delta.items() if value}
+
+
+def apply(changes: Dict[Row, Dict[str, float]]):
+    """Add counter deltas to rollup rows, creating rows as needed
+
+    Rows receiving the same deltas are updated by a single UPDATE.
+    """
+    changes = {row: delta for row, delta in changes.items() if delta}
+    if not changes:
+        return
+    groups = defaultdict(list)
+    for row, delta in changes.items():
+        groups[tuple(sorted(delta.items()))].append(row)
+
+    with transaction.atomic():
+        DeliveryKPI.objects.bulk_create(
+            [DeliveryKPI(date=day, dimension=dimension, key=key) for day, dimension, key in changes],
+            ignore_conflicts=True
+        )
+        for delta, rows in groups.items():
+            match = Q()
+            for day, dimension, key in rows:
+                match |= Q(date=day, dimension=dimension, key=key)
+            DeliveryKPI.objects.filter(match).update(**{
+                field: F(field) + (Decimal(str(value)) if field == 'route_km' else value) for field, value in delta
+            })
+
+
+def record_order_change(order, previous_status: Optional[str], previous_delivered_at=None):
+    """Move ``order``'s contribution from its previous status to its current one"""
+    old = order_counters(previous_status, order.requested_delivery_date, order.created_at, previous_delivered_at)
+    new = order_counters(order.status, order.requested_delivery_date, order.created_at, order.actual_delivery_time)
+    delta = _subtract(new, old)
+    if not delta:
+        return
+    facts = order_facts(DeliveryOrder.objects.filter(pk=order.pk)).first()
+    if facts is None:
+        return
+    _, _, requested_date, customer_id, _, _, truck_id, driver_id = facts
+    apply({row: delta for row in order_rows(requested_date, customer_id, truck_id, driver_id)})
+
+
+def _add_orders(totals: Dict[Row, Dict[str, float]], facts: Iterable[tuple]):
+    for _, status, requested_date, customer_id, created_at, delivered_at, truck_id, driver_id in facts:
+        counters = order_counters(status, requested_date, created_at, delivered_at)
+        for row in order_rows(requested_date, customer_id, truck_id, driver_id):
+            for field, value in counters.items():
+                totals[row][field] += value
+
+
+def record_orders_reaching(order_ids: Iterable[int], status: str):
+    """Count orders moved to ``status`` by a bulk update
+
+    Bulk updates skip orders already in a final status (see
+    ``deliveries.signals``), so every order comes from a status that did not
+    count and there is nothing to take back.
+    """
+    if status not in FINAL_STATUSES:
+        return
+    changes = defaultdict(lambda: defaultdict(float))
+    _add_orders(changes, order_facts(DeliveryOrder.objects.filter(id__in=list(order_ids))))
+    apply({row: dict(delta) for row, delta in changes.items()})
+
+
+def record_route_change(route, previous_status: Optional[str]):
+    """Add or take back a route's km when it enters or leaves 'completed'"""
+    was, now = previous_status == 'completed', route.status == 'completed'
+    if was == now:
+        return
+    km = float(route.total_distance_km) * (1 if now else -1)
+    apply({row: {'route_km': km} for row in route_rows(route)})
+
+
+def rebuild(start=None, end=None) -> int:
+    """Recompute the rollup rows of [start, end] (all dates by default) from orders and routes; returns rows written"""
+    orders = DeliveryOrder.objects.filter(status__in=FINAL_STATUSES)
+    routes = Route.objects.filter(status='completed')
+    rows = DeliveryKPI.objects.all()
+    if start is not None:
+        orders, routes, rows = (orders.filter(requested_delivery_date__gte=start), routes.filter(date__gte=start),
+                                rows.filter(date__gte=start))
+    if end is not None:
+        orders, routes, rows = (orders.filter(requested_delivery_date__lte=end), routes.filter(date__lte=end),
+                                rows.filter(date__lte=end))
+
+    totals = defaultdict(lambda: defaultdict(float))
+    _add_orders(totals, order_facts(orders).iterator(chunk_size=2000))
+    for route in routes.only('date', 'truck_id', 'driver_id', 'total_distance_km').iterator(chunk_size=2000):
+        for row in route_rows(route):
+            totals[row]['route_km'] += float(route.total_distance_km)
+
+    kpis = []
+    for (day, dimension, key), counters in totals.items():
+        values = dict(counters)
+        if 'route_km' in values:
+            values['route_km'] = round(Decimal(str(values['route_km'])), 2)
+        for field in ('delivered', 'failed', 'cancelled', 'timed_deliveries'):
+            if field in values:
+                values[field] = int(values[field])
+        kpis.append(DeliveryKPI(date=day, dimension=dimension, key=key, **values))
+    with transaction.atomic():
+        rows.delete()
+        DeliveryKPI.objects.bulk_create(kpis, batch_size=1000)
+    return len(kpis)
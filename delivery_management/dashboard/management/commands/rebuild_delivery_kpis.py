@@ -0,0 +1,19 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from dashboard.kpis import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily delivery KPI rollup from order and route history"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=None,
+                            help="First date to rebuild (YYYY-MM-DD, default: all history)")
+        parser.add_argument('--end', type=date.fromisoformat, default=None,
+                            help="Last date to rebuild (YYYY-MM-DD, default: all history)")
+
+    def handle(self, *args, **options):
+        rows = rebuild(options['start'], options['end'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} KPI rows"))
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryKPI',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('dimension', models.CharField(choices=[('all', 'All'), ('truck', 'Truck'), ('driver', 'Driver'), ('customer', 'Customer')], max_length=10)),
+                ('key', models.BigIntegerField(default=0)),
+                ('delivered', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('timed_deliveries', models.IntegerField(default=0)),
+                ('lead_minutes', models.FloatField(default=0)),
+                ('delay_minutes', models.FloatField(default=0)),
+                ('route_km', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+            options={
+                'unique_together': {('date', 'dimension', 'key')},
+            },
+        ),
+    ]
@@ -1,3 +1,46 @@
 from django.db import models
 
-# Create your models here.
+
+class DeliveryKPI(models.Model):
+    """Delivery outcomes of one day, rolled up per truck, driver and customer (see dashboard.kpis)
+
+    There is one row per (date, dimension, key), where key is the id of
+    the truck, driver or customer. Dimension 'all' (key 0) holds the day's
+    totals. Orders count on their requested delivery date and routes on
+    their date.
+    """
+    DIMENSION_CHOICES = [
+        ('all', 'All'),
+        ('truck', 'Truck'),
+        ('driver', 'Driver'),
+        ('customer', 'Customer'),
+    ]
+
+    date = models.DateField()
+    dimension = models.CharField(max_length=10, choices=DIMENSION_CHOICES)
+    key = models.BigIntegerField(default=0)
+    delivered = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    # Delivered orders with an actual delivery time, and two sums over them:
+    # minutes from order creation to delivery, and minutes past the end of the
+    # requested day (negative when delivered early)
+    timed_deliveries = models.IntegerField(default=0)
+    lead_minutes = models.FloatField(default=0)
+    delay_minutes = models.FloatField(default=0)
+    # Length of the day's completed routes; not split per customer
+    route_km = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['date', 'dimension', 'key']
+
+    def __str__(self):
+        return f"KPIs {self.date} {self.dimension} {self.key}"
+
+    @property
+    def avg_lead_minutes(self):
+        return self.lead_minutes / self.timed_deliveries if self.timed_deliveries else None
+
+    @property
+    def avg_delay_minutes(self):
+        return self.delay_minutes / self.timed_deliveries if self.timed_deliveries else None
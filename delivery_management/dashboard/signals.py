@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from accounts.models import User
+from deliveries.models import DeliveryOrder, Route, Truck
+from deliveries.signals import order_status_changed
+from . import kpis
+from .stats import invalidate_admin_stats
+
+
+@receiver(order_status_changed)
+@receiver(post_save, sender=DeliveryOrder)
+@receiver(post_delete, sender=DeliveryOrder)
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+@receiver(post_save, sender=Truck)
+@receiver(post_delete, sender=Truck)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_admin_stats(sender, **kwargs):
+    # After commit, so a page rendered meanwhile cannot cache the old counts again
+    transaction.on_commit(invalidate_admin_stats)
+
+
+# Status as loaded, to tell transitions apart on save. Read from __dict__ so
+# deferred fields are not fetched; None when status was deferred.
+
+@receiver(post_init, sender=DeliveryOrder)
+def remember_order_status(sender, instance, **kwargs):
+    if 'status' in instance.__dict__:
+        instance._kpi_state = (instance.status, instance.__dict__.get('actual_delivery_time'))
+    else:
+        instance._kpi_state = None
+
+
+@receiver(post_save, sender=DeliveryOrder)
+def update_order_kpis(sender, instance, created, raw=False, **kwargs):
+    previous = (None, None) if created else instance._kpi_state
+    if raw or previous is None:
+        return
+    kpis.record_order_change(instance, *previous)
+    instance._kpi_state = (instance.status, instance.actual_delivery_time)
+
+
+@receiver(order_status_changed)
+def update_bulk_order_kpis(sender, order_ids, status, **kwargs):
+    kpis.record_orders_reaching(order_ids, status)
+
+
+@receiver(post_init, sender=Route)
+def remember_route_status(sender, instance, **kwargs):
+    instance._kpi_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Route)
+def update_route_kpis(sender, instance, created, raw=False, **kwargs):
+    if raw or not (created or 'status' in instance.__dict__):
+        return
+    kpis.record_route_change(instance, None if created else instance._kpi_status)
+    instance._kpi_status = instance.status
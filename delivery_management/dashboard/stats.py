@@ -0,0 +1,76 @@
+"""Dashboard statistics, computed with one aggregate query per table and cached briefly
+
+Every count of a table comes from a single conditional aggregation
+(``Count(filter=Q(...))``) instead of one COUNT query each. The result is
+cached for DASHBOARD_STATS['TTL'] seconds. The ``signals`` handlers drop
+it when orders, routes, trucks or users change, but only in the cache of
+the process that made the change: with the default per-process
+LocMemCache, other workers keep serving their copy until the TTL runs
+out. Point CACHE_ALIAS at a shared backend (Redis, Memcached, database)
+for changes to show everywhere at once; otherwise figures can be up to
+TTL seconds stale. Delivery
+outcomes come from the DeliveryKPI rollup (see ``kpis``) rather than from
+scanning orders.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q, Sum
+
+from accounts.models import User
+from deliveries.models import DeliveryOrder, Route, Truck
+from .models import DeliveryKPI
+
+DEFAULT_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 60,
+}
+
+ADMIN_STATS_KEY = 'dashboard:admin-stats'
+
+
+def get_stats_settings() -> dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'DASHBOARD_STATS', {})}
+
+
+def compute_admin_stats() -> dict:
+    """Counts for the admin dashboard: five queries, one per table"""
+    orders = DeliveryOrder.objects.aggregate(
+        total_orders=Count('pk'),
+        pending_orders=Count('pk', filter=Q(status='pending')),
+    )
+    routes = Route.objects.aggregate(active_routes=Count('pk', filter=Q(status='active')))
+    drivers = User.objects.aggregate(total_drivers=Count('pk', filter=Q(role='driver')))
+    trucks = Truck.objects.aggregate(total_trucks=Count('pk', filter=Q(is_active=True)))
+
+    outcomes = DeliveryKPI.objects.filter(dimension='all').aggregate(
+        delivered=Sum('delivered'), failed=Sum('failed'),
+        timed=Sum('timed_deliveries'), lead_minutes=Sum('lead_minutes'),
+    )
+
+    delivered, failed = outcomes['delivered'] or 0, outcomes['failed'] or 0
+    attempted = delivered + failed
+    return {
+        **orders, **routes, **drivers, **trucks,
+        'delivered_orders': delivered,
+        'delivery_success_rate': round(delivered / attempted * 100 if attempted else 0, 1),
+        'avg_delivery_time': format_hours(outcomes['lead_minutes'] / outcomes['timed']) if outcomes['timed'] else None,
+    }
+
+
+def format_hours(minutes: float) -> str:
+    return f"{minutes / 60:.1f} hours"
+
+
+def admin_stats() -> dict:
+    """The admin dashboard counts, from the stats cache when fresh"""
+    config = get_stats_settings()
+    cache = caches[config['CACHE_ALIAS']]
+    stats = cache.get(ADMIN_STATS_KEY)
+    if stats is None:
+        stats = compute_admin_stats()
+        cache.set(ADMIN_STATS_KEY, stats, config['TTL'])
+    return stats
+
+
+def invalidate_admin_stats():
+    caches[get_stats_settings()['CACHE_ALIAS']].delete(ADMIN_STATS_KEY)
@@ -1,3 +1,211 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from deliveries.models import Customer, DeliveryOrder, Route, RouteStop, Truck
+from deliveries.signals import order_status_changed
+from routes.providers import HaversineProvider
+from routes.cache import DistanceCache
+from routes.incremental import RouteEditor
+from routes.services import RouteOptimizationService
+
+from . import kpis
+from .models import DeliveryKPI
+from .stats import admin_stats, compute_admin_stats
+
+
+class AdminStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user('admin', password='x', role='admin')
+        self.driver = User.objects.create_user('driver', password='x', role='driver')
+        self.truck = Truck.objects.create(license_plate='B-DM-1', driver=self.driver)
+        customer = Customer.objects.create(address='Alexanderplatz', latitude=52.52, longitude=13.41, phone='1')
+        self.orders = [
+            DeliveryOrder.objects.create(
+                order_number=f'ORD-{i}', customer=customer, weight_kg=100, status=status,
+                pickup_address='Pickup', pickup_latitude=52.50, pickup_longitude=13.38 + i * 0.01,
+                delivery_address='Delivery', delivery_latitude=52.53, delivery_longitude=13.42,
+                requested_delivery_date=date(2025, 7, 1)
+            )
+            for i, status in enumerate(['pending', 'pending', 'delivered', 'failed'])
+        ]
+
+    def test_one_query_per_table(self):
+        with self.assertNumQueries(5):
+            stats = compute_admin_stats()
+
+        self.assertEqual(stats['total_orders'], 4)
+        self.assertEqual(stats['pending_orders'], 2)
+        self.assertEqual(stats['total_drivers'], 1)
+        self.assertEqual(stats['total_trucks'], 1)
+        self.assertEqual(stats['delivered_orders'], 1)
+        self.assertEqual(stats['delivery_success_rate'], 50.0)
+
+    def test_stats_are_cached_until_an_order_changes(self):
+        admin_stats()
+        with self.assertNumQueries(0):
+            admin_stats()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.orders[0].status = 'delivered'
+            self.orders[0].save()
+        self.assertEqual(admin_stats()['delivery_success_rate'], 66.7)
+
+    def test_bulk_status_updates_invalidate_the_stats(self):
+        self.assertEqual(admin_stats()['pending_orders'], 2)
+        service = RouteOptimizationService(routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            service._create_routes(date(2025, 7, 1), [('Route', self.truck, self.orders[:2])])
+
+        self.assertEqual(admin_stats()['pending_orders'], 0)
+
+    def test_admin_dashboard_serves_cached_stats(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('dashboard:admin_dashboard'))
+
+        response = self.client.get(reverse('dashboard:admin_dashboard'))
+
+        self.assertEqual(response.context['total_orders'], 4)
+        self.assertEqual(response.context['delivery_success_rate'], 50.0)
+
+
+class DeliveryKPITests(TestCase):
+    def setUp(self):
+        self.driver = User.objects.create_user('driver', password='x', role='driver')
+        self.truck = Truck.objects.create(license_plate='B-DM-1', driver=self.driver)
+        self.customer = Customer.objects.create(address='Alexanderplatz', latitude=52.52, longitude=13.41, phone='1')
+        self.day = date(2025, 7, 1)
+        self.orders = [
+            DeliveryOrder.objects.create(
+                order_number=f'ORD-{i}', customer=self.customer, weight_kg=100,
+                pickup_address='Pickup', pickup_latitude=52.50, pickup_longitude=13.38,
+                delivery_address='Delivery', delivery_latitude=52.53, delivery_longitude=13.42,
+                requested_delivery_date=self.day
+            )
+            for i in range(3)
+        ]
+        self.route = Route.objects.create(name='Route', truck=self.truck, driver=self.driver, date=self.day,
+                                          total_distance_km=Decimal('12.50'))
+        for number, order in enumerate(self.orders[:2], 1):
+            RouteStop.objects.create(route=self.route, delivery_order=order, stop_number=number)
+
+    def kpi(self, dimension='all', key=0):
+        return DeliveryKPI.objects.get(date=self.day, dimension=dimension, key=key)
+
+    def deliver(self, order, delivered_at):
+        order.status = 'delivered'
+        order.actual_delivery_time = delivered_at
+        order.save()
+
+    def test_status_transitions_move_counts(self):
+        order = self.orders[0]
+        delivered_at = order.created_at + timedelta(hours=3)
+        self.deliver(order, delivered_at)
+
+        for dimension, key in [('all', 0), ('truck', self.truck.id), ('driver', self.driver.id),
+                               ('customer', self.customer.id)]:
+            row = self.kpi(dimension, key)
+            self.assertEqual(row.delivered, 1)
+            self.assertAlmostEqual(row.avg_lead_minutes, 180)
+        end_of_day = timezone.make_aware(datetime(2025, 7, 2))
+        self.assertAlmostEqual(self.kpi().avg_delay_minutes, (delivered_at - end_of_day).total_seconds() / 60)
+
+        # Re-reading the order and moving it back out of 'delivered' undoes the count
+        order = DeliveryOrder.objects.get(pk=order.pk)
+        order.status = 'failed'
+        order.save()
+        row = self.kpi()
+        self.assertEqual((row.delivered, row.failed, row.timed_deliveries), (0, 1, 0))
+        self.assertAlmostEqual(row.lead_minutes, 0)
+
+    def test_bulk_cancellation_counts_through_the_signal(self):
+        ids = [order.id for order in self.orders]
+        DeliveryOrder.objects.filter(id__in=ids).update(status='cancelled')
+        order_status_changed.send(sender=DeliveryOrder, order_ids=ids, status='cancelled')
+
+        self.assertEqual(self.kpi().cancelled, 3)
+        self.assertEqual(self.kpi('truck', self.truck.id).cancelled, 2)
+        self.assertEqual(self.kpi('customer', self.customer.id).cancelled, 3)
+
+    def test_repeated_or_late_cancellations_are_not_counted_again(self):
+        editor = RouteEditor(RouteOptimizationService(routing_provider=HaversineProvider(), distance_cache=DistanceCache()))
+        stale = DeliveryOrder.objects.get(pk=self.orders[2].pk)
+        editor.cancel_order(self.orders[2])
+        with self.assertRaises(ValueError):
+            editor.cancel_order(self.orders[2])
+        # A copy loaded before the first cancellation still reads 'pending'
+        editor.cancel_order(stale)
+        self.assertEqual(self.kpi().cancelled, 1)
+
+        self.deliver(self.orders[1], self.orders[1].created_at + timedelta(hours=1))
+        with self.assertRaises(ValueError):
+            editor.cancel_order(self.orders[1])
+        row = self.kpi()
+        self.assertEqual((row.delivered, row.cancelled), (1, 1))
+        self.assertEqual(DeliveryOrder.objects.get(pk=self.orders[1].pk).status, 'delivered')
+
+    def test_completed_routes_add_their_distance(self):
+        self.route.status = 'completed'
+        self.route.save()
+        self.assertEqual(self.kpi('driver', self.driver.id).route_km, Decimal('12.50'))
+
+        self.route.status = 'active'
+        self.route.save()
+        self.assertEqual(self.kpi().route_km, Decimal('0'))
+
+    def test_rebuild_matches_incremental_rollup(self):
+        self.deliver(self.orders[0], self.orders[0].created_at + timedelta(hours=2))
+        self.orders[1].status = 'failed'
+        self.orders[1].save()
+        self.route.status = 'completed'
+        self.route.save()
+        fields = ['date', 'dimension', 'key', 'delivered', 'failed', 'cancelled', 'timed_deliveries', 'route_km']
+        incremental = sorted(DeliveryKPI.objects.values_list(*fields))
+
+        # Orders, routes, then delete and insert inside a savepoint
+        with self.assertNumQueries(6):
+            self.assertEqual(kpis.rebuild(), len(incremental))
+
+        self.assertEqual(sorted(DeliveryKPI.objects.values_list(*fields)), incremental)
+        self.assertAlmostEqual(self.kpi().lead_minutes, 120)
+
+
+class DriverDashboardTests(TestCase):
+    def setUp(self):
+        self.driver = User.objects.create_user('driver', password='x', role='driver')
+        self.truck = Truck.objects.create(license_plate='B-DM-1', driver=self.driver)
+        self.customer = Customer.objects.create(address='Alexanderplatz', latitude=52.52, longitude=13.41, phone='1')
+        self.client.force_login(self.driver)
+
+    def add_route(self, completed, pending):
+        route = Route.objects.create(name='Route', truck=self.truck, driver=self.driver, date=timezone.now().date())
+        for number in range(completed + pending):
+            order = DeliveryOrder.objects.create(
+                order_number=f'ORD-{route.id}-{number}', customer=self.customer, weight_kg=100,
+                pickup_address='Pickup', pickup_latitude=52.50, pickup_longitude=13.38,
+                delivery_address='Delivery', delivery_latitude=52.53, delivery_longitude=13.42,
+                requested_delivery_date=route.date
+            )
+            RouteStop.objects.create(route=route, delivery_order=order, stop_number=number + 1,
+                                     is_completed=number < completed)
+
+    def test_query_count_does_not_grow_with_routes(self):
+        self.add_route(completed=1, pending=2)
+        for _ in range(3):
+            self.add_route(completed=2, pending=1)
+
+        # Session, user, routes with counts, stops with their orders
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('dashboard:driver_dashboard'))
 
-# Create your tests here.
+        self.assertEqual(response.context['completed_deliveries'], 7)
+        self.assertEqual(response.context['pending_deliveries'], 5)
+        self.assertEqual([route.stop_count for route in response.context['my_routes']], [3, 3, 3, 3])
+        self.assertContains(response, 'ORD-', count=12)
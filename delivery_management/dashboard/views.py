@@ -8,6 +8,7 @@ from datetime import timedelta
 from accounts.decorators import role_required, admin_required, manager_required, driver_required
 from deliveries.models import DeliveryOrder, Route, Truck
 from accounts.models import User
+from .stats import admin_stats
 
 class DashboardView(LoginRequiredMixin, TemplateView):
     def get(self, request, *args, **kwargs):
@@ -36,34 +37,16 @@ class AdminDashboardView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         today = timezone.now().date()
         
-        # Statistics
+        # Statistics (cached; also holds delivery_success_rate and avg_delivery_time)
+        context.update(admin_stats())
         context.update({
-            'total_orders': DeliveryOrder.objects.count(),
-            'pending_orders': DeliveryOrder.objects.filter(status='pending').count(),
-            'active_routes': Route.objects.filter(status='active').count(),
-            'total_drivers': User.objects.filter(role='driver').count(),
-            'total_trucks': Truck.objects.filter(is_active=True).count(),
-            
             # Recent orders
             'recent_orders': DeliveryOrder.objects.order_by('-created_at')[:10],
             
             # Today's routes
             'todays_routes': Route.objects.filter(date=today),
-            
-            # Performance metrics
-            'delivery_success_rate': self.get_delivery_success_rate(),
-            'avg_delivery_time': self.get_avg_delivery_time(),
         })
         return context
-    
-    def get_delivery_success_rate(self):
-        total = DeliveryOrder.objects.count()
-        delivered = DeliveryOrder.objects.filter(status='delivered').count()
-        return round((delivered / total * 100) if total > 0 else 0, 1)
-    
-    def get_avg_delivery_time(self):
-        # Calculate average delivery time logic here
-        return "2.5 hours"  # Placeholder
 
 class ManagerDashboardView(LoginRequiredMixin, TemplateView):
     template_name = 'dashboard/manager_dashboard.html'
@@ -97,16 +80,15 @@ class DriverDashboardView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         today = timezone.now().date()
         
-        # Get driver's routes
-        my_routes = Route.objects.filter(
-            driver=self.request.user,
-            date=today
+        # Get driver's routes, with stop counts and stops loaded up front
+        my_routes = list(
+            Route.objects.filter(driver=self.request.user, date=today).with_stop_counts().with_stops()
         )
         
         context.update({
             'my_routes': my_routes,
-            'completed_deliveries': sum(route.stops.filter(is_completed=True).count() for route in my_routes),
-            'pending_deliveries': sum(route.stops.filter(is_completed=False).count() for route in my_routes),
+            'completed_deliveries': sum(route.completed_stops for route in my_routes),
+            'pending_deliveries': sum(route.pending_stops for route in my_routes),
         })
         return context
 
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deliveries', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryorder',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('assigned', 'Assigned'), ('in_transit', 'In Transit'), ('delivered', 'Delivered'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], db_index=True, default='pending', max_length=20),
+        ),
+    ]
@@ -1,9 +1,22 @@
+from functools import cached_property
+from typing import Tuple
+
 from django.db import models
+from django.db.models import FloatField
+from django.db.models.functions import Cast
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 User = get_user_model()
 
+Coordinate = Tuple[float, float]
+
+
+def as_float(field: str) -> Cast:
+    """A DecimalField read as a float by the database, so no Decimal is built for it"""
+    return Cast(field, FloatField())
+
+
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
     company_name = models.CharField(max_length=200, blank=True)
@@ -38,6 +51,8 @@ class DeliveryOrder(models.Model):
         ('failed', 'Failed'),
         ('cancelled', 'Cancelled'),
     ]
+    # Statuses an order does not leave through planning or route edits
+    FINAL_STATUSES = ('delivered', 'failed', 'cancelled')
     
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -50,7 +65,7 @@ class DeliveryOrder(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     weight_kg = models.IntegerField(validators=[MinValueValidator(1)])
     priority = models.CharField(max_length=10, choices=PRIORITY_CHOICES, default='normal')
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', db_index=True)
     
     pickup_address = models.TextField()
     pickup_latitude = models.DecimalField(max_digits=10, decimal_places=8)
@@ -70,6 +85,34 @@ class DeliveryOrder(models.Model):
     
     def __str__(self):
         return f"Order {self.order_number}"
+    
+    # Converted once per instance: the optimizer and the map read them in tight loops
+    @cached_property
+    def pickup_point(self) -> Coordinate:
+        return float(self.pickup_latitude), float(self.pickup_longitude)
+    
+    @cached_property
+    def delivery_point(self) -> Coordinate:
+        return float(self.delivery_latitude), float(self.delivery_longitude)
+
+class RouteQuerySet(models.QuerySet):
+    def with_stop_counts(self):
+        """Annotate stop_count, completed_stops and pending_stops, counted in the same query"""
+        return self.annotate(
+            stop_count=models.Count('stops'),
+            completed_stops=models.Count('stops', filter=models.Q(stops__is_completed=True)),
+            pending_stops=models.Count('stops', filter=models.Q(stops__is_completed=False)),
+        )
+
+    def with_load(self):
+        """Annotate total_weight_kg, the summed weight of the route's orders (None without stops)"""
+        return self.annotate(total_weight_kg=models.Sum('stops__delivery_order__weight_kg'))
+
+    def with_stops(self):
+        """Load truck and driver with the routes, and their stops with orders in one more query"""
+        stops = RouteStop.objects.select_related('delivery_order')
+        return self.select_related('truck', 'driver').prefetch_related(models.Prefetch('stops', queryset=stops))
+
 
 class Route(models.Model):
     name = models.CharField(max_length=100)
@@ -86,6 +129,8 @@ class Route(models.Model):
         ('cancelled', 'Cancelled'),
     ], default='planned')
     created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = RouteQuerySet.as_manager()
     
     def __str__(self):
         return f"Route {self.name} - {self.date}"
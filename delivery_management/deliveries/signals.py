@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+# Sent with sender=DeliveryOrder, order_ids and status after statuses are
+# changed with a queryset update(), which does not send post_save. Such
+# updates leave orders in DeliveryOrder.FINAL_STATUSES alone, so receivers can
+# take every order in order_ids to come from a non-final status.
+order_status_changed = Signal()
@@ -136,3 +136,68 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.User'
+
+
+# Route optimization
+# Where road distances come from. BACKEND is 'osrm' (a self-hosted OSRM server
+# at URL), 'matrix_file' (a matrix saved under MATRIX_PATH, haversine for
+# coordinates it does not cover) or 'haversine' (straight-line estimates).
+# PRECOMPUTED_MATRIX_PATH is where manage.py build_distance_matrix writes road
+# distances between the depots and every active customer; the optimizer reads
+# them from there and only asks BACKEND for coordinates the matrix lacks.
+
+ROUTING_PROVIDER = {
+    'BACKEND': 'osrm',
+    'URL': 'http://localhost:5000',
+    'PROFILE': 'driving',
+    'MAX_TABLE_SIZE': 100,
+    'CONCURRENCY': 8,  # simultaneous requests per process
+    'TIMEOUT': 10,
+    'RETRIES': 2,
+    'MATRIX_PATH': None,
+    'PRECOMPUTED_MATRIX_PATH': None,
+}
+
+# Road distances are cached in-process (LRU) and in a persistent tier so that
+# repeat optimization runs over the same customers skip the routing server.
+# BACKEND is 'database' (routes.DistanceCacheRow), 'django_cache' (uses
+# CACHE_ALIAS) or None for the in-process tier only.
+
+ROUTING_DISTANCE_CACHE = {
+    'BACKEND': 'database',
+    'CACHE_ALIAS': 'default',
+    'PRECISION': 5,  # decimal places of lat/lon in cache keys (~1 m)
+    'TTL': 7 * 24 * 60 * 60,
+    'MAX_ENTRIES': 4000000,  # cells kept in process (~32 bytes each); a 1000-order day is ~4M
+}
+
+# Depots used by batch planning (manage.py plan_routes), name -> (lat, lon)
+
+ROUTING_DEPOTS = {
+    'berlin': (52.5200, 13.4050),
+}
+
+# Dashboard counts are cached for TTL seconds in CACHE_ALIAS. Changes drop the
+# cached counts only in the cache they can reach: with a per-process cache such
+# as the default LocMemCache, other workers show counts up to TTL seconds old.
+
+DASHBOARD_STATS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 60,
+}
+
+# Rendered route maps are cached in CACHE_ALIAS under a digest of the route's
+# stops, so a changed route gets a new entry; TTL only clears out old ones.
+
+ROUTE_MAPS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 24 * 3600,
+}
+
+# Optimization runs started from the web are executed by a local process pool
+# so requests return immediately. EAGER runs them inline instead.
+
+ROUTE_OPTIMIZATION_JOBS = {
+    'WORKERS': 2,
+    'EAGER': False,
+}
@@ -28,6 +28,7 @@ urlpatterns = [
     path('accounts/', include('allauth.urls')),
     path('accounts/profile/', accounts_views.profile, name='profile'),
     path('deliveries/', include('deliveries.urls')),
+    path('routes/', include('routes.urls')),
     path('dashboard/', include('dashboard.urls', namespace='dashboard')),
     path('', RedirectView.as_view(url='/deliveries/', permanent=True)),
 ]
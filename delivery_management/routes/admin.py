@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import OptimizationRun
+
+
+@admin.register(OptimizationRun)
+class OptimizationRunAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'date', 'routing_provider', 'order_count', 'route_count', 'total_distance_km',
+        'duration_seconds', 'routing_calls', 'cache_hits', 'haversine_fallbacks', 'query_count', 'created_at'
+    )
+    list_filter = ('routing_provider', 'date')
+    date_hierarchy = 'created_at'
+    filter_horizontal = ('routes',)
+    readonly_fields = [field.name for field in OptimizationRun._meta.concrete_fields]
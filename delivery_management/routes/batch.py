@@ -0,0 +1,119 @@
+"""Multi-process route planning across several dates and depots
+
+The work is split into one partition per (date, depot). Each worker plans
+its partition like a single run: it fetches only the candidate cells among
+its own depot and order locations, through the precomputed matrix and the
+process-wide distance cache, so partitions share cells a persistent cache
+already holds and never fetch cells between each other's orders.
+"""
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import django
+import numpy as np
+from django.conf import settings
+
+from deliveries.models import DeliveryOrder, Truck
+from .distance import haversine_matrix
+from .providers import get_routing_provider
+from .records import order_records
+from .services import RouteOptimizationService
+
+Depot = Tuple[float, float]
+
+
+def get_depots() -> Dict[str, Depot]:
+    """Depots from the ROUTING_DEPOTS setting, defaulting to the service's factory"""
+    depots = getattr(settings, 'ROUTING_DEPOTS', None)
+    if not depots:
+        return {'factory': RouteOptimizationService().factory_location}
+    return {name: tuple(location) for name, location in depots.items()}
+
+
+def assign_depots(orders: List[DeliveryOrder], depots: Dict[str, Depot]) -> Dict[str, List[DeliveryOrder]]:
+    """Give every order to the depot nearest to its pickup"""
+    names = list(depots)
+    pickups = np.array([order.pickup_point for order in orders], dtype=float).reshape(-1, 2)
+    nearest = haversine_matrix(pickups, np.array([depots[name] for name in names])).argmin(axis=1)
+
+    assigned = defaultdict(list)
+    for order, depot in zip(orders, nearest.tolist()):
+        assigned[names[depot]].append(order)
+    return assigned
+
+
+def build_partitions(dates: Iterable[date], depots: Dict[str, Depot]) -> List[dict]:
+    """Split pending orders into (date, depot) partitions with their share of the fleet
+
+    Trucks have no home depot, so active trucks are dealt out round-robin by
+    id; every date gets the whole fleet.
+    """
+    trucks = list(Truck.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+    fleet = {name: trucks[i::len(depots)] for i, name in enumerate(depots)}
+
+    orders = DeliveryOrder.objects.filter(requested_delivery_date__in=list(dates), status='pending').order_by('id')
+    by_date = defaultdict(list)
+    for order in order_records(orders):
+        by_date[order.requested_delivery_date].append(order)
+
+    partitions = []
+    for day in sorted(by_date):
+        for name, depot_orders in assign_depots(by_date[day], depots).items():
+            partitions.append({
+                'date': day,
+                'depot': name,
+                'location': depots[name],
+                'truck_ids': fleet[name],
+                'orders': depot_orders,
+            })
+    return partitions
+
+
+def plan_partition(task: dict) -> Tuple[date, str, List[int]]:
+    """Worker entry point: optimize one (date, depot) partition"""
+    trucks_by_id = Truck.objects.in_bulk(task['truck_ids'])
+    trucks = [trucks_by_id[truck_id] for truck_id in task['truck_ids'] if truck_id in trucks_by_id]
+    orders = order_records(DeliveryOrder.objects.filter(id__in=task['order_ids']).order_by('id'))
+
+    optimizer = RouteOptimizationService(
+        factory_location=task['location'],
+        routing_provider=get_routing_provider(task['routing_backend'])
+    )
+    routes = optimizer.optimize_daily_routes(task['date'], trucks, orders)
+    return task['date'], task['depot'], [route.id for route in routes]
+
+
+def plan_batch(dates: Iterable[date], depots: Optional[Dict[str, Depot]] = None, workers: Optional[int] = None,
+               routing_backend: Optional[str] = None) -> Dict[Tuple[date, str], List[int]]:
+    """Plan every (date, depot) partition in a process pool; returns created route ids per partition
+
+    ``routing_backend`` overrides the BACKEND of the ROUTING_PROVIDER setting.
+    """
+    depots = depots or get_depots()
+    partitions = [p for p in build_partitions(dates, depots) if p['truck_ids'] and p['orders']]
+    if not partitions:
+        return {}
+
+    tasks = [
+        {
+            'date': p['date'],
+            'depot': p['depot'],
+            'location': p['location'],
+            'truck_ids': p['truck_ids'],
+            'order_ids': [order.id for order in p['orders']],
+            'routing_backend': routing_backend,
+        }
+        for p in partitions
+    ]
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup
+    ) as executor:
+        for day, depot, route_ids in executor.map(plan_partition, tasks):
+            results[(day, depot)] = route_ids
+    return results
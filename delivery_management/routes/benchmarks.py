@@ -0,0 +1,353 @@
+"""Synthetic benchmarks for the route optimizer
+
+Run them through ``python manage.py benchmark_merge`` (merge step only),
+``python manage.py benchmark_optimizer`` (every phase against the database)
+and ``python manage.py benchmark_coordinates`` (loading order coordinates).
+"""
+import json
+import math
+import random
+import time
+import tracemalloc
+from datetime import date
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from deliveries.models import Customer, DeliveryOrder, Truck
+from .cache import DistanceCache
+from .merging import RouteMerger
+from .providers import HaversineProvider
+from .records import order_records
+from .services import RouteOptimizationService
+
+BERLIN = (52.5200, 13.4050)
+
+# The capacity the original optimizer assumed for every truck
+LEGACY_TRUCK_CAPACITY = 1500
+
+# Order sets the optimizer is benchmarked on:
+# uniform    - locations and weights spread evenly over the Berlin area
+# clustered  - locations around a handful of hotspots (districts, industrial parks)
+# heavy_tail - uniform locations, Pareto weights: mostly parcels, a few pallets
+DISTRIBUTIONS = ('uniform', 'clustered', 'heavy_tail')
+
+# Differences below these are measurement noise, not regressions
+NOISE_FLOOR = {'seconds': 0.01, 'peak_kb': 1024, 'queries': 0}
+
+
+def synthetic_orders(count: int, seed: int = 0) -> List[SimpleNamespace]:
+    """Orders with pickups and deliveries scattered around Berlin"""
+    rng = random.Random(seed)
+    orders = []
+    for i in range(count):
+        pickup = (BERLIN[0] + rng.uniform(-0.15, 0.15), BERLIN[1] + rng.uniform(-0.25, 0.25))
+        delivery = (BERLIN[0] + rng.uniform(-0.15, 0.15), BERLIN[1] + rng.uniform(-0.25, 0.25))
+        orders.append(SimpleNamespace(
+            id=i + 1,
+            weight_kg=rng.randint(10, 100),
+            pickup_latitude=pickup[0],
+            pickup_longitude=pickup[1],
+            delivery_latitude=delivery[0],
+            delivery_longitude=delivery[1],
+            pickup_point=pickup,
+            delivery_point=delivery,
+        ))
+    return orders
+
+
+def synthetic_trucks(count: int, capacity_kg: int = 1500) -> List[SimpleNamespace]:
+    return [SimpleNamespace(id=i + 1, capacity_kg=capacity_kg, driver=None) for i in range(count)]
+
+
+def legacy_merge_routes(routes, sorted_pairs, trucks, truck_capacity):
+    """The original list-scanning merge step, kept as a benchmark reference"""
+    truck_assignments = []
+    truck_utilization = {truck.id: 0 for truck in trucks}
+
+    for route in routes:
+        route_weight = sum(order.weight_kg for order in route)
+        for truck in trucks:
+            if truck_utilization[truck.id] + route_weight <= truck_capacity:
+                truck_assignments.append((route, truck))
+                truck_utilization[truck.id] += route_weight
+                break
+        else:
+            truck_assignments.append((route, None))
+
+    for order1_id, order2_id in sorted_pairs:
+        route1_idx, route2_idx = None, None
+        for i, (route, _) in enumerate(truck_assignments):
+            if any(order.id == order1_id for order in route):
+                route1_idx = i
+            if any(order.id == order2_id for order in route):
+                route2_idx = i
+
+        if route1_idx == route2_idx or route1_idx is None or route2_idx is None:
+            continue
+
+        route1, truck1 = truck_assignments[route1_idx]
+        route2, truck2 = truck_assignments[route2_idx]
+        if truck1 and truck2 and truck1.id == truck2.id:
+            combined_weight = sum(order.weight_kg for order in route1) + sum(order.weight_kg for order in route2)
+            if combined_weight <= truck1.capacity_kg:
+                truck_assignments[route1_idx] = (route1 + route2, truck1)
+                truck_assignments.pop(route2_idx)
+
+    return truck_assignments
+
+
+def compare_merge(count: int, trucks: int = None, seed: int = 0, include_legacy: bool = True) -> Dict[str, Dict]:
+    """Time the indexed merge against the legacy one on the same savings"""
+    orders = synthetic_orders(count, seed)
+    if trucks is None:
+        trucks = math.ceil(sum(order.weight_kg for order in orders) / 1500) + 1
+    fleet = synthetic_trucks(trucks)
+
+    service = RouteOptimizationService(routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+    merger = RouteMerger([[order] for order in orders], fleet)
+    firsts, seconds, values = service._calculate_savings_matrix(orders, groups=merger.truck_groups())
+    ranking = np.argsort(-values, kind='stable')
+    pairs: List[Tuple[int, int]] = list(zip(firsts[ranking].tolist(), seconds[ranking].tolist()))
+
+    results = {}
+
+    started = time.perf_counter()
+    merger.merge_all(pairs)
+    indexed = merger.routes()
+    results['indexed'] = {
+        'seconds': time.perf_counter() - started,
+        'routes': sum(1 for _, truck in indexed if truck),
+        'km': sum(service._route_distance(route) for route, truck in indexed if truck),
+    }
+
+    if include_legacy:
+        started = time.perf_counter()
+        legacy = legacy_merge_routes([[order] for order in orders], pairs, fleet, LEGACY_TRUCK_CAPACITY)
+        results['legacy'] = {
+            'seconds': time.perf_counter() - started,
+            'routes': sum(1 for _, truck in legacy if truck),
+            'km': sum(service._route_distance(route) for route, truck in legacy if truck),
+        }
+
+    results['pairs'] = len(pairs)
+    return results
+
+
+def _location_sampler(rng: random.Random, distribution: str) -> Callable[[], Tuple[float, float]]:
+    if distribution == 'clustered':
+        hotspots = [
+            (BERLIN[0] + rng.uniform(-0.12, 0.12), BERLIN[1] + rng.uniform(-0.2, 0.2)) for _ in range(8)
+        ]
+
+        def sample():
+            lat, lon = rng.choice(hotspots)
+            return lat + rng.gauss(0, 0.01), lon + rng.gauss(0, 0.015)
+    else:
+        def sample():
+            return BERLIN[0] + rng.uniform(-0.15, 0.15), BERLIN[1] + rng.uniform(-0.25, 0.25)
+    return sample
+
+
+def _weight_sampler(rng: random.Random, distribution: str) -> Callable[[], int]:
+    if distribution == 'heavy_tail':
+        # Capped well below a truck load so every order still fits somewhere
+        return lambda: min(int(10 * rng.paretovariate(1.5)), 800)
+    return lambda: rng.randint(10, 100)
+
+
+def generate_customers(count: int, seed: int = 0, distribution: str = 'uniform') -> List[Customer]:
+    """Insert ``count`` customers placed according to the distribution"""
+    rng = random.Random(seed)
+    sample = _location_sampler(rng, distribution)
+    customers = []
+    for i in range(count):
+        lat, lon = sample()
+        customers.append(Customer(
+            company_name=f"Benchmark Customer {i + 1}",
+            address=f"Benchmark Street {i + 1}, Berlin",
+            latitude=round(lat, 8),
+            longitude=round(lon, 8),
+            phone='000'
+        ))
+    return Customer.objects.bulk_create(customers, batch_size=500)
+
+
+def generate_orders(count: int, customers: List[Customer], seed: int = 0, distribution: str = 'uniform',
+                    requested_date: date = date(2025, 1, 1)) -> List[DeliveryOrder]:
+    """Insert ``count`` pending orders delivering to the given customers
+
+    The same seed and distribution always give the same orders.
+    """
+    rng = random.Random(seed)
+    sample = _location_sampler(rng, distribution)
+    weight = _weight_sampler(rng, distribution)
+    orders = []
+    for i in range(count):
+        customer = rng.choice(customers)
+        lat, lon = sample()
+        orders.append(DeliveryOrder(
+            order_number=f"BENCH-{seed}-{i + 1}",
+            customer=customer,
+            weight_kg=max(1, weight()),
+            priority=rng.choice(['low', 'normal', 'normal', 'high', 'urgent']),
+            pickup_address='Benchmark pickup',
+            pickup_latitude=round(lat, 8),
+            pickup_longitude=round(lon, 8),
+            delivery_address=customer.address,
+            delivery_latitude=customer.latitude,
+            delivery_longitude=customer.longitude,
+            requested_delivery_date=requested_date
+        ))
+    return DeliveryOrder.objects.bulk_create(orders, batch_size=500)
+
+
+def generate_fleet(orders: List[DeliveryOrder], capacities: Tuple[int, ...] = (3500, 1500, 1000),
+                   spare: int = 1) -> List[Truck]:
+    """Insert trucks cycling through ``capacities`` until they hold the total order weight, plus ``spare`` more"""
+    total = sum(order.weight_kg for order in orders)
+    sizes = []
+    while sum(sizes) < total:
+        sizes.append(capacities[len(sizes) % len(capacities)])
+    sizes += [capacities[(len(sizes) + i) % len(capacities)] for i in range(spare)]
+
+    suffix = random.Random().getrandbits(32)
+    drivers = User.objects.bulk_create([
+        User(username=f"bench-driver-{suffix}-{i}", role='driver', is_active_driver=True) for i in range(len(sizes))
+    ])
+    return Truck.objects.bulk_create([
+        Truck(license_plate=f"BENCH-{suffix:x}-{i}", capacity_kg=capacity, driver=driver)
+        for i, (capacity, driver) in enumerate(zip(sizes, drivers))
+    ])
+
+
+def measure(phase: Callable):
+    """Run ``phase()`` and return (result, {seconds, peak_kb, queries})
+
+    Peak memory is traced with tracemalloc, which slows Python-heavy code
+    down; compare timings against baselines taken the same way.
+    """
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        result = phase()
+        seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'seconds': seconds, 'peak_kb': peak / 1024, 'queries': len(queries)}
+
+
+def benchmark_optimizer(count: int, distribution: str = 'uniform', seed: int = 0,
+                        service: Optional[RouteOptimizationService] = None) -> Dict:
+    """Time each optimizer phase on a generated day of orders
+
+    Everything runs in a transaction that is rolled back, so the database is
+    left as it was. Returns {'phases': {name: stats}, 'routes', 'km'}.
+    """
+    service = service or RouteOptimizationService(routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+    day = date(2025, 1, 1)
+
+    with transaction.atomic():
+        customers = generate_customers(max(10, count // 5), seed, distribution)
+        orders = generate_orders(count, customers, seed, distribution, requested_date=day)
+        trucks = generate_fleet(orders)
+        orders = order_records(DeliveryOrder.objects.filter(id__in=[order.id for order in orders]).order_by('id'))
+
+        phases = {}
+        merger = RouteMerger([[order] for order in orders], trucks)
+        savings, phases['savings'] = measure(
+            lambda: service._calculate_savings_matrix(orders, groups=merger.truck_groups())
+        )
+
+        def merge():
+            merger.use_schedule(service._build_schedule(day, orders))
+            return service._merge_routes(merger, savings)
+
+        merged, phases['merge'] = measure(merge)
+        merged, phases['improve'] = measure(lambda: service._improve_routes(merged, savings, date=day))
+        planned = [
+            (f"Benchmark Route {i + 1}", truck, route_orders)
+            for i, (route_orders, truck) in enumerate(merged)
+            if route_orders and truck
+        ]
+        routes, phases['create_routes'] = measure(lambda: service._create_routes(day, planned))
+
+        result = {
+            'orders': count,
+            'distribution': distribution,
+            'seed': seed,
+            'phases': phases,
+            'routes': len(routes),
+            'km': float(sum(route.total_distance_km for route in routes)),
+        }
+        transaction.set_rollback(True)
+    return result
+
+
+def compare_coordinate_loading(count: int = 10000, seed: int = 0) -> Dict[str, Dict]:
+    """Time loading a day's order coordinates as model instances against ``order_records``
+
+    ``decimals`` is how consumers used to read coordinates: full instances,
+    then float() of every Decimal field. ``points`` reads the instances'
+    float points and ``records`` gets the same numbers from the one
+    values_list query planning runs use, with the floats cast in the
+    database. Rolled back like ``benchmark_optimizer``.
+    """
+    with transaction.atomic():
+        customers = generate_customers(max(10, count // 5), seed)
+        created = generate_orders(count, customers, seed)
+        orders = DeliveryOrder.objects.filter(id__range=(created[0].id, created[-1].id))
+
+        def decimals():
+            loaded = list(orders.all())
+            return (
+                np.array([(float(o.pickup_latitude), float(o.pickup_longitude)) for o in loaded]),
+                np.array([(float(o.delivery_latitude), float(o.delivery_longitude)) for o in loaded]),
+            )
+
+        def points(loaded):
+            return (
+                np.array([order.pickup_point for order in loaded]),
+                np.array([order.delivery_point for order in loaded]),
+            )
+
+        results = {}
+        expected, results['decimals'] = measure(decimals)
+        _, results['points'] = measure(lambda: points(list(orders.all())))
+        arrays, results['records'] = measure(lambda: points(order_records(orders.all())))
+        for name, values in zip(('pickups', 'deliveries'), arrays):
+            assert np.allclose(values, expected[name == 'deliveries']), f"{name} differ"
+        transaction.set_rollback(True)
+    return results
+
+
+def save_baseline(results: List[Dict], path: str):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(results, indent=2, sort_keys=True))
+
+
+def compare_to_baseline(results: List[Dict], baseline: List[Dict], tolerance: float = 0.2) -> List[str]:
+    """Describe every phase metric or route km more than ``tolerance`` worse than the baseline"""
+    previous = {(row['orders'], row['distribution'], row['seed']): row for row in baseline}
+    regressions = []
+    for row in results:
+        before = previous.get((row['orders'], row['distribution'], row['seed']))
+        if before is None:
+            continue
+        label = f"{row['orders']} {row['distribution']}"
+        for phase, stats in row['phases'].items():
+            for metric, value in stats.items():
+                old = before['phases'].get(phase, {}).get(metric)
+                if old is None or value - old <= NOISE_FLOOR.get(metric, 0):
+                    continue
+                if value > old * (1 + tolerance):
+                    regressions.append(f"{label} {phase} {metric}: {old:.3f} -> {value:.3f}")
+        if before['km'] and row['km'] > before['km'] * (1 + tolerance):
+            regressions.append(f"{label} km: {before['km']:.1f} -> {row['km']:.1f}")
+    return regressions
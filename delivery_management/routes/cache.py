@@ -0,0 +1,276 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from .distance import Coordinate
+from .models import DistanceCacheRow
+
+# (start lat, start lon, end lat, end lon) rounded to the cache precision
+CacheKey = Tuple[float, float, float, float]
+# (distance in km, duration in seconds)
+CacheValue = Tuple[float, float]
+
+# Cells from one origin, sorted by destination code; expires is a Unix time
+ROW_DTYPE = np.dtype([('destination', '<i8'), ('distance', '<f8'), ('duration', '<f8'), ('expires', '<f8')])
+
+DEFAULT_SETTINGS = {
+    'BACKEND': 'database',
+    'CACHE_ALIAS': 'default',
+    'PRECISION': 5,
+    'TTL': 7 * 24 * 60 * 60,
+    'MAX_ENTRIES': 4000000,
+}
+
+
+def empty_row() -> np.ndarray:
+    return np.zeros(0, dtype=ROW_DTYPE)
+
+
+class DatabaseDistanceStore:
+    """Persistent tier backed by the DistanceCacheRow table"""
+
+    batch_size = 500
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, np.ndarray]:
+        names = list(names)
+        found = {}
+        for i in range(0, len(names), self.batch_size):
+            rows = DistanceCacheRow.objects.filter(
+                origin__in=names[i:i + self.batch_size],
+                expires_at__gt=timezone.now()
+            ).values_list('origin', 'cells')
+            for name, cells in rows:
+                found[name] = np.frombuffer(cells, dtype=ROW_DTYPE)
+        return found
+
+    def set_many(self, rows: Dict[str, np.ndarray], ttl: int):
+        expires_at = timezone.now() + timedelta(seconds=ttl)
+        DistanceCacheRow.objects.bulk_create(
+            [DistanceCacheRow(origin=name, cells=row.tobytes(), expires_at=expires_at) for name, row in rows.items()],
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=['origin'],
+            update_fields=['cells', 'expires_at']
+        )
+
+
+class DjangoCacheDistanceStore:
+    """Persistent tier backed by a configured Django cache alias"""
+
+    def __init__(self, alias: str):
+        self.cache = caches[alias]
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, np.ndarray]:
+        found = self.cache.get_many(['routes:distance:' + name for name in names])
+        return {key[len('routes:distance:'):]: np.frombuffer(cells, dtype=ROW_DTYPE) for key, cells in found.items()}
+
+    def set_many(self, rows: Dict[str, np.ndarray], ttl: int):
+        self.cache.set_many({'routes:distance:' + name: row.tobytes() for name, row in rows.items()}, timeout=ttl)
+
+
+class DistanceCache:
+    """Road distance cache with an in-process LRU tier in front of a persistent store
+
+    Cells are grouped by origin: the stores hold one row per origin
+    coordinate, a sorted array of (destination, distance, duration,
+    expiry), so a matrix over N coordinates costs N row lookups fetched in
+    bulk rather than N² keys. Coordinates are rounded to ``precision``
+    decimals and encoded as integers for vectorized lookups within a row.
+    ``max_entries`` bounds the cells kept in process, whole rows being
+    evicted least recently used first.
+
+    Only answers that came from the routing server are stored, so haversine
+    fallbacks never hide a distance that could be fetched later.
+    """
+
+    def __init__(self, store=None, precision: int = 5, ttl: int = 7 * 24 * 60 * 60, max_entries: int = 4000000):
+        self.store = store
+        self.precision = precision
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._rows: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+        self._cells = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, start: Coordinate, end: Coordinate) -> CacheKey:
+        p = self.precision
+        return (round(start[0], p), round(start[1], p), round(end[0], p), round(end[1], p))
+
+    def encode(self, points) -> np.ndarray:
+        """Integer codes of (N, 2) lat/lon points at the cache precision"""
+        scale = 10 ** self.precision
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        lat = np.round((points[:, 0] + 90) * scale).astype(np.int64)
+        lon = np.round((points[:, 1] + 180) * scale).astype(np.int64)
+        return lat * (360 * scale + 1) + lon
+
+    def get(self, start: Coordinate, end: Coordinate) -> Optional[CacheValue]:
+        key = self.make_key(start, end)
+        return self.get_many([key]).get(key)
+
+    def set(self, start: Coordinate, end: Coordinate, distance: float, duration: float):
+        self.set_many({self.make_key(start, end): (distance, duration)})
+
+    def get_many(self, keys: Iterable[CacheKey]) -> Dict[CacheKey, CacheValue]:
+        """Look cells up by key, reading each origin's row once"""
+        keys = list(keys)
+        if not keys:
+            return {}
+        table = np.array(keys, dtype=float)
+        origins, destinations = self.encode(table[:, :2]), self.encode(table[:, 2:])
+        rows = self._get_rows(set(origins.tolist()))
+        found = {}
+        now = time.time()
+        for key, origin, destination in zip(keys, origins.tolist(), destinations.tolist()):
+            row = rows[origin]
+            position = np.searchsorted(row['destination'], destination)
+            if position < len(row) and row['destination'][position] == destination and row['expires'][position] > now:
+                found[key] = (float(row['distance'][position]), float(row['duration'][position]))
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, values: Dict[CacheKey, CacheValue]):
+        if not values:
+            return
+        table = np.array([key + value for key, value in values.items()], dtype=float)
+        self._add_cells(self.encode(table[:, :2]), self.encode(table[:, 2:4]), table[:, 4], table[:, 5])
+
+    def load_cells(self, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(distances, durations, found) of the cells from starts[i] to ends[i], given as (N, 2) lat/lon arrays
+
+        The rows of all the origins are read in one bulk lookup.
+        """
+        origins, destinations = self.encode(starts), self.encode(ends)
+        distances, durations = np.zeros(len(origins)), np.zeros(len(origins))
+        found = np.zeros(len(origins), dtype=bool)
+        if not len(origins):
+            return distances, durations, found
+
+        order = np.argsort(origins, kind='stable')
+        starts = np.flatnonzero(np.r_[True, origins[order][1:] != origins[order][:-1]])
+        rows = self._get_rows(set(origins[order][starts].tolist()))
+        now = time.time()
+        for cells in np.split(order, starts[1:]):
+            row = rows[int(origins[cells[0]])]
+            if not len(row):
+                continue
+            positions = np.minimum(np.searchsorted(row['destination'], destinations[cells]), len(row) - 1)
+            hit = (row['destination'][positions] == destinations[cells]) & (row['expires'][positions] > now)
+            cells, positions = cells[hit], positions[hit]
+            distances[cells], durations[cells] = row['distance'][positions], row['duration'][positions]
+            found[cells] = True
+
+        with self._lock:
+            self.hits += int(found.sum())
+            self.misses += len(found) - int(found.sum())
+        return distances, durations, found
+
+    def save_cells(self, starts: np.ndarray, ends: np.ndarray, distances: np.ndarray, durations: np.ndarray):
+        """Store cells answered by the routing server, from starts[i] to ends[i]"""
+        self._add_cells(self.encode(starts), self.encode(ends), np.asarray(distances), np.asarray(durations))
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': self._cells}
+
+    def clear(self):
+        """Drop the in-process tier and reset counters; the persistent store is kept"""
+        with self._lock:
+            self._rows.clear()
+            self._cells = 0
+            self.hits = self.misses = 0
+
+    def _name(self, origin: int) -> str:
+        return f'{self.precision}:{origin}'
+
+    def _get_rows(self, origins: Set[int]) -> Dict[int, np.ndarray]:
+        """Rows of the origins from the LRU tier, the rest from the store in one bulk read"""
+        found, missing = {}, []
+        with self._lock:
+            for origin in origins:
+                row = self._rows.get(origin)
+                if row is not None:
+                    self._rows.move_to_end(origin)
+                    found[origin] = row
+                else:
+                    missing.append(origin)
+        if missing:
+            stored = self.store.get_many([self._name(origin) for origin in missing]) if self.store is not None else {}
+            # Origins without a stored row are remembered empty, so saving to them needs no read
+            loaded = {origin: stored.get(self._name(origin), empty_row()) for origin in missing}
+            self._remember(loaded)
+            found.update(loaded)
+        return found
+
+    def _add_cells(self, origins: np.ndarray, destinations: np.ndarray, distances: np.ndarray, durations: np.ndarray):
+        """Merge cells into their origins' rows, dropping expired and replaced cells, and write the rows back"""
+        if not len(origins):
+            return
+        now = time.time()
+        cells = np.zeros(len(origins), dtype=ROW_DTYPE)
+        cells['destination'], cells['distance'], cells['duration'] = destinations, distances, durations
+        cells['expires'] = now + self.ttl
+
+        order = np.argsort(origins, kind='stable')
+        origins, cells = origins[order], cells[order]
+        starts = np.flatnonzero(np.r_[True, origins[1:] != origins[:-1]])
+        groups = dict(zip(origins[starts].tolist(), np.split(cells, starts[1:])))
+
+        current = self._get_rows(set(groups))
+        merged = {}
+        for origin, new in groups.items():
+            old = current[origin]
+            combined = np.concatenate([new[::-1], old[old['expires'] > now]])
+            # np.unique keeps the first occurrence: the newest value of each destination
+            _, first = np.unique(combined['destination'], return_index=True)
+            merged[origin] = combined[first]
+        self._remember(merged)
+        if self.store is not None:
+            self.store.set_many({self._name(origin): row for origin, row in merged.items()}, self.ttl)
+
+    def _remember(self, rows: Dict[int, np.ndarray]):
+        with self._lock:
+            for origin, row in rows.items():
+                previous = self._rows.pop(origin, None)
+                if previous is not None:
+                    self._cells -= max(len(previous), 1)
+                self._rows[origin] = row
+                self._cells += max(len(row), 1)
+            while self._cells > self.max_entries and len(self._rows) > 1:
+                _, evicted = self._rows.popitem(last=False)
+                self._cells -= max(len(evicted), 1)
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_distance_cache() -> DistanceCache:
+    """Return the process-wide distance cache configured by ROUTING_DISTANCE_CACHE"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            config = {**DEFAULT_SETTINGS, **getattr(settings, 'ROUTING_DISTANCE_CACHE', {})}
+            if config['BACKEND'] == 'database':
+                store = DatabaseDistanceStore()
+            elif config['BACKEND'] == 'django_cache':
+                store = DjangoCacheDistanceStore(config['CACHE_ALIAS'])
+            else:
+                store = None
+            _shared_cache = DistanceCache(
+                store=store,
+                precision=config['PRECISION'],
+                ttl=config['TTL'],
+                max_entries=config['MAX_ENTRIES']
+            )
+        return _shared_cache
@@ -0,0 +1,255 @@
+import math
+from pathlib import Path
+
+import numpy as np
+from typing import Callable, Iterable, List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371
+FALLBACK_SPEED_KMH = 40
+
+Coordinate = Tuple[float, float]
+# fill_cells(points, rows, columns) -> (distances km, durations s, answered by road) for each cell
+CellFiller = Callable[[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]
+
+
+def haversine_distance(start: Coordinate, end: Coordinate) -> float:
+    """Calculate great-circle distance between two points in km"""
+    lat1, lon1 = math.radians(start[0]), math.radians(start[1])
+    lat2, lon2 = math.radians(end[0]), math.radians(end[1])
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def haversine_matrix(origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+    """Great-circle distances in km between every row of two (N, 2) lat/lon arrays"""
+    return haversine_pairs(origins[:, None, :], destinations[None, :, :])
+
+
+def haversine_pairs(origins: np.ndarray, destinations: np.ndarray) -> np.ndarray:
+    """Great-circle distances in km between matching rows of two (..., 2) lat/lon arrays, broadcasting like numpy"""
+    lat1, lon1 = np.radians(origins[..., 0]), np.radians(origins[..., 1])
+    lat2, lon2 = np.radians(destinations[..., 0]), np.radians(destinations[..., 1])
+
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def haversine_duration(distance_km: float) -> float:
+    """Estimate driving time in seconds for a straight-line distance"""
+    return distance_km / FALLBACK_SPEED_KMH * 3600
+
+
+class DistanceMatrix:
+    """Road distances (km) and durations (s) between a fixed set of coordinates
+
+    A saved matrix holds NaN in cells the routing provider did not answer.
+    """
+
+    def __init__(self, coordinates: Iterable[Coordinate], dtype=float):
+        # Keep first occurrence order so indexes are stable between runs
+        self.coordinates: List[Coordinate] = list(dict.fromkeys(coordinates))
+        self.index = {coord: i for i, coord in enumerate(self.coordinates)}
+        self.points = np.array(self.coordinates, dtype=float).reshape(-1, 2)
+
+        size = len(self.coordinates)
+        self.distances = np.zeros((size, size), dtype=dtype)
+        self.durations = np.zeros((size, size), dtype=dtype)
+
+    @classmethod
+    def from_arrays(cls, coordinates: Iterable[Coordinate], distances: np.ndarray, durations: np.ndarray) -> 'DistanceMatrix':
+        """Wrap existing (possibly memory-mapped) arrays without copying them"""
+        matrix = cls.__new__(cls)
+        matrix.coordinates = [tuple(coord) for coord in coordinates]
+        matrix.index = {coord: i for i, coord in enumerate(matrix.coordinates)}
+        matrix.points = np.array(matrix.coordinates, dtype=float).reshape(-1, 2)
+        matrix.distances = distances
+        matrix.durations = durations
+        return matrix
+
+    def save(self, directory: str):
+        """Write the matrix as .npy files that load() can memory-map"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / 'coordinates.npy', self.points)
+        np.save(directory / 'distances.npy', self.distances)
+        np.save(directory / 'durations.npy', self.durations)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> 'DistanceMatrix':
+        """Open a saved matrix; with ``mmap`` the arrays are read-only and shared between processes"""
+        directory = Path(directory)
+        mode = 'r' if mmap else None
+        return cls.from_arrays(
+            np.load(directory / 'coordinates.npy').tolist(),
+            np.load(directory / 'distances.npy', mmap_mode=mode),
+            np.load(directory / 'durations.npy', mmap_mode=mode)
+        )
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def covers(self, coordinates: Iterable[Coordinate]) -> bool:
+        return all(coord in self.index for coord in coordinates)
+
+    def __contains__(self, coord):
+        return coord in self.index
+
+    def distance(self, start: Coordinate, end: Coordinate) -> float:
+        return float(self.distances[self.index[start], self.index[end]])
+
+    def duration(self, start: Coordinate, end: Coordinate) -> float:
+        return float(self.durations[self.index[start], self.index[end]])
+
+    def copy_from(self, other: 'DistanceMatrix') -> np.ndarray:
+        """Copy the cells between coordinates ``other`` also has; returns the mask of copied road values
+
+        NaN cells are copied too but left out of the mask.
+        """
+        positions = np.array([other.index.get(coord, -1) for coord in self.coordinates], dtype=int)
+        known = np.nonzero(positions >= 0)[0]
+        cells = np.ix_(known, known)
+        source = np.ix_(positions[known], positions[known])
+        self.distances[cells] = other.distances[source]
+        self.durations[cells] = other.durations[source]
+        copied = np.zeros((len(self), len(self)), dtype=bool)
+        copied[cells] = ~np.isnan(self.distances[cells])
+        return copied
+
+    def fill_from(self, fill_cells: CellFiller, missing: Optional[np.ndarray] = None) -> np.ndarray:
+        """Fill the cells flagged in ``missing`` (all by default) with ``fill_cells``; returns a mask of road answers"""
+        size = len(self)
+        if missing is None:
+            missing = np.ones((size, size), dtype=bool)
+        rows, cols = np.nonzero(missing)
+        distances, durations, answered = fill_cells(self.points, rows, cols)
+        self.distances[rows, cols] = distances
+        self.durations[rows, cols] = durations
+        fetched = np.zeros((size, size), dtype=bool)
+        fetched[rows[answered], cols[answered]] = True
+        return fetched
+
+
+def estimate_cells(points: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Great-circle distances and fallback-speed durations from points[rows] to points[cols]"""
+    distances = haversine_pairs(points[rows], points[cols])
+    return distances, haversine_duration(distances)
+
+
+class SparseDistanceMatrix:
+    """Road distances (km) and durations (s) for some of the cells between a fixed set of coordinates
+
+    Only cells given road values with ``set_cells`` are stored, as arrays
+    sorted by cell number (row * size + column), so memory grows with the
+    cells fetched rather than with size². Other cells are read from
+    ``base``, a dense matrix such as the precomputed one, when it covers
+    both coordinates and the cell is not NaN; the rest are estimated from
+    great-circle distances whenever they are read. Small batches of cells
+    are kept apart and merged into the sorted arrays once they add up.
+    """
+
+    def __init__(self, coordinates: Iterable[Coordinate], base: Optional[DistanceMatrix] = None):
+        self.coordinates: List[Coordinate] = list(dict.fromkeys(coordinates))
+        self.index = {coord: i for i, coord in enumerate(self.coordinates)}
+        self.points = np.array(self.coordinates, dtype=float).reshape(-1, 2)
+        self.base = base
+        if base is not None:
+            self._base_positions = np.array([base.index.get(coord, -1) for coord in self.coordinates], dtype=int)
+        self._stored = self._empty()
+        self._recent = self._empty()
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def covers(self, coordinates: Iterable[Coordinate]) -> bool:
+        return all(coord in self.index for coord in coordinates)
+
+    def __contains__(self, coord):
+        return coord in self.index
+
+    @property
+    def stored_cells(self) -> int:
+        return len(self._stored[0]) + len(self._recent[0])
+
+    def lookup(self, rows, cols) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(distances, durations, known) of the cells at ``rows``, ``cols``, which broadcast like numpy indexes
+
+        ``known`` flags cells holding road values; the others are estimates.
+        """
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+        shape, rows, cols = rows.shape, rows.ravel(), cols.ravel()
+        distances, durations = np.zeros(len(rows)), np.zeros(len(rows))
+        known = rows == cols
+        keys = rows * len(self) + cols
+        for stored_keys, stored_distances, stored_durations in (self._recent, self._stored):
+            todo = np.flatnonzero(~known)
+            if len(todo) and len(stored_keys):
+                hit, positions = self._find(stored_keys, keys[todo])
+                cells, positions = todo[hit], positions[hit]
+                distances[cells], durations[cells] = stored_distances[positions], stored_durations[positions]
+                known[cells] = True
+        todo = np.flatnonzero(~known)
+        if len(todo) and self.base is not None:
+            sources, destinations = self._base_positions[rows[todo]], self._base_positions[cols[todo]]
+            covered = (sources >= 0) & (destinations >= 0)
+            cells, sources, destinations = todo[covered], sources[covered], destinations[covered]
+            distances[cells] = self.base.distances[sources, destinations]
+            durations[cells] = self.base.durations[sources, destinations]
+            known[cells] = ~np.isnan(distances[cells])
+        todo = np.flatnonzero(~known)
+        if len(todo):
+            distances[todo], durations[todo] = estimate_cells(self.points, rows[todo], cols[todo])
+        return distances.reshape(shape), durations.reshape(shape), known.reshape(shape)
+
+    def cell(self, row: int, col: int) -> Tuple[float, float, bool]:
+        """(distance, duration, known) of a single cell, like ``lookup`` without the array overhead"""
+        if row == col:
+            return 0.0, 0.0, True
+        key = row * len(self) + col
+        for keys, distances, durations in (self._recent, self._stored):
+            position = int(np.searchsorted(keys, key))
+            if position < len(keys) and keys[position] == key:
+                return float(distances[position]), float(durations[position]), True
+        if self.base is not None:
+            source, destination = self._base_positions[row], self._base_positions[col]
+            if source >= 0 and destination >= 0 and not math.isnan(self.base.distances[source, destination]):
+                return float(self.base.distances[source, destination]), float(self.base.durations[source, destination]), True
+        distance = haversine_distance(self.coordinates[row], self.coordinates[col])
+        return distance, haversine_duration(distance), False
+
+    def distance(self, start: Coordinate, end: Coordinate) -> float:
+        return self.cell(self.index[start], self.index[end])[0]
+
+    def duration(self, start: Coordinate, end: Coordinate) -> float:
+        return self.cell(self.index[start], self.index[end])[1]
+
+    def set_cells(self, rows: np.ndarray, cols: np.ndarray, distances: np.ndarray, durations: np.ndarray):
+        """Store road values for the cells at ``rows``, ``cols``; later values replace earlier ones"""
+        keys = np.asarray(rows, dtype=np.int64) * len(self) + np.asarray(cols, dtype=np.int64)
+        added = (keys, np.asarray(distances, dtype=float), np.asarray(durations, dtype=float))
+        self._recent = self._merge(self._recent, added)
+        if len(self._recent[0]) > max(4096, len(self._stored[0]) // 8):
+            self._stored = self._merge(self._stored, self._recent)
+            self._recent = self._empty()
+
+    @staticmethod
+    def _empty():
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0)
+
+    @staticmethod
+    def _merge(old, new):
+        keys, distances, durations = (np.concatenate([n[::-1], o]) for n, o in zip(new, old))
+        # np.unique keeps the first occurrence: the newest value of each cell
+        keys, first = np.unique(keys, return_index=True)
+        return keys, distances[first], durations[first]
+
+    @staticmethod
+    def _find(sorted_keys: np.ndarray, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return sorted_keys[positions] == keys, positions
+
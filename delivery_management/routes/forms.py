@@ -13,7 +13,7 @@ class ManualOptimizationForm(forms.Form):
         min_value=1,
         max_value=10,
         initial=3,
-        help_text="Number of trucks to use (each with 1500kg capacity)"
+        help_text="Number of active trucks to use, largest first (each carries up to its own capacity)"
     )
     orders = forms.ModelMultipleChoiceField(
         queryset=DeliveryOrder.objects.none(),
@@ -0,0 +1,281 @@
+"""Mid-day changes to planned routes without replanning the whole day
+
+``RouteEditor.insert_order`` puts a new order into the cheapest feasible gap
+of the date's open routes and ``RouteEditor.cancel_order`` takes a cancelled
+order out and resequences what is left of its route. Completed stops are
+never moved and nothing is inserted before them. Only the rows that change
+are written: the new or deleted stop, stops whose number or ETA shifts, the
+route's distance and duration and the order's status.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F
+
+from deliveries.models import DeliveryOrder, Route, RouteStop
+from deliveries.signals import order_status_changed
+from .distance import haversine_pairs
+from .local_search import LocalSearch
+from .services import RouteOptimizationService
+
+OPEN_ROUTE_STATUSES = ('planned', 'active')
+# Orders the editor may put on or take off routes
+EDITABLE_ORDER_STATUSES = ('pending', 'assigned')
+
+
+class RouteEditor:
+    """Cheapest-insertion and removal of single orders on already planned routes
+
+    Insertion gaps are first ranked by straight-line cost, then the best
+    ``candidates`` are priced with road distances in one batched lookup, so
+    an insertion costs a few queries whatever the size of the day.
+    ``resequence_budget`` is the local search time allowed on a route after
+    an order is removed from it.
+    """
+
+    def __init__(self, service: Optional[RouteOptimizationService] = None, candidates: int = 8,
+                 resequence_budget: float = 0.05):
+        self.service = service or RouteOptimizationService()
+        self.candidates = candidates
+        self.resequence_budget = resequence_budget
+
+    def insert_order(self, order: DeliveryOrder, date=None) -> RouteStop:
+        """Insert ``order`` at the cheapest feasible position on an open route of ``date``
+
+        ``date`` defaults to the order's requested delivery date. Returns the
+        new stop. A gap is only taken if it makes no more priority orders
+        late than before (see ``Schedule.avoidable_late``). Raises ValueError
+        when the order is not pending or assigned, is already on an open
+        route or no open route has a truck with capacity left or a gap that
+        keeps its deadlines.
+        """
+        self._check_editable(order)
+        if RouteStop.objects.filter(delivery_order=order, route__status__in=OPEN_ROUTE_STATUSES).exists():
+            raise ValueError(f"Order {order.order_number} is already on a route")
+        date = date or order.requested_delivery_date
+        factory = self.service.factory_location
+        routes = list(Route.objects.filter(date=date, status__in=OPEN_ROUTE_STATUSES).select_related('truck'))
+        stops = self._stops_by_route(routes)
+
+        # A truck carries its capacity over the whole day, across its routes
+        loads: Dict[int, int] = {}
+        for route in routes:
+            loads[route.truck_id] = loads.get(route.truck_id, 0) + sum(
+                stop.delivery_order.weight_kg for stop in stops[route.id]
+            )
+
+        # Gap (route, k) sits after the k-th stop; never before a completed stop
+        gaps, exits, entries = [], [], []
+        for route in routes:
+            if loads[route.truck_id] + order.weight_kg > route.truck.capacity_kg:
+                continue
+            route_stops = stops[route.id]
+            locked = self._locked_count(route_stops)
+            for k in range(locked, len(route_stops) + 1):
+                gaps.append((route, k))
+                exits.append(route_stops[k - 1].delivery_order.delivery_point if k else factory)
+                entries.append(route_stops[k].delivery_order.pickup_point if k < len(route_stops) else factory)
+        if not gaps:
+            raise ValueError(f"No open route on {date} can take order {order.order_number}")
+
+        pickup, delivery = order.pickup_point, order.delivery_point
+        exit_points, entry_points = np.array(exits), np.array(entries)
+        estimates = (
+            haversine_pairs(exit_points, np.array(pickup))
+            + haversine_pairs(np.array(delivery), entry_points)
+            - haversine_pairs(exit_points, entry_points)
+        )
+        best = np.argsort(estimates, kind='stable')[:self.candidates].tolist()
+
+        # Price the shortlisted gaps with road distances: exit -> pickup, delivery -> entry, exit -> entry
+        starts = [exits[i] for i in best] + [delivery] * len(best) + [exits[i] for i in best] + [pickup]
+        ends = [pickup] * len(best) + [entries[i] for i in best] + [entries[i] for i in best] + [delivery]
+        legs = self.service._leg_distances(starts, ends)
+        count = len(best)
+        costs = legs[:count] + legs[count:2 * count] - legs[2 * count:3 * count] + legs[-1]
+
+        # Cheapest first, skipping gaps that would make a priority order late
+        for choice in np.argsort(costs, kind='stable').tolist():
+            route, k = gaps[best[choice]]
+            route_orders = [stop.delivery_order for stop in stops[route.id]]
+            before = self._timetable(route, route_orders)
+            after = self._timetable(route, route_orders[:k] + [order] + route_orders[k:])
+            if after[2] <= before[2]:
+                break
+        else:
+            raise ValueError(f"No open route on {date} can take order {order.order_number} without making "
+                             f"priority orders late")
+        etas, minutes, _ = after
+
+        route_stops = stops[route.id]
+        number = route_stops[k - 1].stop_number + 1 if k else 1
+        with transaction.atomic():
+            self._renumber(route_stops[k:], number + 1)
+            stop = RouteStop.objects.create(
+                route=route, delivery_order=order, stop_number=number, estimated_arrival_time=etas[k]
+            )
+            self._write_etas(route_stops[k:], etas[k + 1:])
+            self._update_route(route, float(costs[choice]), minutes)
+            self._set_status(order, 'assigned')
+        order.status = 'assigned'
+        return stop
+
+    def cancel_order(self, order: DeliveryOrder) -> Optional[Route]:
+        """Mark ``order`` cancelled and take it off its open route; returns that route, if any
+
+        The pending stops left on the route are resequenced. Raises
+        ValueError for an order that is not pending or assigned, or whose stop
+        is already completed.
+        """
+        self._check_editable(order)
+        stop = (
+            RouteStop.objects.filter(delivery_order=order, route__status__in=OPEN_ROUTE_STATUSES)
+            .select_related('route')
+            .first()
+        )
+        if stop is not None and stop.is_completed:
+            raise ValueError(f"Order {order.order_number} was already delivered on stop {stop.stop_number}")
+        if stop is None:
+            self._set_status(order, 'cancelled')
+            order.status = 'cancelled'
+            return None
+
+        route = stop.route
+        route_stops = self._stops_by_route([route])[route.id]
+        position = next(i for i, other in enumerate(route_stops) if other.id == stop.id)
+        factory = self.service.factory_location
+        previous = route_stops[position - 1].delivery_order.delivery_point if position else factory
+        following = route_stops[position + 1].delivery_order.pickup_point if position + 1 < len(route_stops) else factory
+        legs = self.service._leg_distances(
+            [previous, order.pickup_point, order.delivery_point, previous],
+            [order.pickup_point, order.delivery_point, following, following]
+        )
+        saved = legs[0] + legs[1] + legs[2] - legs[3]
+
+        remaining = route_stops[:position] + route_stops[position + 1:]
+        locked = self._locked_count(remaining)
+        pending, change = self._resequence(remaining[:locked], remaining[locked:])
+        etas, minutes, _ = self._timetable(route, [other.delivery_order for other in remaining[:locked] + pending])
+
+        with transaction.atomic():
+            stop.delete()
+            self._renumber(pending, remaining[locked - 1].stop_number + 1 if locked else 1)
+            self._write_etas(pending, etas[locked:])
+            self._update_route(route, change - float(saved), minutes)
+            self._set_status(order, 'cancelled')
+        order.status = 'cancelled'
+        return route
+
+    @staticmethod
+    def _check_editable(order: DeliveryOrder):
+        if order.status not in EDITABLE_ORDER_STATUSES:
+            raise ValueError(f"Order {order.order_number} is {order.get_status_display().lower()}")
+
+    def _stops_by_route(self, routes: List[Route]) -> Dict[int, List[RouteStop]]:
+        stops = {route.id: [] for route in routes}
+        for stop in (
+            RouteStop.objects.filter(route__in=routes)
+            .select_related('delivery_order')
+            .order_by('route_id', 'stop_number')
+        ):
+            stops[stop.route_id].append(stop)
+        return stops
+
+    @staticmethod
+    def _locked_count(route_stops: List[RouteStop]) -> int:
+        """Number of leading stops that must stay put: everything up to the last completed one"""
+        completed = [i for i, stop in enumerate(route_stops) if stop.is_completed]
+        return completed[-1] + 1 if completed else 0
+
+    def _resequence(self, locked: List[RouteStop], pending: List[RouteStop]) -> Tuple[List[RouteStop], float]:
+        """Reorder the stops after the ``locked`` ones with local search; returns them and the km change"""
+        if len(pending) < 3 or not self.resequence_budget:
+            return pending, 0.0
+
+        # Stop 0 is left from the last locked delivery (or the factory) and entered at the factory
+        factory = self.service.factory_location
+        anchor = locked[-1].delivery_order.delivery_point if locked else factory
+        exits = [anchor] + [stop.delivery_order.delivery_point for stop in pending]
+        entries = [factory] + [stop.delivery_order.pickup_point for stop in pending]
+
+        def legs(sources, destinations):
+            starts = [exits[a] for a in sources for _ in destinations]
+            ends = [entries[b] for _ in sources for b in destinations]
+            return self.service._leg_distances(starts, ends).reshape(len(sources), len(destinations))
+
+        search = LocalSearch(
+            [list(range(1, len(pending) + 1))],
+            legs=legs,
+            weights=[0] * (len(pending) + 1),
+            capacities=[float('inf')],
+            time_budget=self.resequence_budget
+        )
+        before = search.total_cost()
+        improved = search.run()[0]
+        return [pending[i - 1] for i in improved], search.total_cost() - before
+
+    @staticmethod
+    def _renumber(route_stops: List[RouteStop], first: int):
+        """Number ``route_stops`` consecutively from ``first``, writing only the stops whose number changes
+
+        Two UPDATEs keep unique (route, stop_number) intact: the stops first
+        move to the negative of their new number, which no other stop uses,
+        and are then flipped back.
+        """
+        changed = []
+        for number, stop in enumerate(route_stops, first):
+            if stop.stop_number != number:
+                stop.stop_number = number
+                changed.append(stop)
+        if not changed:
+            return
+        RouteStop.objects.bulk_update(
+            [RouteStop(id=stop.id, stop_number=-stop.stop_number) for stop in changed], ['stop_number']
+        )
+        RouteStop.objects.filter(id__in=[stop.id for stop in changed]).update(stop_number=-F('stop_number'))
+
+    @staticmethod
+    def _set_status(order: DeliveryOrder, status: str):
+        """Write ``status`` unless the order already reached a final one, and signal the change"""
+        changed = DeliveryOrder.objects.filter(pk=order.pk).exclude(
+            status__in=DeliveryOrder.FINAL_STATUSES
+        ).update(status=status)
+        if changed:
+            order_status_changed.send(sender=DeliveryOrder, order_ids=[order.pk], status=status)
+
+    def _timetable(self, route: Route, orders: List[DeliveryOrder]) -> Tuple[List[datetime], int, int]:
+        """(ETA of each order, route duration in minutes, avoidable late orders) with ``orders`` driven in sequence
+
+        Travel times are road durations of the sequence's legs.
+        """
+        matrix = self.service._sequence_matrix(orders)
+        schedule = self.service._build_schedule(route.date, orders, matrix)
+        sequence = list(range(len(orders)))
+        etas, duration = schedule.arrivals(sequence)
+        departure = self.service.departure(route.date)
+        return (
+            [departure + timedelta(seconds=round(eta)) for eta in etas],
+            round(duration / 60),
+            schedule.avoidable_late(sequence)
+        )
+
+    @staticmethod
+    def _write_etas(route_stops: List[RouteStop], etas: List[datetime]):
+        """Give ``route_stops`` their new ETAs, writing only those that change"""
+        changed = []
+        for stop, eta in zip(route_stops, etas):
+            if stop.estimated_arrival_time != eta:
+                stop.estimated_arrival_time = eta
+                changed.append(stop)
+        if changed:
+            RouteStop.objects.bulk_update(changed, ['estimated_arrival_time'])
+
+    @staticmethod
+    def _update_route(route: Route, km: float, minutes: int):
+        route.total_distance_km = max(round(float(route.total_distance_km) + km, 2), 0)
+        route.estimated_duration_minutes = minutes
+        Route.objects.filter(pk=route.pk).update(
+            total_distance_km=route.total_distance_km, estimated_duration_minutes=minutes
+        )
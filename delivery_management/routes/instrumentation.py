@@ -0,0 +1,54 @@
+"""Per-run measurements of the route optimizer
+
+A RunMetrics object collects phase timings and counters while
+``RouteOptimizationService.optimize_daily_routes`` runs. The result is stored
+as an OptimizationRun row linked to the routes it created.
+"""
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict
+
+from django.db import connection
+
+
+class RunMetrics:
+    """Phase timers, counters and a database query count for one optimization run"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.phase_queries: Dict[str, int] = {}
+        self.counters = Counter()
+        self.queries = 0
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a phase and count the queries it issues; repeated phases accumulate"""
+        queries = self.queries
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+            self.phase_queries[name] = self.phase_queries.get(name, 0) + self.queries - queries
+
+    @contextmanager
+    def count_queries(self):
+        """Count every query the default connection executes inside the block"""
+        def wrapper(execute, sql, params, many, context):
+            self.queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(wrapper):
+            yield
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def as_dict(self) -> dict:
+        return {
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'phase_queries': dict(self.phase_queries),
+            'counters': dict(self.counters),
+            'queries': self.queries,
+        }
@@ -0,0 +1,107 @@
+"""Background execution of route optimization runs
+
+Jobs are OptimizationJob rows handed to a process pool that lives inside the
+web process, so no external broker is needed. Worker processes are spawned
+(not forked) and run ``django.setup()`` themselves, so they never share
+database connections with the web process. Jobs left queued or running by
+a restarted web process are not resumed.
+"""
+import logging
+import multiprocessing
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from deliveries.models import DeliveryOrder, Truck
+from .models import OptimizationJob
+from .records import order_records
+from .services import RouteOptimizationService
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'WORKERS': 2,
+    'EAGER': False,  # run jobs inline, e.g. in tests
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_job_settings():
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ROUTE_OPTIMIZATION_JOBS', {})}
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=get_job_settings()['WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        return _executor
+
+
+def enqueue_optimization(date, trucks, orders, user=None) -> OptimizationJob:
+    """Record a job and hand it to the worker pool once the row is committed"""
+    job = OptimizationJob.objects.create(
+        date=date,
+        truck_ids=[truck.id for truck in trucks],
+        order_ids=[order.id for order in orders],
+        created_by=user,
+        message='Waiting for a worker'
+    )
+    if get_job_settings()['EAGER']:
+        transaction.on_commit(lambda: run_optimization_job(job.id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(run_optimization_job, job.id))
+    return job
+
+
+def run_optimization_job(job_id: int):
+    """Worker entry point: load the job's trucks and orders and optimize them
+
+    Only orders still pending are planned; those routed by another job or
+    cancelled while this one waited are listed in ``result['skipped_order_ids']``.
+    """
+    job = OptimizationJob.objects.get(pk=job_id)
+    job.status = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['status', 'started_at'])
+
+    try:
+        # Keep the truck order chosen when the job was queued
+        trucks_by_id = Truck.objects.in_bulk(job.truck_ids)
+        trucks = [trucks_by_id[truck_id] for truck_id in job.truck_ids if truck_id in trucks_by_id]
+        orders = order_records(DeliveryOrder.objects.filter(id__in=job.order_ids, status='pending').order_by('id'))
+        planned = {order.id for order in orders}
+        skipped = [order_id for order_id in job.order_ids if order_id not in planned]
+
+        optimizer = RouteOptimizationService()
+        routes = optimizer.optimize_daily_routes(job.date, trucks, orders, progress=job.report_progress)
+
+        job.status = 'completed'
+        job.progress = 100
+        job.message = f"Created {len(routes)} optimized routes for {len(orders)} orders using {len(trucks)} trucks"
+        if skipped:
+            job.message += f", skipped {len(skipped)} orders no longer pending"
+        job.result = {
+            'route_ids': [route.id for route in routes],
+            'run_id': optimizer.last_run.id if optimizer.last_run else None,
+            'skipped_order_ids': skipped,
+        }
+    except Exception:
+        logger.exception("Optimization job %s failed", job_id)
+        job.status = 'failed'
+        job.message = 'Optimization failed'
+        job.error = traceback.format_exc()
+
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'progress', 'message', 'result', 'error', 'finished_at'])
@@ -0,0 +1,186 @@
+import time
+from collections import Counter
+from itertools import product
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Improvements smaller than this are rounding noise and would make the search cycle
+EPSILON = 1e-9
+
+
+class LocalSearch:
+    """Improve merged routes with 2-opt, or-opt and inter-route relocate moves
+
+    Stops are numbered 1..n and 0 is the depot that starts and ends every
+    route. ``legs(sources, destinations)`` returns the array of distances
+    from leaving each source stop to arriving at each destination stop; the
+    cost of a->b need not equal b->a (an order is left from its delivery but
+    entered at its pickup). Costs within each route are fetched in one block
+    up front, the few others a move needs one at a time.
+
+    Every route keeps prefix sums of its arc costs in both directions, so a
+    2-opt reversal is priced in O(1) like the or-opt and relocate moves.
+    Moves are applied first-improvement until none is left or ``time_budget``
+    seconds have passed; applying one only rebuilds the routes it changed.
+
+    ``vehicles`` maps each route to the vehicle driving it (by default every
+    route has its own) and ``capacities`` is indexed by vehicle, so routes
+    sharing a truck share its capacity.
+    """
+
+    def __init__(self, routes: Sequence[Sequence[int]], legs: Callable[[List[int], List[int]], np.ndarray],
+                 weights: Sequence[float], capacities: Sequence[float], vehicles: Optional[Sequence[int]] = None,
+                 neighbours: Optional[Dict[int, List[int]]] = None, time_budget: float = 0.5):
+        self.routes = [list(route) for route in routes]
+        self.weights = weights
+        self.capacities = capacities
+        self.vehicles = list(vehicles) if vehicles is not None else list(range(len(self.routes)))
+        self.loads = [0] * len(capacities)
+        for route, vehicle in zip(self.routes, self.vehicles):
+            self.loads[vehicle] += sum(weights[stop] for stop in route)
+        self.neighbours = neighbours or {}
+        self.time_budget = time_budget
+        self.moves = Counter()
+
+        self._costs: Dict[tuple, float] = {}
+        self._legs = legs
+        self._deadline = None
+        self._forward: List[List[float]] = []
+        self._backward: List[List[float]] = []
+        # stop -> (route index, position in the route's depot-padded sequence)
+        self._where: Dict[int, tuple] = {}
+        for r in range(len(self.routes)):
+            self._preload(r)
+            self._forward.append([])
+            self._backward.append([])
+            self._rebuild(r)
+
+    def cost(self, a: int, b: int) -> float:
+        key = (a, b)
+        value = self._costs.get(key)
+        if value is None:
+            value = self._costs[key] = float(self._legs([a], [b])[0, 0])
+        return value
+
+    def route_cost(self, r: int) -> float:
+        return self._forward[r][-1]
+
+    def total_cost(self) -> float:
+        return sum(self.route_cost(r) for r in range(len(self.routes)))
+
+    def run(self) -> List[List[int]]:
+        """Apply improving moves until none is left or the budget runs out; returns the routes"""
+        self._deadline = time.perf_counter() + self.time_budget
+        improved = True
+        while improved and not self._expired():
+            improved = False
+            for r in range(len(self.routes)):
+                while not self._expired() and (self._two_opt(r) or self._or_opt(r)):
+                    improved = True
+            if self._relocate():
+                improved = True
+        return self.routes
+
+    def _expired(self) -> bool:
+        return time.perf_counter() > self._deadline
+
+    def _sequence(self, r: int) -> List[int]:
+        return [0] + self.routes[r] + [0]
+
+    def _preload(self, r: int):
+        """Fetch every cost between the stops of a route (and the depot) in one block"""
+        stops = self._sequence(r)[:-1]
+        self._costs.update(zip(product(stops, stops), self._legs(stops, stops).ravel().tolist()))
+
+    def _rebuild(self, r: int):
+        """Recompute prefix sums and positions of one route after it changed"""
+        sequence = self._sequence(r)
+        forward, backward = [0.0], [0.0]
+        for a, b in zip(sequence, sequence[1:]):
+            forward.append(forward[-1] + self.cost(a, b))
+            backward.append(backward[-1] + self.cost(b, a))
+        self._forward[r], self._backward[r] = forward, backward
+        for position, stop in enumerate(self.routes[r], 1):
+            self._where[stop] = (r, position)
+
+    def _two_opt(self, r: int) -> bool:
+        """Reverse the segment s[i..j] when that shortens the route"""
+        s = self._sequence(r)
+        forward, backward = self._forward[r], self._backward[r]
+        # Every pair within a route is preloaded, so read the table directly
+        cost = self._costs
+        for i in range(1, len(s) - 2):
+            for j in range(i + 1, len(s) - 1):
+                before = cost[s[i - 1], s[i]] + forward[j] - forward[i] + cost[s[j], s[j + 1]]
+                after = cost[s[i - 1], s[j]] + backward[j] - backward[i] + cost[s[i], s[j + 1]]
+                if after - before < -EPSILON:
+                    s[i:j + 1] = s[i:j + 1][::-1]
+                    self.routes[r] = s[1:-1]
+                    self._rebuild(r)
+                    self.moves['two_opt'] += 1
+                    return True
+        return False
+
+    def _or_opt(self, r: int) -> bool:
+        """Move a segment of one to three stops elsewhere in the same route, keeping its direction"""
+        s = self._sequence(r)
+        cost = self._costs
+        for length in (1, 2, 3):
+            for i in range(1, len(s) - length):
+                e = i + length - 1
+                removal = cost[s[i - 1], s[i]] + cost[s[e], s[e + 1]] - cost[s[i - 1], s[e + 1]]
+                for k in range(len(s) - 1):
+                    if i - 1 <= k <= e:
+                        continue
+                    insertion = cost[s[k], s[i]] + cost[s[e], s[k + 1]] - cost[s[k], s[k + 1]]
+                    if insertion - removal < -EPSILON:
+                        segment = s[i:e + 1]
+                        rest = s[:i] + s[e + 1:]
+                        at = k + 1 if k < i else k + 1 - length
+                        s = rest[:at] + segment + rest[at:]
+                        self.routes[r] = s[1:-1]
+                        self._rebuild(r)
+                        self.moves['or_opt'] += 1
+                        return True
+        return False
+
+    def _relocate(self) -> bool:
+        """Move single stops next to a nearby stop of another route with spare capacity"""
+        cost = self.cost
+        improved = False
+        for stop, candidates in self.neighbours.items():
+            if self._expired():
+                break
+            r, i = self._where[stop]
+            s = self._sequence(r)
+            removal = cost(s[i - 1], stop) + cost(stop, s[i + 1]) - cost(s[i - 1], s[i + 1])
+            weight = self.weights[stop]
+            vehicle = self.vehicles[r]
+
+            for neighbour in candidates:
+                target, j = self._where[neighbour]
+                if target == r:
+                    continue
+                other = self.vehicles[target]
+                if other != vehicle and self.loads[other] + weight > self.capacities[other]:
+                    continue
+                t = self._sequence(target)
+                # Try the gaps just before and just after the neighbour
+                for k in (j - 1, j):
+                    insertion = cost(t[k], stop) + cost(stop, t[k + 1]) - cost(t[k], t[k + 1])
+                    if insertion - removal < -EPSILON:
+                        self.routes[r].remove(stop)
+                        self.routes[target].insert(k, stop)
+                        self.loads[vehicle] -= weight
+                        self.loads[other] += weight
+                        self._preload(target)
+                        self._rebuild(r)
+                        self._rebuild(target)
+                        self.moves['relocate'] += 1
+                        improved = True
+                        break
+                else:
+                    continue
+                break
+        return improved
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from routes.benchmarks import compare_coordinate_loading
+
+
+class Command(BaseCommand):
+    help = "Benchmark loading order coordinates as Decimals on model instances against float order records"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, nargs='+', default=[10000])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'orders':>7} {'method':>9} {'seconds':>9} {'peak_kb':>10} {'queries':>8}")
+        for count in options['orders']:
+            results = compare_coordinate_loading(count, seed=options['seed'])
+            for name, row in results.items():
+                self.stdout.write(
+                    f"{count:>7} {name:>9} {row['seconds']:>9.3f} {row['peak_kb']:>10.0f} {row['queries']:>8}"
+                )
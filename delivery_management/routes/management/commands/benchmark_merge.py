@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from routes.benchmarks import compare_merge
+
+
+class Command(BaseCommand):
+    help = "Benchmark the indexed Clarke-Wright merge step against the legacy implementation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, nargs='+', default=[200, 500, 2000])
+        parser.add_argument('--trucks', type=int, default=None,
+                            help="Trucks in the fleet (default: just enough for the total weight)")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--legacy-limit', type=int, default=500,
+                            help="Skip the legacy merge above this many orders (it is O(S*N))")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'orders':>7} {'pairs':>9} {'impl':>8} {'seconds':>9} {'routes':>7} {'km':>10}")
+        for count in options['orders']:
+            results = compare_merge(
+                count,
+                trucks=options['trucks'],
+                seed=options['seed'],
+                include_legacy=count <= options['legacy_limit']
+            )
+            for name in ('indexed', 'legacy'):
+                if name in results:
+                    row = results[name]
+                    self.stdout.write(
+                        f"{count:>7} {results['pairs']:>9} {name:>8} {row['seconds']:>9.3f} "
+                        f"{row['routes']:>7} {row['km']:>10.1f}"
+                    )
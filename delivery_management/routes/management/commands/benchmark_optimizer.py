@@ -0,0 +1,59 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from routes.benchmarks import DISTRIBUTIONS, benchmark_optimizer, compare_to_baseline, save_baseline
+from routes.providers import get_routing_provider
+from routes.services import RouteOptimizationService
+
+
+class Command(BaseCommand):
+    help = "Time the savings, merge and persistence phases of the optimizer on generated orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, nargs='+', default=[50, 500, 5000])
+        parser.add_argument('--distribution', choices=DISTRIBUTIONS, nargs='+', default=list(DISTRIBUTIONS))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--routing', choices=['osrm', 'matrix_file', 'haversine'], default='haversine',
+                            help="Routing provider backend (default: haversine, so runs are comparable)")
+        parser.add_argument('--save-baseline', metavar='PATH', help="Write the results as a JSON baseline")
+        parser.add_argument('--compare', metavar='PATH', help="Report regressions against a saved baseline")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="Relative slowdown reported as a regression (default 0.2)")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                baseline = json.loads(Path(options['compare']).read_text())
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline {options['compare']}: {exc}")
+
+        self.stdout.write(
+            f"{'orders':>7} {'distribution':>12} {'phase':>14} {'seconds':>9} {'peak MB':>9} {'queries':>8}"
+        )
+        results = []
+        for count in options['orders']:
+            for distribution in options['distribution']:
+                service = RouteOptimizationService(routing_provider=get_routing_provider(options['routing']))
+                result = benchmark_optimizer(count, distribution, options['seed'], service=service)
+                results.append(result)
+                for phase, stats in result['phases'].items():
+                    self.stdout.write(
+                        f"{count:>7} {distribution:>12} {phase:>14} {stats['seconds']:>9.3f} "
+                        f"{stats['peak_kb'] / 1024:>9.1f} {stats['queries']:>8}"
+                    )
+                self.stdout.write(f"{count:>7} {distribution:>12} {'total':>14} "
+                                  f"{result['routes']} routes, {result['km']:.1f} km")
+
+        if options['save_baseline']:
+            save_baseline(results, options['save_baseline'])
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+
+        if baseline is not None:
+            regressions = compare_to_baseline(results, baseline, options['tolerance'])
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(f"Regression: {regression}"))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
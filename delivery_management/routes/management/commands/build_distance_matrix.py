@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from routes.precompute import build_precomputed_matrix
+from routes.providers import get_routing_provider, get_routing_settings
+
+
+class Command(BaseCommand):
+    help = "Precompute road distances between the depots and all active customers for the optimizer"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help="Directory to write (default: ROUTING_PROVIDER['PRECOMPUTED_MATRIX_PATH'])")
+        parser.add_argument('--routing', choices=['osrm', 'matrix_file', 'haversine'], default=None,
+                            help="Routing provider backend (default: ROUTING_PROVIDER setting)")
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Fetch every cell again instead of reusing the existing matrix")
+
+    def handle(self, *args, **options):
+        output = options['output'] or get_routing_settings()['PRECOMPUTED_MATRIX_PATH']
+        if not output:
+            raise CommandError("Pass --output or set ROUTING_PROVIDER['PRECOMPUTED_MATRIX_PATH']")
+
+        matrix, fetched, failed = build_precomputed_matrix(
+            output, get_routing_provider(options['routing']), rebuild=options['rebuild']
+        )
+        size_mb = (matrix.distances.nbytes + matrix.durations.nbytes) / 2 ** 20
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {len(matrix)} locations ({size_mb:.1f} MB) to {output}, fetched {fetched} cells"
+        ))
+        if failed:
+            self.stderr.write(self.style.WARNING(
+                f"{failed} cells got no road distance and were saved as missing; the optimizer estimates them "
+                f"and the next build fetches them again"
+            ))
@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from routes.batch import get_depots, plan_batch
+
+
+class Command(BaseCommand):
+    help = "Plan optimized routes for pending orders over several days and depots in parallel"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, default=date.today(),
+                            help="First delivery date (YYYY-MM-DD, default today)")
+        parser.add_argument('--days', type=int, default=7)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes (default: one per CPU)")
+        parser.add_argument('--depot', action='append', default=[], metavar='NAME=LAT,LON',
+                            help="Depot to plan from; repeat for several (default: ROUTING_DEPOTS)")
+        parser.add_argument('--routing', choices=['osrm', 'matrix_file', 'haversine'], default=None,
+                            help="Routing provider backend (default: ROUTING_PROVIDER setting)")
+
+    def handle(self, *args, **options):
+        depots = get_depots()
+        if options['depot']:
+            depots = {}
+            for value in options['depot']:
+                try:
+                    name, location = value.split('=')
+                    lat, lon = (float(part) for part in location.split(','))
+                except ValueError:
+                    raise CommandError(f"Invalid depot '{value}', expected NAME=LAT,LON")
+                depots[name] = (lat, lon)
+
+        dates = [options['start'] + timedelta(days=i) for i in range(options['days'])]
+        results = plan_batch(dates, depots, workers=options['workers'], routing_backend=options['routing'])
+
+        for (day, depot), route_ids in sorted(results.items()):
+            self.stdout.write(f"{day} {depot}: {len(route_ids)} routes")
+        self.stdout.write(self.style.SUCCESS(
+            f"Planned {sum(len(ids) for ids in results.values())} routes in {len(results)} partitions"
+        ))
@@ -0,0 +1,88 @@
+"""Folium maps of routes, rendered once per stop state and cached
+
+Building a Folium map and serializing it costs far more than the page
+around it, so the route detail page loads its map from a separate
+endpoint. ``route_map_html`` reads the route's stops in one query and keys
+the cache on a digest of exactly what the map draws: stop numbers, order
+numbers and coordinates. Reordering, adding or removing stops, or moving an
+order, gives a new key, so cached maps never need invalidating and simply
+expire after ROUTE_MAPS['TTL'] seconds.
+"""
+import hashlib
+from typing import List, Tuple
+
+import folium
+from django.conf import settings
+from django.core.cache import caches
+
+from deliveries.models import RouteStop, as_float
+
+DEFAULT_SETTINGS = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 24 * 3600,
+}
+
+FACTORY_LOCATION = (52.5200, 13.4050)  # Berlin
+
+StopRow = Tuple[int, str, float, float, float, float]  # (stop number, order number, pickup, delivery)
+
+
+def get_map_settings() -> dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ROUTE_MAPS', {})}
+
+
+def route_stop_rows(route_id: int) -> List[StopRow]:
+    return list(
+        RouteStop.objects.filter(route_id=route_id).order_by('stop_number').values_list(
+            'stop_number', 'delivery_order__order_number',
+            as_float('delivery_order__pickup_latitude'), as_float('delivery_order__pickup_longitude'),
+            as_float('delivery_order__delivery_latitude'), as_float('delivery_order__delivery_longitude'),
+        )
+    )
+
+
+def route_map_key(route_id: int, rows: List[StopRow]) -> str:
+    digest = hashlib.sha1(repr(rows).encode()).hexdigest()
+    return f'routes:map:{route_id}:{digest}'
+
+
+def render_route_map(rows: List[StopRow]) -> str:
+    """HTML of a map from the factory through each stop's pickup and delivery and back"""
+    m = folium.Map(location=FACTORY_LOCATION, zoom_start=12, tiles='OpenStreetMap')
+    folium.Marker(
+        location=FACTORY_LOCATION,
+        popup='Factory',
+        icon=folium.Icon(color='red', icon='industry')
+    ).add_to(m)
+
+    route_coords = [FACTORY_LOCATION]
+    for _, order_number, pickup_lat, pickup_lon, delivery_lat, delivery_lon in rows:
+        folium.Marker(
+            location=(pickup_lat, pickup_lon),
+            popup=f'Pickup: {order_number}',
+            icon=folium.Icon(color='blue', icon='arrow-up')
+        ).add_to(m)
+        folium.Marker(
+            location=(delivery_lat, delivery_lon),
+            popup=f'Delivery: {order_number}',
+            icon=folium.Icon(color='green', icon='arrow-down')
+        ).add_to(m)
+        route_coords.extend([(pickup_lat, pickup_lon), (delivery_lat, delivery_lon)])
+    route_coords.append(FACTORY_LOCATION)
+
+    folium.PolyLine(route_coords, color='red', weight=3, opacity=0.8).add_to(m)
+    m.fit_bounds(route_coords)
+    return m._repr_html_()
+
+
+def route_map_html(route_id: int) -> str:
+    """The route's map, from the map cache when its stops have not changed"""
+    config = get_map_settings()
+    cache = caches[config['CACHE_ALIAS']]
+    rows = route_stop_rows(route_id)
+    key = route_map_key(route_id, rows)
+    html = cache.get(key)
+    if html is None:
+        html = render_route_map(rows)
+        cache.set(key, html, config['TTL'])
+    return html
@@ -0,0 +1,236 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from deliveries.models import DeliveryOrder, Truck
+from .scheduling import Schedule
+
+
+class RouteMerger:
+    """Clarke-Wright merge state with near O(1) merge decisions
+
+    Orders are tracked by position. A union-find structure maps each order to
+    its route, and each route root caches its load, truck and two endpoint
+    orders. Routes are kept as undirected chains (every order knows at most
+    two neighbours), so joining two routes end to end is a constant-time link
+    and the visiting sequence is only walked once, in ``routes()``.
+
+    Each truck carries at most its own ``capacity_kg`` over the day. Routes
+    are pre-assigned first-fit-decreasing (heaviest route first, largest
+    truck first); routes that fit on no truck stay unassigned. Routes on
+    different trucks may merge when one of the two trucks can take the other
+    route's load; the fuller truck is preferred so the other one empties.
+
+    With a Schedule (see ``use_schedule``) each route also keeps its span
+    and deadline slack in both driving directions, and a merge that would
+    make an order late, or later than it already was, is rejected.
+    """
+
+    def __init__(self, routes: List[List[DeliveryOrder]], trucks: List[Truck]):
+        self.orders: List[DeliveryOrder] = [order for route in routes for order in route]
+        self.position: Dict[int, int] = {order.id: i for i, order in enumerate(self.orders)}
+
+        count = len(self.orders)
+        self.parent = list(range(count))
+        self.size = [1] * count
+        self.neighbours: List[List[int]] = [[] for _ in range(count)]
+        self.load: Dict[int, int] = {}
+        self.ends: Dict[int, Tuple[int, int]] = {}
+        self.truck: Dict[int, Optional[Truck]] = {}
+        self.utilization: Dict[int, int] = {truck.id: 0 for truck in trucks}
+        self.schedule: Optional[Schedule] = None
+        # root -> ((span, slack) head to tail, (span, slack) tail to head)
+        self.timing: Dict[int, Tuple[Tuple[float, float], Tuple[float, float]]] = {}
+        self.late_rejections = 0
+
+        start = 0
+        for route in routes:
+            if not route:
+                continue
+            members = list(range(start, start + len(route)))
+            start += len(route)
+
+            # Chain the initial route in its given order
+            for a, b in zip(members, members[1:]):
+                self.neighbours[a].append(b)
+                self.neighbours[b].append(a)
+                self.parent[b] = members[0]
+            root = members[0]
+            self.size[root] = len(members)
+            self.ends[root] = (members[0], members[-1])
+            self.load[root] = sum(order.weight_kg for order in route)
+            self.truck[root] = None
+
+        # First-fit decreasing; sorts are stable so equal loads keep their order
+        fleet = sorted(trucks, key=lambda truck: -truck.capacity_kg)
+        for root in sorted(self.load, key=lambda root: -self.load[root]):
+            for truck in fleet:
+                if self.utilization[truck.id] + self.load[root] <= truck.capacity_kg:
+                    self.truck[root] = truck
+                    self.utilization[truck.id] += self.load[root]
+                    break
+
+    def use_schedule(self, schedule: Schedule):
+        """Check deadlines on every further merge; order positions index the schedule"""
+        self.schedule = schedule
+        for root in self.ends:
+            sequence = self._walk(root)
+            self.timing[root] = (schedule.summary(sequence), schedule.summary(sequence[::-1]))
+
+    def truck_groups(self) -> np.ndarray:
+        """Truck id of every order's route by position, -1 where no truck was available"""
+        groups = np.full(len(self.orders), -1)
+        for i in range(len(self.orders)):
+            truck = self.truck[self.find(i)]
+            if truck is not None:
+                groups[i] = truck.id
+        return groups
+
+    def endpoint_orders(self) -> List[DeliveryOrder]:
+        """Orders at either end of a route that has a truck, i.e. those further merges can link"""
+        return [
+            order for i, order in enumerate(self.orders)
+            if len(self.neighbours[i]) < 2 and self.truck[self.find(i)] is not None
+        ]
+
+    def find(self, i: int) -> int:
+        root = i
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[i] != root:
+            self.parent[i], i = root, self.parent[i]
+        return root
+
+    def is_endpoint(self, i: int) -> bool:
+        return len(self.neighbours[i]) < 2
+
+    def try_merge(self, order1_id: int, order2_id: int) -> bool:
+        """Join the routes of two orders end to end if the pair allows it"""
+        a, b = self.position.get(order1_id), self.position.get(order2_id)
+        if a is None or b is None:
+            return False
+        # Only route endpoints can be linked without breaking up a route
+        if not (self.is_endpoint(a) and self.is_endpoint(b)):
+            return False
+        return self._merge(a, b)
+
+    def _merge(self, a: int, b: int) -> bool:
+        root1, root2 = self.find(a), self.find(b)
+        if root1 == root2:
+            return False
+
+        truck1, truck2 = self.truck[root1], self.truck[root2]
+        if not (truck1 and truck2):
+            return False
+        load1, load2 = self.load[root1], self.load[root2]
+        if truck1.id == truck2.id:
+            # Both loads already count towards the truck's capacity
+            host = truck1
+        else:
+            hosts = []
+            if self.utilization[truck1.id] + load2 <= truck1.capacity_kg:
+                hosts.append(truck1)
+            if self.utilization[truck2.id] + load1 <= truck2.capacity_kg:
+                hosts.append(truck2)
+            if not hosts:
+                return False
+            host = max(hosts, key=lambda truck: self.utilization[truck.id])
+        timing = self._merged_timing(a, b, root1, root2) if self.schedule is not None else None
+        if timing is False:
+            self.late_rejections += 1
+            return False
+        if truck1.id != truck2.id:
+            guest = truck2 if host is truck1 else truck1
+            moved = load2 if host is truck1 else load1
+            self.utilization[host.id] += moved
+            self.utilization[guest.id] -= moved
+        load = load1 + load2
+
+        self.neighbours[a].append(b)
+        self.neighbours[b].append(a)
+
+        # The merged route runs from the far end of route1 to the far end of route2
+        head1, tail1 = self.ends[root1]
+        head2, tail2 = self.ends[root2]
+        far1 = head1 if a == tail1 else tail1
+        far2 = tail2 if b == head2 else head2
+
+        if self.size[root1] < self.size[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size[root2]
+        self.load[root1] = load
+        self.ends[root1] = (far1, far2)
+        self.truck[root1] = host
+        for table in (self.load, self.ends, self.truck):
+            del table[root2]
+        if timing is not None:
+            forward, backward, flipped = timing
+            self.timing[root1] = (forward, backward)
+            del self.timing[root2]
+            if flipped:
+                self.ends[root1] = (far2, far1)
+        return True
+
+    def _merged_timing(self, a: int, b: int, root1: int, root2: int):
+        """Timing of joining route1 (at a) to route2 (at b), or False if that makes orders late
+
+        Returns ((span, slack) forwards, (span, slack) backwards, flipped).
+        The merged route is normally driven from route1's far end; when only
+        the opposite direction keeps deadlines, ``flipped`` is True.
+        """
+        schedule = self.schedule
+        head1, tail1 = self.ends[root1]
+        head2, tail2 = self.ends[root2]
+        # Each route's (span, slack) in the direction it is driven in the merged route, and reversed
+        forward1, reverse1 = self.timing[root1] if a == tail1 else self.timing[root1][::-1]
+        forward2, reverse2 = self.timing[root2] if b == head2 else self.timing[root2][::-1]
+        far1 = head1 if a == tail1 else tail1
+        far2 = tail2 if b == head2 else head2
+
+        gap = schedule.travel(a + 1, b + 1)
+        forward = (forward1[0] + gap + forward2[0], min(forward1[1], forward2[1] - forward1[0] - gap))
+        back_gap = schedule.travel(b + 1, a + 1)
+        backward = (reverse2[0] + back_gap + reverse1[0], min(reverse2[1], reverse1[1] - reverse2[0] - back_gap))
+
+        # Acceptable when nobody is late, or nobody is later than on the two routes driven alone
+        lateness = schedule.lateness(far1, forward[1])
+        if lateness <= 0 or lateness <= max(schedule.lateness(far1, forward1[1]), schedule.lateness(b, forward2[1])):
+            return forward, backward, False
+        lateness = schedule.lateness(far2, backward[1])
+        if lateness <= 0 or lateness <= max(schedule.lateness(far2, reverse2[1]), schedule.lateness(a, reverse1[1])):
+            return backward, forward, True
+        return False
+
+    def merge_all(self, pairs: Iterable[Tuple[int, int]]) -> int:
+        """Apply merges for (order1 id, order2 id) pairs in order; returns merges made"""
+        # Same checks as try_merge, inlined: most pairs are rejected because an
+        # order is already interior to a route, so that test has to stay cheap
+        position, neighbours = self.position, self.neighbours
+        merges = 0
+        for order1_id, order2_id in pairs:
+            a, b = position.get(order1_id), position.get(order2_id)
+            if a is None or b is None or len(neighbours[a]) > 1 or len(neighbours[b]) > 1:
+                continue
+            if self._merge(a, b):
+                merges += 1
+        return merges
+
+    def routes(self) -> List[Tuple[List[DeliveryOrder], Optional[Truck]]]:
+        """Walk every route from head to tail"""
+        return [
+            ([self.orders[i] for i in self._walk(root)], self.truck[root])
+            for root in range(len(self.orders))
+            if self.parent[root] == root
+        ]
+
+    def _walk(self, root: int) -> List[int]:
+        """Positions of a route's orders from head to tail"""
+        head, _ = self.ends[root]
+        sequence, previous, current = [], None, head
+        while current is not None:
+            sequence.append(current)
+            following = [n for n in self.neighbours[current] if n != previous]
+            previous, current = current, (following[0] if following else None)
+        return sequence
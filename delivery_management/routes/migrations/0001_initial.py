@@ -0,0 +1,24 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanceCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('distance_km', models.FloatField()),
+                ('duration_seconds', models.FloatField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
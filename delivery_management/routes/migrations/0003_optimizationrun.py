@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-18 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deliveries', '0001_initial'),
+        ('routes', '0002_optimizationjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptimizationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('routing_provider', models.CharField(max_length=30)),
+                ('order_count', models.PositiveIntegerField(default=0)),
+                ('truck_count', models.PositiveIntegerField(default=0)),
+                ('route_count', models.PositiveIntegerField(default=0)),
+                ('total_distance_km', models.FloatField(default=0)),
+                ('duration_seconds', models.FloatField(default=0)),
+                ('phases', models.JSONField(blank=True, default=dict)),
+                ('phase_queries', models.JSONField(blank=True, default=dict)),
+                ('routing_calls', models.PositiveIntegerField(default=0)),
+                ('routing_seconds', models.FloatField(default=0)),
+                ('cache_hits', models.PositiveIntegerField(default=0)),
+                ('cache_misses', models.PositiveIntegerField(default=0)),
+                ('haversine_fallbacks', models.PositiveIntegerField(default=0)),
+                ('query_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('routes', models.ManyToManyField(blank=True, related_name='optimization_runs', to='deliveries.route')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
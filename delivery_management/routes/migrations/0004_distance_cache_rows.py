@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-18 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0003_optimizationrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanceCacheRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin', models.CharField(max_length=40, unique=True)),
+                ('cells', models.BinaryField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.DeleteModel(
+            name='DistanceCacheEntry',
+        ),
+    ]
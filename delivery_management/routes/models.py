@@ -1,3 +1,98 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class DistanceCacheRow(models.Model):
+    """Persistent tier of the routing distance cache: the cached cells from one origin (see routes.cache)"""
+    origin = models.CharField(max_length=40, unique=True)
+    cells = models.BinaryField()
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return f"Distances from {self.origin}"
+
+
+class OptimizationJob(models.Model):
+    """A route optimization run queued from the web and executed by the local worker pool"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=200, blank=True)
+    date = models.DateField()
+    truck_ids = models.JSONField(default=list)
+    order_ids = models.JSONField(default=list)
+    result = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Optimization job {self.id} ({self.get_status_display()})"
+    
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+    
+    def report_progress(self, progress, message=''):
+        """Store progress without touching other columns (called from the worker)"""
+        self.progress, self.message = progress, message
+        OptimizationJob.objects.filter(pk=self.pk).update(progress=progress, message=message)
+
+
+class OptimizationRun(models.Model):
+    """Timings and counters of one optimizer run (see routes.instrumentation)"""
+    date = models.DateField()
+    routes = models.ManyToManyField('deliveries.Route', related_name='optimization_runs', blank=True)
+    routing_provider = models.CharField(max_length=30)
+    order_count = models.PositiveIntegerField(default=0)
+    truck_count = models.PositiveIntegerField(default=0)
+    route_count = models.PositiveIntegerField(default=0)
+    total_distance_km = models.FloatField(default=0)
+    duration_seconds = models.FloatField(default=0)
+    phases = models.JSONField(default=dict, blank=True)
+    phase_queries = models.JSONField(default=dict, blank=True)
+    routing_calls = models.PositiveIntegerField(default=0)
+    routing_seconds = models.FloatField(default=0)
+    cache_hits = models.PositiveIntegerField(default=0)
+    cache_misses = models.PositiveIntegerField(default=0)
+    haversine_fallbacks = models.PositiveIntegerField(default=0)
+    query_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Optimization run {self.id} for {self.date}"
+    
+    def as_dict(self):
+        return {
+            'id': self.id,
+            'date': self.date.isoformat(),
+            'routing_provider': self.routing_provider,
+            'order_count': self.order_count,
+            'truck_count': self.truck_count,
+            'route_count': self.route_count,
+            'total_distance_km': self.total_distance_km,
+            'duration_seconds': self.duration_seconds,
+            'phases': self.phases,
+            'phase_queries': self.phase_queries,
+            'routing_calls': self.routing_calls,
+            'routing_seconds': self.routing_seconds,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'haversine_fallbacks': self.haversine_fallbacks,
+            'query_count': self.query_count,
+            'created_at': self.created_at.isoformat(),
+        }
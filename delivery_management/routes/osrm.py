@@ -0,0 +1,220 @@
+"""Asynchronous OSRM client with connection pooling, retries and a circuit breaker
+
+All requests go through one aiohttp session owned by a background event loop,
+so keep-alive connections are reused across optimization runs in the same
+process. Synchronous callers (the optimizer) use the ``fill`` and ``route``
+facades, which block until the coroutines finish.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+from yarl import URL
+
+from .distance import Coordinate, DistanceMatrix, estimate_cells
+
+logger = logging.getLogger(__name__)
+
+
+class RetryableError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stop calling a failing server for a while instead of waiting out timeouts
+
+    After ``failure_threshold`` consecutive failures the breaker opens and
+    ``allow()`` returns False until ``reset_timeout`` seconds have passed.
+    Then a single trial request is let through (half-open); its outcome
+    closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial_running:
+                    logger.warning("OSRM circuit breaker opened after %s failures", self.failures)
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class OSRMClient:
+    """Table and route lookups against an OSRM server"""
+
+    def __init__(self, base_url: str, profile: str = 'driving', max_table_size: int = 100, concurrency: int = 8,
+                 timeout: float = 10, retries: int = 2, backoff: float = 0.5, breaker: Optional[CircuitBreaker] = None):
+        self.base_url = base_url.rstrip('/')
+        self.profile = profile
+        # A request carries its sources and destinations, so each side gets half the limit
+        self.chunk_size = max(1, max_table_size // 2)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.request_count = 0
+
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    # Synchronous facade
+
+    def fill(self, matrix: DistanceMatrix, missing: Optional[np.ndarray] = None) -> np.ndarray:
+        """Fill the cells flagged in ``missing`` (all by default); returns a mask of the cells the server answered"""
+        return matrix.fill_from(self.fill_cells, missing)
+
+    def fill_cells(self, points: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(distances km, durations s, answered) from points[rows[i]] to points[cols[i]], falling back to haversine
+
+        Cells are grouped into blocks of up to ``chunk_size`` sources by
+        ``chunk_size`` destinations of the coordinate list, and each block
+        asks only for the sources and destinations its cells use, at most
+        ``concurrency`` requests at a time. Cells of a failed block, and
+        pairs the server cannot route, keep their haversine estimates and
+        are False in ``answered``.
+        """
+        return self._run(self._fill_cells(points, rows, cols))
+
+    def route(self, start: Coordinate, end: Coordinate) -> Optional[Tuple[float, float]]:
+        """(distance km, duration s) of the driving route, or None if OSRM could not answer"""
+        return self._run(self._route(start, end))
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self._session = self._semaphore = None
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='osrm-client', daemon=True).start()
+                self._session, self._semaphore = asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return session, asyncio.Semaphore(self.concurrency)
+
+    # Coroutines
+
+    async def _fill_cells(self, points: np.ndarray, rows: np.ndarray, cols: np.ndarray):
+        distances, durations = estimate_cells(points, rows, cols)
+        fetched = np.zeros(len(rows), dtype=bool)
+        if not len(rows):
+            return distances, durations, fetched
+
+        chunks = len(points) // self.chunk_size + 1
+        blocks = rows // self.chunk_size * chunks + cols // self.chunk_size
+        order = np.argsort(blocks, kind='stable')
+        starts = np.flatnonzero(np.r_[True, blocks[order][1:] != blocks[order][:-1]])
+        groups = np.split(order, starts[1:])
+        requests = [(np.unique(rows[cells]), np.unique(cols[cells])) for cells in groups]
+        answers = await asyncio.gather(*(self._table(points, s.tolist(), d.tolist()) for s, d in requests))
+
+        for cells, (sources, destinations), answer in zip(groups, requests, answers):
+            if answer is None:
+                continue
+            # Unroutable pairs come back as null, which numpy reads as nan
+            table = np.array(answer['distances'], dtype=float) / 1000  # Convert to km
+            times = np.array(answer['durations'], dtype=float)
+            i, j = np.searchsorted(sources, rows[cells]), np.searchsorted(destinations, cols[cells])
+            answered = ~(np.isnan(table[i, j]) | np.isnan(times[i, j]))
+            cells, i, j = cells[answered], i[answered], j[answered]
+            distances[cells], durations[cells] = table[i, j], times[i, j]
+            fetched[cells] = True
+
+        return distances, durations, fetched
+
+    async def _table(self, points: np.ndarray, sources: List[int], destinations: List[int]) -> Optional[dict]:
+        # Diagonal blocks share their coordinates, so send them once
+        block_indexes = list(dict.fromkeys(sources + destinations))
+        position = {index: i for i, index in enumerate(block_indexes)}
+        coords = ';'.join(f"{lon},{lat}" for lat, lon in points[block_indexes].tolist())
+        query = (
+            f"sources={';'.join(str(position[i]) for i in sources)}"
+            f"&destinations={';'.join(str(position[i]) for i in destinations)}"
+            f"&annotations=distance,duration"
+        )
+        return await self._get(f"{self.base_url}/table/v1/{self.profile}/{coords}?{query}")
+
+    async def _route(self, start: Coordinate, end: Coordinate) -> Optional[Tuple[float, float]]:
+        data = await self._get(
+            f"{self.base_url}/route/v1/{self.profile}/{start[1]},{start[0]};{end[1]},{end[0]}?overview=false"
+        )
+        if data is None:
+            return None
+        route = data['routes'][0]
+        return route['distance'] / 1000, route['duration']
+
+    async def _get(self, url: str) -> Optional[dict]:
+        """GET an OSRM response with retries; None when the server cannot answer"""
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                return None
+            try:
+                async with self._semaphore:
+                    self.request_count += 1
+                    async with self._session.get(URL(url, encoded=True)) as response:
+                        if response.status >= 500 or response.status == 429:
+                            raise RetryableError(f"HTTP {response.status}")
+                        data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RetryableError, ValueError) as exc:
+                self.breaker.record_failure()
+                logger.info("OSRM request failed (attempt %s): %s", attempt + 1, exc)
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            self.breaker.record_success()
+            # NoRoute/NoSegment etc. are answers, not server failures
+            return data if data.get('code') == 'Ok' else None
+        return None
+
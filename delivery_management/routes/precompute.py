@@ -0,0 +1,62 @@
+"""Road distances between the depots and every active customer, computed ahead of planning
+
+``build_precomputed_matrix`` writes a float32 matrix with
+``DistanceMatrix.save``; the optimizer memory-maps it (see
+``providers.get_precomputed_matrix``) so planning over known customers needs
+no routing calls at all. Cells the provider does not answer are saved as
+NaN, so they are never mistaken for road values. A rebuild only fetches
+rows and columns of coordinates the previous matrix did not have, and the
+NaN cells again.
+"""
+import shutil
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from deliveries.models import Customer, as_float
+from .batch import get_depots
+from .distance import Coordinate, DistanceMatrix
+from .providers import RoutingProvider, get_routing_provider
+
+
+def matrix_coordinates() -> List[Coordinate]:
+    """Depots first, then active customers by id, so the layout is the same for the same data"""
+    coordinates = list(get_depots().values())
+    customers = Customer.objects.filter(is_active=True).order_by('id')
+    coordinates.extend(customers.values_list(as_float('latitude'), as_float('longitude')))
+    return coordinates
+
+
+def build_precomputed_matrix(path: str, provider: Optional[RoutingProvider] = None,
+                             rebuild: bool = False) -> Tuple[DistanceMatrix, int, int]:
+    """Compute the matrix and save it under ``path``; returns it with the number of cells fetched and failed
+
+    Cells of a matrix already saved there are reused unless ``rebuild``.
+    The new files are written next to the old ones and swapped in, so
+    processes planning meanwhile keep reading a complete matrix.
+    """
+    provider = provider or get_routing_provider()
+    directory = Path(path)
+    matrix = DistanceMatrix(matrix_coordinates(), dtype=np.float32)
+
+    missing = ~np.eye(len(matrix), dtype=bool)
+    if not rebuild and (directory / 'distances.npy').exists():
+        missing &= ~matrix.copy_from(DistanceMatrix.load(directory))
+    fetched = np.zeros_like(missing)
+    if missing.any():
+        fetched = provider.fill(matrix, missing)
+    failed = missing & ~fetched
+    matrix.distances[failed] = np.nan
+    matrix.durations[failed] = np.nan
+
+    partial = directory.with_name(directory.name + '.partial')
+    previous = directory.with_name(directory.name + '.previous')
+    shutil.rmtree(partial, ignore_errors=True)
+    matrix.save(partial)
+    if directory.exists():
+        shutil.rmtree(previous, ignore_errors=True)
+        directory.rename(previous)
+    partial.rename(directory)
+    shutil.rmtree(previous, ignore_errors=True)
+    return matrix, int(fetched.sum()), int(failed.sum())
@@ -0,0 +1,227 @@
+"""Routing providers: where road distances and durations come from
+
+The provider is chosen with the ROUTING_PROVIDER setting:
+
+* ``osrm``: an OSRM server, typically self-hosted next to the app
+* ``matrix_file``: a precomputed matrix saved with ``DistanceMatrix.save``;
+  coordinates it does not cover fall back to haversine
+* ``haversine``: straight-line estimates, no network and fully deterministic
+
+Every provider times its own calls, so slow routing shows up in ``latency()``.
+"""
+import atexit
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .distance import Coordinate, DistanceMatrix, estimate_cells, haversine_distance, haversine_duration
+from .osrm import OSRMClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    'BACKEND': 'osrm',
+    'URL': 'http://localhost:5000',
+    'PROFILE': 'driving',
+    'MAX_TABLE_SIZE': 100,
+    'CONCURRENCY': 8,
+    'TIMEOUT': 10,
+    'RETRIES': 2,
+    'MATRIX_PATH': None,
+    'PRECOMPUTED_MATRIX_PATH': None,
+}
+
+
+class RoutingProvider:
+    """Base class; subclasses implement ``_fill_cells`` and ``_route``
+
+    ``cache_results`` marks providers whose answers are worth keeping in the
+    distance cache. ``road_distances`` is False for providers that only
+    estimate, which lets the optimizer skip building a matrix at all.
+    """
+
+    name = None
+    cache_results = False
+    road_distances = True
+
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def fill(self, matrix: DistanceMatrix, missing: Optional[np.ndarray] = None) -> np.ndarray:
+        """Fill the cells flagged in ``missing`` (all by default); returns a mask of road answers"""
+        return matrix.fill_from(self.fill_cells, missing)
+
+    def fill_cells(self, points: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(distances km, durations s, answered) from points[rows[i]] to points[cols[i]]
+
+        Cells the provider cannot answer with a road distance hold
+        great-circle estimates and are False in ``answered``.
+        """
+        with self._timed():
+            return self._fill_cells(points, np.asarray(rows, dtype=int), np.asarray(cols, dtype=int))
+
+    def route(self, start: Coordinate, end: Coordinate) -> Optional[Tuple[float, float]]:
+        """(distance km, duration s) between two points, or None if the provider cannot answer"""
+        with self._timed():
+            return self._route(start, end)
+
+    def latency(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'total_ms': round(self.total_seconds * 1000, 3),
+                'mean_ms': round(self.total_seconds * 1000 / self.calls, 3) if self.calls else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 3),
+            }
+
+    @contextmanager
+    def _timed(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.calls += 1
+                self.total_seconds += elapsed
+                self.max_seconds = max(self.max_seconds, elapsed)
+            logger.debug("%s routing call took %.1f ms", self.name, elapsed * 1000)
+
+    def _fill_cells(self, points: np.ndarray, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def _route(self, start: Coordinate, end: Coordinate) -> Optional[Tuple[float, float]]:
+        raise NotImplementedError
+
+
+class OSRMProvider(RoutingProvider):
+    name = 'osrm'
+    cache_results = True
+
+    def __init__(self, client: OSRMClient):
+        super().__init__()
+        self.client = client
+
+    def _fill_cells(self, points, rows, cols):
+        return self.client.fill_cells(points, rows, cols)
+
+    def _route(self, start, end):
+        return self.client.route(start, end)
+
+
+class MatrixFileProvider(RoutingProvider):
+    """Serve distances from a saved matrix, memory-mapped so it is never copied whole"""
+
+    name = 'matrix_file'
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.matrix = DistanceMatrix.load(path)
+
+    def _fill_cells(self, points, rows, cols):
+        distances, durations = estimate_cells(points, rows, cols)
+        positions = np.array([self.matrix.index.get(tuple(point), -1) for point in points.tolist()], dtype=int)
+        sources, destinations = positions[rows], positions[cols]
+
+        # Cells between two covered coordinates come from the file unless NaN there, the rest are estimated
+        covered = np.flatnonzero((sources >= 0) & (destinations >= 0))
+        stored = self.matrix.distances[sources[covered], destinations[covered]]
+        fetched = np.zeros(len(rows), dtype=bool)
+        fetched[covered] = ~np.isnan(stored)
+        distances[fetched] = self.matrix.distances[sources[fetched], destinations[fetched]]
+        durations[fetched] = self.matrix.durations[sources[fetched], destinations[fetched]]
+        return distances, durations, fetched
+
+    def _route(self, start, end):
+        if start in self.matrix and end in self.matrix and not math.isnan(self.matrix.distance(start, end)):
+            return self.matrix.distance(start, end), self.matrix.duration(start, end)
+        return None
+
+
+class HaversineProvider(RoutingProvider):
+    name = 'haversine'
+    road_distances = False
+
+    def _fill_cells(self, points, rows, cols):
+        distances, durations = estimate_cells(points, rows, cols)
+        return distances, durations, np.zeros(len(rows), dtype=bool)
+
+    def _route(self, start, end):
+        distance = haversine_distance(start, end)
+        return distance, haversine_duration(distance)
+
+
+def get_routing_settings() -> dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, 'ROUTING_PROVIDER', {})}
+
+
+def build_routing_provider(backend: Optional[str] = None) -> RoutingProvider:
+    """Create a provider from ROUTING_PROVIDER, optionally overriding its BACKEND"""
+    config = get_routing_settings()
+    backend = backend or config['BACKEND']
+    if backend == 'osrm':
+        client = OSRMClient(
+            config['URL'],
+            profile=config['PROFILE'],
+            max_table_size=config['MAX_TABLE_SIZE'],
+            concurrency=config['CONCURRENCY'],
+            timeout=config['TIMEOUT'],
+            retries=config['RETRIES']
+        )
+        atexit.register(client.close)
+        return OSRMProvider(client)
+    if backend == 'matrix_file':
+        if not config['MATRIX_PATH']:
+            raise ValueError("ROUTING_PROVIDER['MATRIX_PATH'] is required for the matrix_file backend")
+        return MatrixFileProvider(config['MATRIX_PATH'])
+    if backend == 'haversine':
+        return HaversineProvider()
+    raise ValueError(f"Unknown routing provider backend '{backend}'")
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_routing_provider(backend: Optional[str] = None) -> RoutingProvider:
+    """Return the process-wide provider, so connection pools and loaded matrices are reused"""
+    backend = backend or get_routing_settings()['BACKEND']
+    with _providers_lock:
+        if backend not in _providers:
+            _providers[backend] = build_routing_provider(backend)
+        return _providers[backend]
+
+
+_precomputed = {}
+
+
+def get_precomputed_matrix() -> Optional[DistanceMatrix]:
+    """The matrix written by ``manage.py build_distance_matrix``, memory-mapped once per process
+
+    Returns None when PRECOMPUTED_MATRIX_PATH is not set or nothing was
+    built there yet. A rebuilt matrix is picked up on the next call.
+    """
+    path = get_routing_settings()['PRECOMPUTED_MATRIX_PATH']
+    if not path:
+        return None
+    try:
+        version = os.stat(os.path.join(path, 'distances.npy')).st_mtime_ns
+    except OSError:
+        logger.warning("No precomputed distance matrix at %s; run manage.py build_distance_matrix", path)
+        return None
+    with _providers_lock:
+        if _precomputed.get('key') != (path, version):
+            _precomputed['key'] = (path, version)
+            _precomputed['matrix'] = DistanceMatrix.load(path)
+        return _precomputed['matrix']
@@ -0,0 +1,48 @@
+"""Compact order records for planning runs
+
+The optimizer reads an order's id, weight, priority, requested date and
+four coordinates. ``order_records`` loads exactly those with one
+values_list query, coordinates cast to floats in the database, instead of
+full DeliveryOrder instances with their addresses and instructions.
+Routes are persisted by order id, so records never have to be turned back
+into model instances.
+"""
+from datetime import date
+from typing import List
+
+from django.db.models import QuerySet
+
+from deliveries.models import as_float
+from .distance import Coordinate
+
+
+class OrderRecord:
+    """The fields of a DeliveryOrder the optimizer uses, without the model instance"""
+
+    __slots__ = ('id', 'weight_kg', 'priority', 'requested_delivery_date', 'status', 'pickup_point', 'delivery_point')
+
+    def __init__(self, id: int, weight_kg: int, priority: str, requested_delivery_date: date, status: str,
+                 pickup_point: Coordinate, delivery_point: Coordinate):
+        self.id = id
+        self.weight_kg = weight_kg
+        self.priority = priority
+        self.requested_delivery_date = requested_delivery_date
+        self.status = status
+        self.pickup_point = pickup_point
+        self.delivery_point = delivery_point
+
+    def __repr__(self):
+        return f"OrderRecord({self.id})"
+
+
+def order_records(orders: QuerySet) -> List[OrderRecord]:
+    """Records of the DeliveryOrder queryset ``orders``, in its order, from a single query"""
+    rows = orders.values_list(
+        'id', 'weight_kg', 'priority', 'requested_delivery_date', 'status',
+        as_float('pickup_latitude'), as_float('pickup_longitude'),
+        as_float('delivery_latitude'), as_float('delivery_longitude')
+    )
+    return [
+        OrderRecord(id, weight, priority, requested, status, (pickup_lat, pickup_lon), (delivery_lat, delivery_lon))
+        for id, weight, priority, requested, status, pickup_lat, pickup_lon, delivery_lat, delivery_lon in rows
+    ]
@@ -0,0 +1,99 @@
+"""Arrival times along routes, and the deadlines priority orders must meet
+
+Times are seconds after the truck leaves the factory. Every order is a
+pickup followed by its delivery; the ETA of an order is the arrival at its
+delivery. Stops are numbered as in local search: 0 is the factory and the
+order at position i of the run is stop i + 1.
+"""
+import math
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from deliveries.models import DeliveryOrder
+
+# Latest delivery, in minutes after the day starts, for orders due on the planned date
+PRIORITY_DEADLINE_MINUTES = {
+    'urgent': 2 * 60,
+    'high': 4 * 60,
+}
+
+
+def order_deadline(order: DeliveryOrder, date, deadlines: Dict[str, int]) -> float:
+    """Seconds after departure by which the order should be delivered, inf when it can wait
+
+    Orders requested for a later date never have a deadline; overdue ones
+    are treated as urgent whatever their priority.
+    """
+    if order.requested_delivery_date > date:
+        return math.inf
+    minutes = deadlines.get(order.priority)
+    if order.requested_delivery_date < date:
+        minutes = min(minutes or math.inf, deadlines.get('urgent', math.inf))
+    return math.inf if minutes is None else minutes * 60
+
+
+class Schedule:
+    """Travel and service times of a run's orders
+
+    ``travel(a, b)`` is the driving time in seconds from leaving stop a to
+    arriving at stop b: an order is left from its delivery and entered at
+    its pickup. ``legs[i]`` is the time from pickup to delivery of order i.
+
+    An order that would be late even on a trip of its own cannot be helped
+    by any sequence, so ``summary`` ignores its deadline rather than let it
+    block every merge; ``arrivals`` and ``late`` still hold it to it.
+    """
+
+    def __init__(self, travel: Callable[[int, int], float], legs: Sequence[float], deadlines: Sequence[float],
+                 pickup_service: float = 5 * 60, delivery_service: float = 10 * 60):
+        self.travel = travel
+        self.legs = legs
+        self.deadlines = deadlines
+        self.pickup_service = pickup_service
+        self.delivery_service = delivery_service
+        self.outbound = [travel(0, i + 1) for i in range(len(legs))]
+        self.limits = [
+            deadline if self.outbound[i] + pickup_service + legs[i] <= deadline else math.inf
+            for i, deadline in enumerate(deadlines)
+        ]
+
+    def summary(self, sequence: Sequence[int]) -> Tuple[float, float]:
+        """(span, slack) of orders driven in sequence, timed from arriving at the first pickup
+
+        ``span`` ends when the last delivery is done. ``slack`` is the least
+        time any order could still be delayed before missing its deadline,
+        before adding the drive from the factory to the first pickup. Orders
+        that cannot be on time anyway do not count.
+        """
+        time, slack, previous = 0.0, math.inf, None
+        for i in sequence:
+            if previous is not None:
+                time += self.travel(previous + 1, i + 1)
+            time += self.pickup_service + self.legs[i]
+            slack = min(slack, self.limits[i] - time)
+            time += self.delivery_service
+            previous = i
+        return time, slack
+
+    def arrivals(self, sequence: Sequence[int]) -> Tuple[List[float], float]:
+        """ETA of every order in sequence and the duration of the whole trip back to the factory"""
+        etas, time, previous = [], 0.0, 0
+        for i in sequence:
+            time += self.travel(previous, i + 1) + self.pickup_service + self.legs[i]
+            etas.append(time)
+            time += self.delivery_service
+            previous = i + 1
+        return etas, time + self.travel(previous, 0) if sequence else 0.0
+
+    def late(self, sequence: Sequence[int]) -> int:
+        """Number of orders in sequence that miss their deadline"""
+        etas, _ = self.arrivals(sequence)
+        return sum(eta > self.deadlines[i] for i, eta in zip(sequence, etas))
+
+    def avoidable_late(self, sequence: Sequence[int]) -> int:
+        """Number of orders in sequence that miss a deadline they could meet on a trip of their own"""
+        etas, _ = self.arrivals(sequence)
+        return sum(eta > self.limits[i] for i, eta in zip(sequence, etas))
+
+    def lateness(self, first: int, slack: float) -> float:
+        """How late the worst order of a summarised sequence starting with order ``first`` is; negative while on time"""
+        return self.outbound[first] - slack
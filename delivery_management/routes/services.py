@@ -1,223 +1,655 @@
-import math
-import requests
-from typing import List, Dict, Tuple
+import heapq
+import time
+import numpy as np
+from typing import Callable, Iterator, List, Optional, Tuple
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from deliveries.models import DeliveryOrder, Route, RouteStop, Truck
-from datetime import date
+from deliveries.signals import order_status_changed
+from datetime import date, datetime, time as clock, timedelta
+from .cache import get_distance_cache
+from .distance import DistanceMatrix, SparseDistanceMatrix, haversine_distance, haversine_duration, haversine_matrix, haversine_pairs
+from .instrumentation import RunMetrics
+from .local_search import LocalSearch
+from .merging import RouteMerger
+from .models import OptimizationRun
+from .providers import RoutingProvider, get_precomputed_matrix, get_routing_provider
+from .scheduling import PRIORITY_DEADLINE_MINUTES, Schedule, order_deadline
+from .spatial import OrderIndex
 
 class RouteOptimizationService:
-    def __init__(self, factory_location=(52.5200, 13.4050), truck_capacity=1500):
-        self.factory_location = factory_location
-        self.truck_capacity = truck_capacity
-        self.osrm_endpoint = "http://router.project-osrm.org/route/v1/driving/"
-        self.distance_cache = {}
-
-    def optimize_daily_routes(self, date: date, trucks: List[Truck], orders: List[DeliveryOrder]) -> List[Route]:
-        """Optimize routes with manual truck configuration"""
-        if not orders:
-            return []
+    def __init__(self, factory_location=(52.5200, 13.4050),
+                 routing_provider: Optional[RoutingProvider] = None, savings_block_size=256, savings_neighbours=40,
+                 distance_cache=None, bulk_batch_size=500, shared_matrix=None, local_search_budget=0.5,
+                 savings_radius_km=None, day_start=clock(8, 0), pickup_service_minutes=5,
+                 delivery_service_minutes=10, priority_deadlines=None):
+        self.factory_location = tuple(factory_location)
+        self.savings_block_size = savings_block_size
+        self.savings_neighbours = savings_neighbours
+        # Orders with no points this close are never scored as a pair; None relies on savings_neighbours alone
+        self.savings_radius_km = savings_radius_km
+        self.bulk_batch_size = bulk_batch_size
+        # Seconds spent improving merged routes; 0 or None skips the phase
+        self.local_search_budget = local_search_budget
+        # Trucks leave the factory at day_start; ETAs add the minutes spent at each pickup and delivery
+        self.day_start = day_start
+        self.pickup_service_minutes = pickup_service_minutes
+        self.delivery_service_minutes = delivery_service_minutes
+        # Minutes after day_start by which orders of each priority must be delivered
+        self.priority_deadlines = PRIORITY_DEADLINE_MINUTES if priority_deadlines is None else priority_deadlines
+        # Defaults to the provider configured by the ROUTING_PROVIDER setting
+        self.routing_provider = routing_provider or get_routing_provider()
+        self.distance_cache = distance_cache if distance_cache is not None else get_distance_cache()
+        self.distance_matrix = None
+        # Read-only matrix prepared by the caller, else the precomputed one, if built;
+        # cells it holds road values for are never looked up again
+        self.shared_matrix = shared_matrix if shared_matrix is not None else get_precomputed_matrix()
+        self.metrics = RunMetrics()
+        self.last_run = None
 
-        # Calculate savings matrix
-        savings = self._calculate_savings_matrix(orders)
+    def optimize_daily_routes(self, date: date, trucks: List[Truck], orders: List[DeliveryOrder],
+                              progress: Optional[Callable[[int, str], None]] = None) -> List[Route]:
+        """Optimize routes with manual truck configuration
         
-        # Create initial routes (one order per route)
-        routes = [[order] for order in orders]
+        ``orders`` may be DeliveryOrder instances or the lighter OrderRecords
+        of ``records.order_records``; stops are written by order id.
+        ``progress`` is called with (percent, message) as each phase finishes.
+        Timings and counters of the run are stored as an OptimizationRun,
+        available afterwards as ``self.last_run``.
+        """
+        if not orders:
+            return []
+        report = progress or (lambda percent, message: None)
         
-        # Merge routes based on savings
-        optimized_routes = self._merge_routes(routes, savings, trucks)
+        metrics = self.metrics = RunMetrics()
+        provider_before = self.routing_provider.latency()
+        cache_before = (self.distance_cache.hits, self.distance_cache.misses)
+        started = time.perf_counter()
         
-        # Create Route objects
-        django_routes = []
-        for i, (route_orders, truck) in enumerate(optimized_routes):
-            if route_orders and truck:
-                route = self._create_route(
-                    name=f"Optimized Route {i+1}",
-                    date=date,
-                    truck=truck,
-                    orders=route_orders
-                )
-                django_routes.append(route)
+        with metrics.count_queries():
+            # Create initial routes (one order per route) and pack them onto the fleet
+            with metrics.phase('assignment'):
+                routes = [[order] for order in orders]
+                merger = RouteMerger(routes, trucks)
+            
+            # Calculate savings between orders sharing a truck
+            with metrics.phase('savings'):
+                savings = self._calculate_savings_matrix(orders, groups=merger.truck_groups())
+            report(50, 'Savings calculated')
+            
+            # Merge routes based on savings, never making a priority order late
+            with metrics.phase('merge'):
+                merger.use_schedule(self._build_schedule(date, orders))
+                optimized_routes = self._merge_routes(merger, savings)
+                metrics.count('late_merge_rejections', merger.late_rejections)
+            report(70, 'Routes merged')
+            
+            # Shorten the merged routes within the time budget
+            with metrics.phase('improve'):
+                optimized_routes = self._improve_routes(optimized_routes, savings, date=date)
+            report(80, 'Routes improved')
+            
+            # Create Route objects
+            with metrics.phase('persist'):
+                planned = [
+                    (f"Optimized Route {i+1}", truck, route_orders)
+                    for i, (route_orders, truck) in enumerate(optimized_routes)
+                    if route_orders and truck
+                ]
+                django_routes = self._create_routes(date, planned)
         
+        provider_after = self.routing_provider.latency()
+        self.last_run = self._record_run(
+            date, trucks, orders, django_routes,
+            duration=time.perf_counter() - started,
+            routing_calls=provider_after['calls'] - provider_before['calls'],
+            routing_ms=provider_after['total_ms'] - provider_before['total_ms'],
+            cache_hits=self.distance_cache.hits - cache_before[0],
+            cache_misses=self.distance_cache.misses - cache_before[1]
+        )
+        report(100, 'Routes saved')
         return django_routes
 
-    def _calculate_savings_matrix(self, orders: List[DeliveryOrder]) -> Dict:
-        """Calculate Clarke-Wright savings for all order pairs"""
-        savings = {}
+    def _record_run(self, date: date, trucks: List[Truck], orders: List[DeliveryOrder], routes: List[Route],
+                    duration: float, routing_calls: int, routing_ms: float, cache_hits: int,
+                    cache_misses: int) -> OptimizationRun:
+        """Store the metrics of the finished run and link it to its routes"""
+        metrics = self.metrics.as_dict()
+        run = OptimizationRun.objects.create(
+            date=date,
+            routing_provider=self.routing_provider.name,
+            order_count=len(orders),
+            truck_count=len(trucks),
+            route_count=len(routes),
+            total_distance_km=round(sum(float(route.total_distance_km) for route in routes), 2),
+            duration_seconds=round(duration, 6),
+            phases=metrics['phases'],
+            phase_queries=metrics['phase_queries'],
+            routing_calls=routing_calls,
+            routing_seconds=round(routing_ms / 1000, 6),
+            cache_hits=cache_hits,
+            cache_misses=cache_misses,
+            haversine_fallbacks=metrics['counters'].get('haversine_fallbacks', 0),
+            query_count=metrics['queries']
+        )
+        OptimizationRun.routes.through.objects.bulk_create([
+            OptimizationRun.routes.through(optimizationrun=run, route=route) for route in routes
+        ])
+        return run
+
+    def _order_coordinates(self, orders: List[DeliveryOrder]) -> Tuple[np.ndarray, np.ndarray]:
+        """Pickup and delivery coordinates as (N, 2) float arrays"""
+        pickups = np.array([order.pickup_point for order in orders], dtype=float).reshape(-1, 2)
+        deliveries = np.array([order.delivery_point for order in orders], dtype=float).reshape(-1, 2)
+        return pickups, deliveries
+
+    def departure(self, date: date) -> datetime:
+        """When trucks leave the factory on ``date``; ETAs are counted from here"""
+        departure = datetime.combine(date, self.day_start)
+        return timezone.make_aware(departure) if settings.USE_TZ else departure
+
+    def _build_schedule(self, date: date, orders: List[DeliveryOrder],
+                        matrix: Optional[SparseDistanceMatrix] = None) -> Schedule:
+        """Travel times, service times and deadlines of ``orders`` for a plan on ``date``
         
-        # Pre-calculate distances from factory
-        factory_distances = {}
-        for order in orders:
-            pickup_coord = (float(order.pickup_latitude), float(order.pickup_longitude))
-            delivery_coord = (float(order.delivery_latitude), float(order.delivery_longitude))
+        Durations come from ``matrix``, by default this run's distance
+        matrix, when it covers the orders, otherwise from straight-line
+        distances at the fallback speed.
+        """
+        pickups, deliveries = self._order_coordinates(orders)
+        factory = np.array([self.factory_location], dtype=float)
+        entries, exits = np.vstack([factory, pickups]), np.vstack([factory, deliveries])
+        
+        matrix = matrix if matrix is not None else self.distance_matrix
+        if matrix is not None and matrix.covers(map(tuple, entries.tolist())) and matrix.covers(map(tuple, exits.tolist())):
+            entry_positions = [matrix.index[tuple(coord)] for coord in entries.tolist()]
+            exit_positions = [matrix.index[tuple(coord)] for coord in exits.tolist()]
             
-            factory_distances[order.id] = {
-                'pickup': self._get_road_distance(self.factory_location, pickup_coord),
-                'delivery': self._get_road_distance(self.factory_location, delivery_coord)
-            }
+            def travel(a, b):
+                return matrix.cell(exit_positions[a], entry_positions[b])[1]
+            
+            legs = matrix.lookup(entry_positions[1:], exit_positions[1:])[1].tolist()
+        else:
+            def travel(a, b):
+                return haversine_duration(haversine_distance(tuple(exits[a]), tuple(entries[b])))
+            
+            legs = haversine_duration(haversine_pairs(pickups, deliveries)).tolist()
+        
+        return Schedule(
+            travel,
+            legs,
+            [order_deadline(order, date, self.priority_deadlines) for order in orders],
+            pickup_service=self.pickup_service_minutes * 60,
+            delivery_service=self.delivery_service_minutes * 60
+        )
 
-        # Calculate savings for all pairs
-        for i, order1 in enumerate(orders):
-            for j, order2 in enumerate(orders[i+1:], i+1):
-                # Get coordinates
-                pickup1 = (float(order1.pickup_latitude), float(order1.pickup_longitude))
-                delivery1 = (float(order1.delivery_latitude), float(order1.delivery_longitude))
-                pickup2 = (float(order2.pickup_latitude), float(order2.pickup_longitude))
-                delivery2 = (float(order2.delivery_latitude), float(order2.delivery_longitude))
-
-                # Calculate all possible savings combinations
-                savings_combinations = [
-                    # Pickup to pickup
-                    (factory_distances[order1.id]['pickup'] + factory_distances[order2.id]['pickup'] - 
-                     self._get_road_distance(pickup1, pickup2)),
-                    
-                    # Pickup to delivery
-                    (factory_distances[order1.id]['pickup'] + factory_distances[order2.id]['delivery'] - 
-                     self._get_road_distance(pickup1, delivery2)),
-                    
-                    # Delivery to pickup
-                    (factory_distances[order1.id]['delivery'] + factory_distances[order2.id]['pickup'] - 
-                     self._get_road_distance(delivery1, pickup2)),
-                    
-                    # Delivery to delivery
-                    (factory_distances[order1.id]['delivery'] + factory_distances[order2.id]['delivery'] - 
-                     self._get_road_distance(delivery1, delivery2)),
-                ]
+    def _build_distance_matrix(self, pickups: np.ndarray, deliveries: np.ndarray,
+                               candidates: Optional[List[Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]]] = None) -> SparseDistanceMatrix:
+        """Road distances between the factory and the order locations that savings and routes can use
+        
+        ``candidates`` lists (members, pairs) as scored by
+        ``_calculate_savings_matrix``; only the factory's row and column,
+        each order's own pickup to delivery leg and the legs between
+        candidate orders get road distances. Only those cells are stored,
+        others are estimated when read. Without ``candidates`` every cell
+        is fetched.
+        """
+        coordinates = [self.factory_location]
+        for pickup, delivery in zip(pickups.tolist(), deliveries.tolist()):
+            coordinates.append(tuple(pickup))
+            coordinates.append(tuple(delivery))
+        
+        # The matrix of an earlier pass of this run may already cover them
+        matrix = self.distance_matrix
+        if matrix is None or not matrix.covers(coordinates):
+            matrix = SparseDistanceMatrix(coordinates, base=self.shared_matrix)
+        self._fetch_cells(matrix, *self._wanted_cells(matrix, pickups, deliveries, candidates))
+        return matrix
 
-                max_saving = max(savings_combinations)
-                if max_saving > 0:
-                    savings[(order1.id, order2.id)] = max_saving
+    def _wanted_cells(self, matrix: SparseDistanceMatrix, pickups: np.ndarray, deliveries: np.ndarray,
+                      candidates=None) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, columns) of the cells ``_build_distance_matrix`` asks road distances for"""
+        index = matrix.index
+        points = [
+            np.array([index[tuple(coord)] for coord in coords.tolist()], dtype=np.int64).reshape(-1)
+            for coords in (pickups, deliveries)
+        ]
+        if candidates is None:
+            candidates = [(np.arange(len(points[0])), None)]
+        factory = index[self.factory_location]
+        everything = np.concatenate([[factory], points[0], points[1]])
+        rows = [np.full(len(everything), factory), everything, points[0]]
+        cols = [everything, np.full(len(everything), factory), points[1]]
+        for members, pairs in candidates:
+            if pairs is None:
+                block = np.concatenate([points[0][members], points[1][members]])
+                rows.append(np.repeat(block, len(block)))
+                cols.append(np.tile(block, len(block)))
+                continue
+            i, j = pairs
+            # Both directions: merges may join the pair's routes either way round
+            for source in points:
+                for destination in points:
+                    rows.extend([source[i], source[j]])
+                    cols.extend([destination[j], destination[i]])
+        size = len(matrix)
+        cells = np.unique(np.concatenate(rows) * size + np.concatenate(cols))
+        rows, cols = np.divmod(cells, size)
+        off_diagonal = rows != cols
+        return rows[off_diagonal], cols[off_diagonal]
 
-        return savings
+    def _fetch_cells(self, matrix: SparseDistanceMatrix, rows, cols):
+        """Fetch road values for the cells at ``rows``, ``cols`` that the matrix only estimates
 
-    def _merge_routes(self, routes: List[List[DeliveryOrder]], savings: Dict, trucks: List[Truck]) -> List[Tuple[List[DeliveryOrder], Truck]]:
-        """Merge routes based on savings while respecting truck capacities"""
-        # Sort savings in descending order
-        sorted_savings = sorted(savings.items(), key=lambda x: x[1], reverse=True)
+        They are read from the distance cache, then the routing provider in
+        one batch. Cells neither can answer are not stored, so they stay
+        estimates and later lookups ask for them again.
+        """
+        provider = self.routing_provider
+        if not provider.road_distances:
+            return
+        rows, cols = (axis.ravel() for axis in np.broadcast_arrays(np.asarray(rows), np.asarray(cols)))
+        unknown = ~matrix.lookup(rows, cols)[2]
+        if not unknown.any():
+            return
+        rows, cols = rows[unknown], cols[unknown]
+        starts, ends = matrix.points[rows], matrix.points[cols]
+        if provider.cache_results:
+            distances, durations, found = self.distance_cache.load_cells(starts, ends)
+            matrix.set_cells(rows[found], cols[found], distances[found], durations[found])
+            rows, cols, starts, ends = rows[~found], cols[~found], starts[~found], ends[~found]
+            if not len(rows):
+                return
+        distances, durations, fetched = provider.fill_cells(matrix.points, rows, cols)
+        matrix.set_cells(rows[fetched], cols[fetched], distances[fetched], durations[fetched])
+        if provider.cache_results:
+            self.distance_cache.save_cells(starts[fetched], ends[fetched], distances[fetched], durations[fetched])
+        self.metrics.count('haversine_fallbacks', int((~fetched).sum()))
+
+    def _savings_function(self, pickups: np.ndarray, deliveries: np.ndarray,
+                          candidates=None) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+        """Return ``savings(rows, columns)``, the Clarke-Wright savings between orders at those positions
         
-        # Initialize truck assignments
-        truck_assignments = []
-        truck_capacities = {truck.id: self.truck_capacity for truck in trucks}
-        truck_utilization = {truck.id: 0 for truck in trucks}
+        Positions broadcast like numpy indexing: matching 1-D arrays score
+        pairs, ``rows[:, None]`` against ``columns[None, :]`` scores a block.
+        Pairs of an order with itself are set to -inf. With road distances,
+        only the cells ``candidates`` can score are fetched (see
+        ``_build_distance_matrix``).
+        """
+        points = {'pickup': pickups, 'delivery': deliveries}
         
-        # Assign routes to trucks
-        for route in routes:
-            route_weight = sum(order.weight_kg for order in route)
+        if self.routing_provider.road_distances or self.shared_matrix is not None:
+            matrix = self.distance_matrix = self._build_distance_matrix(pickups, deliveries, candidates)
+            index = matrix.index
+            positions = {
+                kind: np.array([index[tuple(coord)] for coord in coords.tolist()], dtype=int)
+                for kind, coords in points.items()
+            }
+            factory = index[self.factory_location]
+            
+            def legs(source, rows, destination, columns):
+                return matrix.lookup(positions[source][rows], positions[destination][columns])[0]
             
-            # Find available truck with enough capacity
-            assigned = False
-            for truck in trucks:
-                if truck_utilization[truck.id] + route_weight <= truck_capacities[truck.id]:
-                    truck_assignments.append((route, truck))
-                    truck_utilization[truck.id] += route_weight
-                    assigned = True
-                    break
+            from_factory = {kind: matrix.lookup(factory, positions[kind])[0] for kind in points}
+        else:
+            self.distance_matrix = None
             
-            if not assigned:
-                # No truck available, leave unassigned
-                truck_assignments.append((route, None))
-        
-        # Apply savings merges
-        for (order1_id, order2_id), saving in sorted_savings:
-            # Find routes containing these orders
-            route1_idx, route2_idx = None, None
-            for i, (route, _) in enumerate(truck_assignments):
-                if any(order.id == order1_id for order in route):
-                    route1_idx = i
-                if any(order.id == order2_id for order in route):
-                    route2_idx = i
+            def legs(source, rows, destination, columns):
+                return haversine_pairs(points[source][rows], points[destination][columns])
+            
+            factory = np.array([self.factory_location], dtype=float)
+            from_factory = {kind: haversine_matrix(factory, coords)[0] for kind, coords in points.items()}
+        
+        fp, fd = from_factory['pickup'], from_factory['delivery']
+        
+        def savings(rows, columns):
+            saving = np.maximum.reduce([
+                fp[rows] + fp[columns] - legs('pickup', rows, 'pickup', columns),
+                fp[rows] + fd[columns] - legs('pickup', rows, 'delivery', columns),
+                fd[rows] + fp[columns] - legs('delivery', rows, 'pickup', columns),
+                fd[rows] + fd[columns] - legs('delivery', rows, 'delivery', columns),
+            ])
+            saving[np.broadcast_to(rows == columns, saving.shape)] = -np.inf
+            self.metrics.count('savings_pairs', saving.size)
+            return saving
+        
+        return savings
+
+    def _calculate_savings_matrix(self, orders: List[DeliveryOrder], groups: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Calculate Clarke-Wright savings for the most promising order pairs
+        
+        Each order keeps only its ``savings_neighbours`` best partners (all of
+        them when that is None), so memory grows with N*k instead of N^2.
+        When ``groups`` is given, partners are limited to orders in the same
+        group and orders in group -1 get none.
+        Groups larger than a block are not scored pair by pair: a spatial
+        index proposes each order's 2 * ``savings_neighbours`` nearest orders,
+        or the orders within ``savings_radius_km`` when that is set, and only
+        those pairs are scored. Smaller groups are scored in full.
+        Returns parallel arrays (order1 ids, order2 ids, savings) holding only
+        positive savings, each unordered pair once with order1 listed before
+        order2 in ``orders``.
+        """
+        ids = np.array([order.id for order in orders])
+        pickups, deliveries = self._order_coordinates(orders)
+        if groups is None:
+            memberships = [np.arange(len(orders))]
+        else:
+            memberships = [np.nonzero(groups == group)[0] for group in np.unique(groups) if group != -1]
+        # Candidates come first so road distances are only fetched for the cells they need
+        candidates = [(members, self._neighbour_pairs(pickups, deliveries, members)) for members in memberships]
+        savings = self._savings_function(pickups, deliveries, candidates)
+        
+        firsts, seconds, values = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)]
+        for members, pairs in candidates:
+            if pairs is not None:
+                i, j = pairs
+                found = savings(i, j)
+                keep = found > 0
+                firsts.append(i[keep])
+                seconds.append(j[keep])
+                values.append(found[keep])
+                continue
             
-            # Skip if same route or not found
-            if route1_idx == route2_idx or route1_idx is None or route2_idx is None:
+            k = len(members) - 1 if self.savings_neighbours is None else min(self.savings_neighbours, len(members) - 1)
+            if k < 1:
                 continue
+            for start in range(0, len(members), self.savings_block_size):
+                rows = members[start:start + self.savings_block_size]
+                block = savings(rows[:, None], members[None, :])
+                if k < len(members) - 1:
+                    columns = np.argpartition(-block, k - 1, axis=1)[:, :k]
+                else:
+                    columns = np.broadcast_to(np.arange(len(members)), block.shape)
+                candidates = np.take_along_axis(block, columns, axis=1)
+                
+                # Only pairs where merging saves distance are worth keeping
+                r, c = np.nonzero(candidates > 0)
+                i, j = rows[r], members[columns[r, c]]
+                firsts.append(np.minimum(i, j))
+                seconds.append(np.maximum(i, j))
+                values.append(candidates[r, c])
+        
+        firsts, seconds, values = np.concatenate(firsts), np.concatenate(seconds), np.concatenate(values)
+        
+        # A pair can be a candidate of both its orders; keep its best saving once
+        ranking = np.lexsort((-values, seconds, firsts))
+        firsts, seconds, values = firsts[ranking], seconds[ranking], values[ranking]
+        first_of_pair = np.ones(len(values), dtype=bool)
+        first_of_pair[1:] = (firsts[1:] != firsts[:-1]) | (seconds[1:] != seconds[:-1])
+        
+        return ids[firsts[first_of_pair]], ids[seconds[first_of_pair]], values[first_of_pair]
+
+    def _neighbour_pairs(self, pickups: np.ndarray, deliveries: np.ndarray,
+                         members: np.ndarray) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Candidate pairs among ``members`` from a spatial index, or None when the group is scored in full"""
+        if self.savings_radius_km is None and (self.savings_neighbours is None or len(members) <= self.savings_block_size):
+            return None
+        index = OrderIndex(pickups[members], deliveries[members], self.factory_location)
+        if self.savings_radius_km is not None:
+            i, j = index.within(self.savings_radius_km)
+        else:
+            # The best savings are not always with the very closest orders, so look a little wider
+            i, j = index.nearest(2 * self.savings_neighbours)
+        return members[i], members[j]
+
+    def _merge_routes(self, merger: RouteMerger, savings: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> List[Tuple[List[DeliveryOrder], Truck]]:
+        """Merge routes based on savings while respecting truck capacities
+        
+        A second pass joins the routes that are left, across trucks where one
+        truck can take the other's load, using savings between route ends.
+        """
+        merger.merge_all(self._iter_savings(savings))
+        ends = merger.endpoint_orders()
+        if len(ends) > 2:
+            merger.merge_all(self._iter_savings(self._calculate_savings_matrix(ends)))
+        return merger.routes()
+
+    def _improve_routes(self, routes: List[Tuple[List[DeliveryOrder], Truck]],
+                        savings: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                        date: Optional[date] = None) -> List[Tuple[List[DeliveryOrder], Truck]]:
+        """Resequence stops and move orders between routes with local search
+        
+        Only routes with a truck take part. Orders whose routes share a savings
+        candidate pair are tried next to each other across routes. With a
+        ``date``, the improved routes are dropped again if they deliver more
+        priority orders late than the merged ones did.
+        """
+        if not self.local_search_budget:
+            return routes
+        active = [(route_orders, truck) for route_orders, truck in routes if route_orders and truck]
+        if not active:
+            return routes
+        
+        orders = [order for route_orders, _ in active for order in route_orders]
+        node = {order.id: i + 1 for i, order in enumerate(orders)}
+        # Stop 0 is the factory; an order is entered at its pickup and left from its delivery
+        pickups, deliveries = self._order_coordinates(orders)
+        factory = np.array([self.factory_location], dtype=float)
+        entries, exits = np.vstack([factory, pickups]), np.vstack([factory, deliveries])
+        
+        matrix = self.distance_matrix
+        if matrix is not None:
+            entry_positions = np.array([matrix.index[tuple(coord)] for coord in entries.tolist()])
+            exit_positions = np.array([matrix.index[tuple(coord)] for coord in exits.tolist()])
             
-            route1, truck1 = truck_assignments[route1_idx]
-            route2, truck2 = truck_assignments[route2_idx]
+            def legs(sources, destinations):
+                # Moves are priced with road distances, fetched as the search first asks for them
+                cells = np.ix_(exit_positions[sources], entry_positions[destinations])
+                self._fetch_cells(matrix, *cells)
+                return matrix.lookup(*cells)[0]
             
-            # Check if same truck and capacity allows merge
-            if truck1 and truck2 and truck1.id == truck2.id:
-                combined_weight = sum(order.weight_kg for order in route1) + sum(order.weight_kg for order in route2)
-                if combined_weight <= truck1.capacity_kg:
-                    # Merge routes
-                    merged_route = route1 + route2
-                    truck_assignments[route1_idx] = (merged_route, truck1)
-                    truck_assignments.pop(route2_idx)
+            # Every leg within a route is priced up front, so fetch those cells in one batch
+            stops = [[0] + [node[order.id] for order in route_orders] for route_orders, _ in active]
+            self._fetch_cells(
+                matrix,
+                np.concatenate([np.repeat(exit_positions[route], len(route)) for route in stops]),
+                np.concatenate([np.tile(entry_positions[route], len(route)) for route in stops])
+            )
+        else:
+            def legs(sources, destinations):
+                return haversine_matrix(exits[sources], entries[destinations])
+        
+        neighbours = {}
+        for order1_id, order2_id in zip(*(ids.tolist() for ids in savings[:2])):
+            if order1_id in node and order2_id in node:
+                neighbours.setdefault(node[order1_id], []).append(node[order2_id])
+                neighbours.setdefault(node[order2_id], []).append(node[order1_id])
+        
+        fleet = list({truck.id: truck for _, truck in active}.values())
+        vehicle = {truck.id: i for i, truck in enumerate(fleet)}
+        search = LocalSearch(
+            [[node[order.id] for order in route_orders] for route_orders, _ in active],
+            legs=legs,
+            weights=[0] + [order.weight_kg for order in orders],
+            capacities=[truck.capacity_kg for truck in fleet],
+            vehicles=[vehicle[truck.id] for _, truck in active],
+            neighbours=neighbours,
+            time_budget=self.local_search_budget
+        )
+        original = [[stop - 1 for stop in stops] for stops in search.routes]
+        improved = search.run()
+        for move, count in search.moves.items():
+            self.metrics.count(f'local_search_{move}', count)
+        
+        if date is not None:
+            schedule = self._build_schedule(date, orders)
+            late = sum(schedule.late(sequence) for sequence in original)
+            if sum(schedule.late([stop - 1 for stop in stops]) for stops in improved) > late:
+                self.metrics.count('local_search_reverted')
+                return routes
         
-        return truck_assignments
+        return [
+            ([orders[stop - 1] for stop in stops], truck)
+            for stops, (_, truck) in zip(improved, active)
+        ] + [(route_orders, truck) for route_orders, truck in routes if not (route_orders and truck)]
+
+    def _iter_savings(self, savings: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> Iterator[Tuple[int, int]]:
+        """Yield (order1 id, order2 id) pairs from best to worst saving
+        
+        A heap is built in O(S) and popped lazily instead of sorting every
+        saving up front.
+        """
+        firsts, seconds, values = savings
+        heap = list(zip((-values).tolist(), firsts.tolist(), seconds.tolist()))
+        heapq.heapify(heap)
+        while heap:
+            _, order1_id, order2_id = heapq.heappop(heap)
+            yield order1_id, order2_id
 
     def _create_route(self, name: str, date: date, truck: Truck, orders: List[DeliveryOrder]) -> Route:
         """Create a Route model instance with stops"""
-        route = Route.objects.create(
-            name=name,
-            truck=truck,
-            driver=truck.driver,
-            date=date,
-            is_optimized=True
-        )
+        return self._create_routes(date, [(name, truck, orders)])[0]
+
+    def _create_routes(self, date: date, planned: List[Tuple[str, Truck, List[DeliveryOrder]]]) -> List[Route]:
+        """Persist (name, truck, orders) routes with their stops in one transaction
         
-        # Create stops and calculate distance
-        total_distance = 0
-        last_location = self.factory_location
+        Routes and stops are written with bulk_create and every order status
+        with one UPDATE, so a failed run leaves nothing half-written. Stops
+        get their estimated arrival and routes their estimated duration,
+        counted from ``day_start`` on ``date``.
+        """
+        all_orders = [order for _, _, orders in planned for order in orders]
+        self._fetch_route_legs([orders for _, _, orders in planned])
+        schedule = self._build_schedule(date, all_orders)
+        departure = self.departure(date)
         
-        for stop_num, order in enumerate(orders, 1):
-            # Create stop
-            RouteStop.objects.create(
-                route=route,
-                delivery_order=order,
-                stop_number=stop_num
+        routes, stops, start, late = [], [], 0, 0
+        for name, truck, orders in planned:
+            sequence = list(range(start, start + len(orders)))
+            start += len(orders)
+            etas, duration = schedule.arrivals(sequence)
+            late += sum(eta > schedule.deadlines[i] for i, eta in zip(sequence, etas))
+            route = Route(
+                name=name,
+                truck=truck,
+                driver=truck.driver,
+                date=date,
+                is_optimized=True,
+                total_distance_km=round(self._route_distance(orders), 2),
+                estimated_duration_minutes=round(duration / 60)
             )
+            routes.append(route)
+            stops.extend(
+                RouteStop(
+                    route=route,
+                    delivery_order_id=order.id,
+                    stop_number=stop_num,
+                    estimated_arrival_time=departure + timedelta(seconds=round(eta))
+                )
+                for stop_num, (order, eta) in enumerate(zip(orders, etas), 1)
+            )
+        self.metrics.count('late_priority_orders', late)
+        
+        with transaction.atomic():
+            Route.objects.bulk_create(routes)
+            RouteStop.objects.bulk_create(stops, batch_size=self.bulk_batch_size)
             
-            # Update order status
-            order.status = 'assigned'
-            order.save()
-            
-            # Calculate distances
-            pickup = (float(order.pickup_latitude), float(order.pickup_longitude))
-            delivery = (float(order.delivery_latitude), float(order.delivery_longitude))
-            
-            total_distance += self._get_road_distance(last_location, pickup)
-            total_distance += self._get_road_distance(pickup, delivery)
+            # Update order statuses
+            order_ids = [order.id for _, _, orders in planned for order in orders]
+            DeliveryOrder.objects.filter(id__in=order_ids).exclude(
+                status__in=DeliveryOrder.FINAL_STATUSES
+            ).update(status='assigned')
+            order_status_changed.send(sender=DeliveryOrder, order_ids=order_ids, status='assigned')
+        
+        for _, _, orders in planned:
+            for order in orders:
+                order.status = 'assigned'
+        return routes
+
+    def _route_distance(self, orders: List[DeliveryOrder]) -> float:
+        """Length of factory -> pickup -> delivery -> ... -> factory in km"""
+        total_distance = 0
+        last_location = self.factory_location
+        
+        for order in orders:
+            pickup, delivery = order.pickup_point, order.delivery_point
+            total_distance += self._get_distance(last_location, pickup)
+            total_distance += self._get_distance(pickup, delivery)
             last_location = delivery
         
         # Return to factory
-        total_distance += self._get_road_distance(last_location, self.factory_location)
-        
-        route.total_distance_km = total_distance
-        route.save()
-        return route
+        total_distance += self._get_distance(last_location, self.factory_location)
+        return total_distance
 
-    def _get_road_distance(self, start: Tuple[float, float], end: Tuple[float, float]) -> float:
-        """Get road distance between two points using OSRM or haversine"""
-        cache_key = (start, end)
-        if cache_key in self.distance_cache:
-            return self.distance_cache[cache_key]
-        
-        try:
-            # OSRM API call
-            url = f"{self.osrm_endpoint}{start[1]},{start[0]};{end[1]},{end[0]}"
-            response = requests.get(url, timeout=5)
-            data = response.json()
-            
-            if data['code'] == 'Ok':
-                distance = data['routes'][0]['distance'] / 1000  # Convert to km
-                self.distance_cache[cache_key] = distance
+    def _get_distance(self, start: Tuple[float, float], end: Tuple[float, float]) -> float:
+        """Read a distance from the prefetched matrix, falling back to a single lookup"""
+        matrix = self.distance_matrix
+        if matrix is not None and start in matrix and end in matrix:
+            distance, _, known = matrix.cell(matrix.index[start], matrix.index[end])
+            if known:
                 return distance
-        except:
-            pass
+        return self._get_road_distance(start, end)
+
+    def _fetch_route_legs(self, routes: List[List[DeliveryOrder]]):
+        """Fetch road distances for every leg of the routes that the matrix only estimated, in one batch"""
+        matrix = self.distance_matrix
+        if matrix is None:
+            return
+        rows, cols = [], []
+        index, factory = matrix.index, self.factory_location
+        for orders in routes:
+            points = [factory] + [point for order in orders for point in (order.pickup_point, order.delivery_point)] + [factory]
+            if all(point in index for point in points):
+                positions = [index[point] for point in points]
+                rows.extend(positions[:-1])
+                cols.extend(positions[1:])
+        self._fetch_cells(matrix, np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64))
+
+    def _get_road_distance(self, start: Tuple[float, float], end: Tuple[float, float]) -> float:
+        """Get road distance between two points from the routing provider, falling back to haversine"""
+        provider = self.routing_provider
+        if provider.cache_results:
+            cached = self.distance_cache.get(start, end)
+            if cached is not None:
+                return cached[0]
+        
+        route = provider.route(start, end)
+        if route is None:
+            # Fallback to haversine distance (not cached so the provider is retried next time)
+            self.metrics.count('haversine_fallbacks')
+            return self._haversine_distance(start, end)
         
-        # Fallback to haversine distance
-        distance = self._haversine_distance(start, end)
-        self.distance_cache[cache_key] = distance
+        distance, duration = route
+        if provider.cache_results:
+            self.distance_cache.set(start, end, distance, duration)
         return distance
 
+    def _leg_distances(self, starts: List[Tuple[float, float]], ends: List[Tuple[float, float]]) -> np.ndarray:
+        """Road distances for matching (start, end) pairs, fetched as one batch
+
+        Pairs the shared matrix or the distance cache can answer are read
+        from there; the rest go to the routing provider in a single matrix
+        call that only asks for the missing cells.
+        """
+        if not starts:
+            return np.zeros(0)
+        matrix = SparseDistanceMatrix(list(starts) + list(ends), base=self.shared_matrix)
+        rows = np.array([matrix.index[start] for start in starts], dtype=np.int64)
+        cols = np.array([matrix.index[end] for end in ends], dtype=np.int64)
+        self._fetch_cells(matrix, rows, cols)
+        return matrix.lookup(rows, cols)[0]
+
+    def _sequence_matrix(self, orders: List[DeliveryOrder]) -> SparseDistanceMatrix:
+        """Matrix over the factory and ``orders`` with road values for driving them in sequence
+
+        Holds the factory to every pickup, each order's pickup to delivery,
+        each delivery to the next pickup and the last delivery back to the
+        factory: the cells ``_build_schedule`` reads for that sequence. They
+        are fetched like ``_leg_distances`` does.
+        """
+        points = [self.factory_location]
+        for order in orders:
+            points.extend([order.pickup_point, order.delivery_point])
+        matrix = SparseDistanceMatrix(points, base=self.shared_matrix)
+        positions = np.array([matrix.index[point] for point in points], dtype=np.int64)
+        factory, pickups, deliveries = positions[0], positions[1::2], positions[2::2]
+        rows = np.concatenate([np.full(len(pickups), factory), pickups, deliveries[:-1], deliveries[-1:]])
+        cols = np.concatenate([pickups, deliveries, pickups[1:], np.full(len(deliveries[-1:]), factory)])
+        self._fetch_cells(matrix, rows, cols)
+        return matrix
+
     def _haversine_distance(self, start: Tuple[float, float], end: Tuple[float, float]) -> float:
         """Calculate great-circle distance between two points"""
-        lat1, lon1 = math.radians(start[0]), math.radians(start[1])
-        lat2, lon2 = math.radians(end[0]), math.radians(end[1])
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        
-        return 6371 * c  # Earth radius in km
\ No newline at end of file
+        return haversine_distance(start, end)
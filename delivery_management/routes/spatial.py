@@ -0,0 +1,149 @@
+"""Spatial indexes over order locations
+
+Points are projected onto a plane in km around a reference point
+(equirectangular, which is accurate enough at city and regional scale). The
+savings phase asks an OrderIndex which orders are near each order instead of
+scoring every pair of the day.
+"""
+from typing import Tuple
+
+import numpy as np
+
+from .distance import Coordinate, EARTH_RADIUS_KM
+
+
+def project(coordinates: np.ndarray, origin: Coordinate) -> np.ndarray:
+    """(lat, lon) degrees as an (N, 2) array -> (x, y) km on a plane centred on ``origin``"""
+    lat0, lon0 = np.radians(origin)
+    radians = np.radians(np.asarray(coordinates, dtype=float).reshape(-1, 2))
+    x = (radians[:, 1] - lon0) * np.cos(lat0) * EARTH_RADIUS_KM
+    y = (radians[:, 0] - lat0) * EARTH_RADIUS_KM
+    return np.column_stack([x, y])
+
+
+def morton_codes(points: np.ndarray, lowest: np.ndarray, span: float) -> np.ndarray:
+    """Z-order (geohash-style) codes of points quantised to 16 bits per axis over ``span`` km"""
+    cells = np.clip((points - lowest) / span * 0xFFFF, 0, 0xFFFF).astype(np.int64)
+    return _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << 1)
+
+
+def _spread_bits(values: np.ndarray) -> np.ndarray:
+    """Put the low 16 bits of each value on the even bit positions"""
+    values = values & 0xFFFF
+    values = (values | (values << 8)) & 0x00FF00FF
+    values = (values | (values << 4)) & 0x0F0F0F0F
+    values = (values | (values << 2)) & 0x33333333
+    return (values | (values << 1)) & 0x55555555
+
+
+# Offsets of the Z-order curves as fractions of the extent; a seam of one curve is away from the others'
+SHIFTS = ((0.0, 0.0), (0.33, 0.21), (0.61, 0.47), (0.17, 0.79))
+
+
+class GridIndex:
+    """Points bucketed into square cells of ``cell_km``
+
+    Points are sorted by (cell column, cell row), so each cell is a single
+    slice of the sorted order and finding it is one binary search.
+    """
+
+    def __init__(self, points: np.ndarray, cell_km: float):
+        self.cell_km = cell_km
+        cells = np.floor(points / cell_km).astype(np.int64)
+        self.cells = cells - cells.min(axis=0)
+        self.columns, self.rows = (self.cells.max(axis=0) + 1).tolist()
+        keys = self.cells[:, 0] * self.rows + self.cells[:, 1]
+        self.ranking = np.argsort(keys, kind='stable')
+        self.keys = keys[self.ranking]
+
+    def adjacent_pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(a, b) point indexes for every ordered pair in the same or touching cells, a == b included
+
+        Any two points closer than ``cell_km`` are among them.
+        """
+        everyone = np.arange(len(self.cells))
+        firsts, seconds = [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                x, y = self.cells[:, 0] + dx, self.cells[:, 1] + dy
+                inside = (x >= 0) & (x < self.columns) & (y >= 0) & (y < self.rows)
+                keys = x * self.rows + y
+                starts = np.searchsorted(self.keys, keys, side='left')
+                counts = np.where(inside, np.searchsorted(self.keys, keys, side='right') - starts, 0)
+
+                # Expand each point against every member of the neighbouring cell
+                total = int(counts.sum())
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                firsts.append(np.repeat(everyone, counts))
+                seconds.append(self.ranking[np.repeat(starts, counts) + offsets])
+        return np.concatenate(firsts), np.concatenate(seconds)
+
+
+class OrderIndex:
+    """Neighbour queries over the pickup and delivery points of a set of orders
+
+    Orders are referred to by their position in the arrays passed in, and
+    the distance between two orders is the shortest straight line between
+    any of their points. Both queries return each unordered pair once as
+    (smaller position, larger position) arrays.
+    """
+
+    def __init__(self, pickups: np.ndarray, deliveries: np.ndarray, origin: Coordinate):
+        self.count = len(pickups)
+        # (orders, pickup/delivery, x/y)
+        self.points = np.stack([project(pickups, origin), project(deliveries, origin)], axis=1)
+
+    def separation(self, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """Distance in km between the orders at matching positions of two arrays"""
+        a, b = self.points[first], self.points[second]
+        return np.min([
+            np.hypot(*(a[:, i] - b[:, j]).T) for i in (0, 1) for j in (0, 1)
+        ], axis=0)
+
+    def nearest(self, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """About the k nearest orders of every order
+
+        Points are sorted along the Z-order curves of ``SHIFTS``, each offset
+        by a different fraction of the extent so that orders split by a seam
+        of one curve are adjacent on another. Orders within k places on either curve are
+        candidates and each order keeps the k closest of them. Work and
+        memory grow with N*k whatever the density.
+        """
+        flat = self.points.reshape(-1, 2)
+        labels = np.repeat(np.arange(self.count), 2)
+        lowest = flat.min(axis=0)
+        span = max(float(np.ptp(flat, axis=0).max()), 1e-9)
+        window = np.arange(1, max(k // 2, 1) + 1)
+
+        firsts, seconds = [], []
+        for shift in SHIFTS:
+            ranking = np.argsort(morton_codes(flat + np.multiply(shift, span), lowest, span * 2), kind='stable')
+            positions = np.arange(len(ranking))[:, None] + window[None, :]
+            valid = positions < len(ranking)
+            firsts.append(labels[ranking][np.nonzero(valid)[0]])
+            seconds.append(labels[ranking][positions[valid]])
+        firsts, seconds = np.concatenate(firsts), np.concatenate(seconds)
+
+        # Score each candidate pair once, then rank every order's candidates by distance and keep the closest k
+        distinct = firsts != seconds
+        firsts, seconds = self._unordered(firsts[distinct], seconds[distinct])
+        gaps = self.separation(firsts, seconds)
+        a, b = np.concatenate([firsts, seconds]), np.concatenate([seconds, firsts])
+        gaps = np.concatenate([gaps, gaps])
+        ranking = np.argsort(a * (2 * gaps.max(initial=0) + 1) + gaps, kind='stable')
+        a, b = a[ranking], b[ranking]
+        keep = np.arange(len(a)) - np.searchsorted(a, a, side='left') < k
+        return self._unordered(a[keep], b[keep])
+
+    def within(self, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Every pair of orders with points no more than ``radius_km`` apart"""
+        flat = self.points.reshape(-1, 2)
+        a, b = GridIndex(flat, max(radius_km, 1e-6)).adjacent_pairs()
+        close = np.hypot(*(flat[a] - flat[b]).T) <= radius_km
+        a, b = a[close] // 2, b[close] // 2
+        distinct = a != b
+        return self._unordered(a[distinct], b[distinct])
+
+    def _unordered(self, a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        keys = np.unique(np.minimum(a, b) * self.count + np.maximum(a, b))
+        return keys // self.count, keys % self.count
@@ -1,3 +1,1378 @@
-from django.test import TestCase
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlsplit, parse_qs
 
-# Create your tests here.
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from functools import partial
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import User
+from deliveries.models import Customer, DeliveryOrder, Route, RouteStop, Truck
+
+from .batch import build_partitions, plan_batch
+from .benchmarks import (
+    benchmark_optimizer, compare_coordinate_loading, compare_to_baseline, generate_customers, generate_orders
+)
+from .cache import DatabaseDistanceStore, DistanceCache
+from .distance import DistanceMatrix, SparseDistanceMatrix, estimate_cells, haversine_distance
+from .incremental import RouteEditor
+from .local_search import LocalSearch
+from .maps import render_route_map
+from .merging import RouteMerger
+from .models import OptimizationJob
+from .osrm import CircuitBreaker, OSRMClient
+from .precompute import build_precomputed_matrix
+from .providers import HaversineProvider, MatrixFileProvider, OSRMProvider, build_routing_provider
+from .records import order_records
+from .scheduling import PRIORITY_DEADLINE_MINUTES, Schedule, order_deadline
+from .services import RouteOptimizationService
+from .spatial import GridIndex, OrderIndex
+from .views import RouteListView
+
+
+class StubOSRMHandler(BaseHTTPRequestHandler):
+    """Answers /table and /route requests with haversine distances, like a tiny OSRM"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.paths.append(self.path)
+            server.client_ports.add(self.client_address[1])
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+            failing = server.fail or server.fail_next > 0
+            server.fail_next = max(0, server.fail_next - 1)
+        try:
+            time.sleep(server.delay)
+            url = urlsplit(self.path)
+            if failing:
+                self._send(500, {'code': 'Error'})
+            elif url.path.startswith('/table/v1/driving/'):
+                self._send(200, self._table(url))
+            elif url.path.startswith('/route/v1/driving/'):
+                self._send(200, self._route(url))
+            else:
+                self._send(400, {'code': 'InvalidUrl'})
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    @staticmethod
+    def _coordinates(url):
+        coords = []
+        for pair in url.path.rsplit('/', 1)[1].split(';'):
+            lon, lat = pair.split(',')
+            coords.append((float(lat), float(lon)))
+        return coords
+
+    def _table(self, url):
+        coords = self._coordinates(url)
+        query = parse_qs(url.query)
+        sources = [int(i) for i in query['sources'][0].split(';')]
+        destinations = [int(i) for i in query['destinations'][0].split(';')]
+        distances = [[haversine_distance(coords[i], coords[j]) * 1000 for j in destinations] for i in sources]
+        return {
+            'code': 'Ok',
+            'distances': distances,
+            'durations': [[d / 10 for d in row] for row in distances],
+        }
+
+    def _route(self, url):
+        start, end = self._coordinates(url)
+        distance = haversine_distance(start, end) * 1000
+        return {'code': 'Ok', 'routes': [{'distance': distance, 'duration': distance / 10}]}
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubOSRMServerMixin:
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubOSRMHandler)
+        # Pooled clients drop idle keep-alive connections; that is not an error
+        cls.server.handle_error = lambda request, client_address: None
+        cls.server.lock = threading.Lock()
+        cls.server.paths = []
+        cls.server.client_ports = set()
+        cls.osrm_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.paths.clear()
+        self.server.client_ports.clear()
+        self.server.fail = False
+        self.server.fail_next = 0
+        self.server.delay = 0
+        self.server.active = self.server.max_active = 0
+
+    def make_provider(self, **kwargs):
+        client = OSRMClient(self.osrm_url, **{'backoff': 0, **kwargs})
+        self.addCleanup(client.close)
+        return OSRMProvider(client)
+
+
+def order_stand_in(**fields):
+    """A lightweight order with the float points the optimizer reads"""
+    order = SimpleNamespace(**fields)
+    order.pickup_point = (float(order.pickup_latitude), float(order.pickup_longitude))
+    order.delivery_point = (float(order.delivery_latitude), float(order.delivery_longitude))
+    return order
+
+
+def make_orders(count):
+    """Build lightweight order stand-ins spread around Berlin"""
+    return [
+        order_stand_in(
+            id=i + 1,
+            weight_kg=100,
+            pickup_latitude=52.50 + i * 0.003,
+            pickup_longitude=13.38 + i * 0.002,
+            delivery_latitude=52.53 - i * 0.002,
+            delivery_longitude=13.42 + i * 0.003,
+        )
+        for i in range(count)
+    ]
+
+
+class OSRMClientTests(StubOSRMServerMixin, SimpleTestCase):
+    def make_client(self, **kwargs):
+        client = OSRMClient(self.osrm_url, **{'backoff': 0, **kwargs})
+        self.addCleanup(client.close)
+        return client
+
+    def test_fill_chunks_requests_to_table_size(self):
+        coords = [(52.5 + i * 0.01, 13.4 + i * 0.01) for i in range(25)]
+        matrix = DistanceMatrix(coords)
+        client = self.make_client(max_table_size=20)
+
+        fetched = client.fill(matrix)
+
+        self.assertTrue(fetched.all())
+        # 25 coordinates in chunks of 10 -> 3 x 3 blocks
+        self.assertEqual(len(self.server.paths), 9)
+        for path in self.server.paths:
+            self.assertLessEqual(urlsplit(path).path.rsplit('/', 1)[1].count(';') + 1, 20)
+        self.assertAlmostEqual(
+            matrix.distance(coords[3], coords[17]),
+            haversine_distance(coords[3], coords[17]),
+            places=6
+        )
+
+    def test_fill_falls_back_to_haversine_when_server_fails(self):
+        self.server.fail = True
+        coords = [(52.5, 13.4), (52.6, 13.5)]
+        matrix = DistanceMatrix(coords)
+
+        fetched = self.make_client().fill(matrix)
+
+        self.assertFalse(fetched.any())
+        self.assertAlmostEqual(matrix.distance(coords[0], coords[1]), haversine_distance(coords[0], coords[1]))
+        self.assertGreater(matrix.duration(coords[0], coords[1]), 0)
+
+    def test_failed_block_only_estimates_the_missing_cells(self):
+        coords = [(52.5 + i * 0.01, 13.4) for i in range(3)]
+        cache = DistanceCache()
+        for start in coords:
+            for end in coords:
+                if start != end and (start, end) != (coords[0], coords[2]):
+                    cache.set(start, end, 99.0, 3600.0)
+        service = RouteOptimizationService(routing_provider=self.make_provider(), distance_cache=cache)
+        matrix = SparseDistanceMatrix(coords)
+        rows, cols = np.nonzero(~np.eye(3, dtype=bool))
+        self.server.fail = True
+
+        service._fetch_cells(matrix, rows, cols)
+
+        self.assertEqual(matrix.distance(coords[0], coords[1]), 99.0)
+        self.assertEqual(matrix.distance(coords[2], coords[0]), 99.0)
+        self.assertAlmostEqual(matrix.distance(coords[0], coords[2]), haversine_distance(coords[0], coords[2]))
+        # The unanswered cell is still an estimate, so it is asked for again later
+        self.assertEqual(matrix.lookup(rows, cols)[2].tolist(), [(r, c) != (0, 2) for r, c in zip(rows, cols)])
+        self.assertEqual(service.metrics.counters['haversine_fallbacks'], 1)
+
+    def test_blocks_run_concurrently_up_to_the_limit(self):
+        self.server.delay = 0.05
+        matrix = DistanceMatrix([(52.5 + i * 0.01, 13.4 + i * 0.01) for i in range(40)])
+
+        self.make_client(max_table_size=10, concurrency=3).fill(matrix)
+
+        # 8 x 8 blocks over at most 3 pooled keep-alive connections
+        self.assertEqual(len(self.server.paths), 64)
+        self.assertEqual(self.server.max_active, 3)
+        self.assertLessEqual(len(self.server.client_ports), 3)
+
+    def test_route_retries_server_errors(self):
+        self.server.fail_next = 2
+        start, end = (52.5, 13.4), (52.6, 13.5)
+
+        distance, duration = self.make_client(retries=2).route(start, end)
+
+        self.assertEqual(len(self.server.paths), 3)
+        self.assertAlmostEqual(distance, haversine_distance(start, end))
+        self.assertAlmostEqual(duration, distance * 100)
+
+    def test_breaker_stops_requests_after_repeated_failures(self):
+        self.server.fail = True
+        client = self.make_client(retries=1, breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+
+        self.assertIsNone(client.route((52.5, 13.4), (52.6, 13.5)))
+        self.assertIsNone(client.route((52.5, 13.4), (52.6, 13.5)))
+        self.assertIsNone(client.route((52.5, 13.4), (52.6, 13.5)))
+
+        self.assertEqual(client.breaker.state, 'open')
+        self.assertEqual(len(self.server.paths), 3)
+
+    def test_half_open_breaker_closes_after_a_success(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_service_road_distance_uses_client_and_cache(self):
+        cache = DistanceCache()
+        service = RouteOptimizationService(routing_provider=OSRMProvider(self.make_client()), distance_cache=cache)
+        start, end = (52.5, 13.4), (52.6, 13.5)
+
+        first = service._get_road_distance(start, end)
+        second = service._get_road_distance(start, end)
+
+        self.assertAlmostEqual(first, haversine_distance(start, end))
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.server.paths), 1)
+
+    def test_leg_distances_are_fetched_in_one_table_call(self):
+        service = RouteOptimizationService(routing_provider=OSRMProvider(self.make_client()), distance_cache=DistanceCache())
+        starts = [(52.5, 13.4), (52.6, 13.5), (52.5, 13.4)]
+        ends = [(52.6, 13.5), (52.7, 13.6), (52.5, 13.4)]
+
+        first = service._leg_distances(starts, ends)
+        second = service._leg_distances(starts, ends)
+
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertTrue(self.server.paths[0].startswith('/table/'))
+        self.assertAlmostEqual(first[1], haversine_distance(starts[1], ends[1]))
+        self.assertEqual(first[2], 0)
+        self.assertEqual(first.tolist(), second.tolist())
+
+
+class RoutingProviderTests(SimpleTestCase):
+    def test_matrix_file_serves_covered_cells_and_estimates_the_rest(self):
+        known = [(52.5, 13.4), (52.6, 13.5)]
+        saved = DistanceMatrix(known)
+        saved.distances[:] = [[0, 12.5], [13.0, 0]]
+        saved.durations[:] = [[0, 900], [950, 0]]
+        new = (52.55, 13.45)
+
+        with tempfile.TemporaryDirectory() as directory:
+            saved.save(directory)
+            provider = MatrixFileProvider(directory)
+            matrix = DistanceMatrix(known + [new])
+            fetched = provider.fill(matrix)
+
+            self.assertEqual(matrix.distance(known[0], known[1]), 12.5)
+            self.assertEqual(matrix.duration(known[1], known[0]), 950)
+            self.assertAlmostEqual(matrix.distance(known[0], new), haversine_distance(known[0], new))
+            self.assertTrue(fetched[0, 1])
+            self.assertFalse(fetched[0, 2])
+            self.assertEqual(provider.route(known[0], known[1]), (12.5, 900))
+            self.assertIsNone(provider.route(known[0], new))
+
+    def test_providers_report_latency(self):
+        provider = HaversineProvider()
+        provider.route((52.5, 13.4), (52.6, 13.5))
+        provider.fill(DistanceMatrix([(52.5, 13.4), (52.6, 13.5)]))
+
+        latency = provider.latency()
+        self.assertEqual(latency['calls'], 2)
+        self.assertGreaterEqual(latency['max_ms'], latency['mean_ms'])
+
+    @override_settings(ROUTING_PROVIDER={'BACKEND': 'haversine'})
+    def test_backend_comes_from_settings(self):
+        self.assertIsInstance(build_routing_provider(), HaversineProvider)
+        self.assertIsInstance(build_routing_provider('osrm'), OSRMProvider)
+        with self.assertRaises(ValueError):
+            build_routing_provider('matrix_file')
+
+
+class SavingsMatrixTests(StubOSRMServerMixin, SimpleTestCase):
+    def test_savings_use_batched_matrix(self):
+        service = RouteOptimizationService(routing_provider=self.make_provider(), distance_cache=DistanceCache())
+        orders = make_orders(30)
+
+        firsts, seconds, values = service._calculate_savings_matrix(orders)
+
+        # 61 coordinates fit in 2 x 2 blocks of 50; no per-pair lookups
+        self.assertEqual(len(self.server.paths), 4)
+        self.assertTrue(all(path.startswith('/table/') for path in self.server.paths))
+        self.assertTrue(len(values))
+
+
+class VectorizedSavingsTests(SimpleTestCase):
+    def test_haversine_savings_match_scalar_path(self):
+        service = RouteOptimizationService(routing_provider=HaversineProvider(), savings_block_size=7, distance_cache=DistanceCache())
+        orders = make_orders(20)
+
+        firsts, seconds, values = service._calculate_savings_matrix(orders)
+        vectorized = {(int(a), int(b)): value for a, b, value in zip(firsts, seconds, values)}
+
+        factory = service.factory_location
+        expected = {}
+        for i, order1 in enumerate(orders):
+            for order2 in orders[i + 1:]:
+                p1, d1 = (order1.pickup_latitude, order1.pickup_longitude), (order1.delivery_latitude, order1.delivery_longitude)
+                p2, d2 = (order2.pickup_latitude, order2.pickup_longitude), (order2.delivery_latitude, order2.delivery_longitude)
+                saving = max(
+                    haversine_distance(factory, a) + haversine_distance(factory, b) - haversine_distance(a, b)
+                    for a, b in [(p1, p2), (p1, d2), (d1, p2), (d1, d2)]
+                )
+                if saving > 0:
+                    expected[(order1.id, order2.id)] = saving
+
+        self.assertEqual(vectorized.keys(), expected.keys())
+        for pair, saving in expected.items():
+            self.assertAlmostEqual(vectorized[pair], saving, places=9)
+
+
+class SavingsCandidateTests(SimpleTestCase):
+    def test_each_order_keeps_at_most_k_partners(self):
+        service = RouteOptimizationService(routing_provider=HaversineProvider(), savings_neighbours=3, distance_cache=DistanceCache())
+        orders = make_orders(30)
+
+        firsts, seconds, values = service._calculate_savings_matrix(orders)
+
+        pairs = set(zip(firsts.tolist(), seconds.tolist()))
+        self.assertEqual(len(pairs), len(values))
+        self.assertLessEqual(len(values), 30 * 3)
+        self.assertTrue((values > 0).all())
+
+    def test_groups_limit_partners(self):
+        service = RouteOptimizationService(routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+        orders = make_orders(6)
+        groups = np.array([1, 1, 1, 2, 2, -1])
+
+        firsts, seconds, _ = service._calculate_savings_matrix(orders, groups=groups)
+
+        for first, second in zip(firsts.tolist(), seconds.tolist()):
+            self.assertEqual(groups[first - 1], groups[second - 1])
+            self.assertNotEqual(groups[first - 1], -1)
+
+
+    def test_road_distances_are_only_fetched_for_candidate_cells(self):
+        provider = HaversineProvider()
+        provider.road_distances = True
+        asked = []
+        fill = provider._fill_cells
+
+        def answer_everything(points, rows, cols):
+            # Answers every cell it is asked for, like a road server
+            asked.append(len(rows))
+            distances, durations, _ = fill(points, rows, cols)
+            return distances, durations, np.ones(len(rows), dtype=bool)
+
+        provider._fill_cells = answer_everything
+        service = RouteOptimizationService(routing_provider=provider, savings_neighbours=3, savings_block_size=16,
+                                           distance_cache=DistanceCache())
+        orders = make_orders(120)
+
+        firsts, seconds, _ = service._calculate_savings_matrix(orders)
+
+        matrix = service.distance_matrix
+        size = len(matrix)
+        self.assertIsInstance(matrix, SparseDistanceMatrix)
+        self.assertLess(asked[0], size * size / 4)
+        self.assertEqual(matrix.stored_cells, asked[0])
+        factory = matrix.index[service.factory_location]
+        everything = np.arange(size)
+        self.assertTrue(matrix.lookup(factory, everything)[2].all() and matrix.lookup(everything, factory)[2].all())
+        # Every scored pair was priced with road distances
+        by_id = {order.id: order for order in orders}
+        for first, second in zip(firsts.tolist(), seconds.tolist()):
+            a, b = matrix.index[by_id[first].delivery_point], matrix.index[by_id[second].pickup_point]
+            self.assertTrue(matrix.cell(a, b)[2])
+
+        # Legs of the persisted routes that were only estimated are fetched before distances are written
+        route = orders[:5]
+        service._fetch_route_legs([route])
+        points = [service.factory_location] + [p for order in route for p in (order.pickup_point, order.delivery_point)]
+        positions = [matrix.index[point] for point in points + [service.factory_location]]
+        self.assertTrue(matrix.lookup(positions[:-1], positions[1:])[2].all())
+
+
+class SpatialIndexTests(SimpleTestCase):
+    def make_scattered_orders(self, count, seed=7, centres=((52.52, 13.40),)):
+        rng = np.random.default_rng(seed)
+        orders = []
+        for i in range(count):
+            lat, lon = centres[i % len(centres)]
+            pickup, delivery = rng.normal((lat, lon), 0.05, size=(2, 2))
+            orders.append(order_stand_in(
+                id=i + 1, weight_kg=100,
+                pickup_latitude=pickup[0], pickup_longitude=pickup[1],
+                delivery_latitude=delivery[0], delivery_longitude=delivery[1],
+            ))
+        return orders
+
+    def test_grid_pairs_include_every_close_pair(self):
+        points = np.random.default_rng(1).uniform(-50, 50, size=(300, 2))
+
+        a, b = GridIndex(points, cell_km=7).adjacent_pairs()
+
+        found = set(zip(a.tolist(), b.tolist()))
+        gaps = np.hypot(*(points[:, None] - points[None, :]).transpose(2, 0, 1))
+        close = set(zip(*(index.tolist() for index in np.nonzero(gaps <= 7))))
+        self.assertTrue(close <= found)
+        self.assertLess(len(found), 300 * 300 / 4)
+
+    def test_nearest_finds_most_true_neighbours(self):
+        orders = self.make_scattered_orders(500)
+        pickups = np.array([(o.pickup_latitude, o.pickup_longitude) for o in orders])
+        deliveries = np.array([(o.delivery_latitude, o.delivery_longitude) for o in orders])
+        index = OrderIndex(pickups, deliveries, (52.52, 13.40))
+
+        a, b = index.nearest(10)
+
+        found = set(zip(a.tolist(), b.tolist()))
+        everyone = np.arange(500)
+        hits = 0
+        for i in range(500):
+            gaps = index.separation(np.full(500, i), everyone)
+            gaps[i] = np.inf
+            hits += sum((min(i, j), max(i, j)) in found for j in np.argsort(gaps)[:10].tolist())
+        self.assertGreater(hits / 5000, 0.8)
+
+    def test_neighbour_pruning_scores_fewer_pairs(self):
+        orders = self.make_scattered_orders(400)
+        pruned = RouteOptimizationService(routing_provider=HaversineProvider(), savings_block_size=32,
+                                          savings_neighbours=10, distance_cache=DistanceCache())
+        dense = RouteOptimizationService(routing_provider=HaversineProvider(), savings_block_size=32,
+                                         savings_neighbours=None, distance_cache=DistanceCache())
+
+        firsts, seconds, values = pruned._calculate_savings_matrix(orders)
+        dense_firsts, dense_seconds, dense_values = dense._calculate_savings_matrix(orders)
+
+        self.assertLess(pruned.metrics.counters['savings_pairs'], 400 * 400 // 2)
+        best = int(np.argmax(dense_values))
+        self.assertIn((dense_firsts[best], dense_seconds[best]), set(zip(firsts.tolist(), seconds.tolist())))
+        self.assertAlmostEqual(values.max(), dense_values.max())
+
+    def test_orders_beyond_the_radius_are_never_paired(self):
+        # Half the orders around Berlin, half around Hamburg, about 250 km apart
+        orders = self.make_scattered_orders(60, centres=((52.52, 13.40), (53.55, 10.00)))
+        service = RouteOptimizationService(routing_provider=HaversineProvider(), savings_block_size=16,
+                                           savings_neighbours=None, savings_radius_km=50,
+                                           distance_cache=DistanceCache())
+
+        firsts, seconds, _ = service._calculate_savings_matrix(orders)
+
+        self.assertTrue(len(firsts))
+        for first, second in zip(firsts.tolist(), seconds.tolist()):
+            self.assertEqual(first % 2, second % 2)
+
+
+class DistanceCacheTests(StubOSRMServerMixin, TestCase):
+    def test_repeat_runs_are_served_from_cache(self):
+        cache = DistanceCache(store=DatabaseDistanceStore())
+        orders = make_orders(10)
+
+        RouteOptimizationService(routing_provider=self.make_provider(), distance_cache=cache)._calculate_savings_matrix(orders)
+        first_run_requests = len(self.server.paths)
+
+        # A fresh service and an empty LRU tier still hit the persistent tier
+        cache.clear()
+        RouteOptimizationService(routing_provider=self.make_provider(), distance_cache=cache)._calculate_savings_matrix(orders)
+
+        self.assertEqual(first_run_requests, 1)
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertEqual(cache.misses, 0)
+        self.assertGreater(cache.hits, 0)
+
+    def test_cells_are_read_one_row_per_origin(self):
+        cache = DistanceCache(store=DatabaseDistanceStore())
+        points = np.array([(52.4 + i * 0.001, 13.3 + i * 0.002) for i in range(300)])
+        rows, cols = np.nonzero(~np.eye(len(points), dtype=bool))
+        distances, durations, _ = HaversineProvider().fill_cells(points, rows, cols)
+        cache.save_cells(points[rows], points[cols], distances, durations)
+
+        cache.clear()
+        with self.assertNumQueries(1):
+            loaded, _, found = cache.load_cells(points[rows], points[cols])
+
+        self.assertTrue(found.all())
+        np.testing.assert_array_equal(loaded, distances)
+        self.assertEqual(cache.stats()['size'], 300 * 299)
+
+    def test_keys_are_rounded_to_precision(self):
+        cache = DistanceCache(precision=3)
+        cache.set((52.52001, 13.40501), (52.6, 13.5), 12.5, 900)
+
+        self.assertEqual(cache.get((52.51999, 13.40499), (52.6, 13.5)), (12.5, 900))
+
+    def test_lru_evicts_least_recently_used_origin(self):
+        cache = DistanceCache(max_entries=2)
+        cache.set((1, 1), (2, 2), 1, 1)
+        cache.set((3, 3), (2, 2), 2, 2)
+        cache.get((1, 1), (2, 2))
+        cache.set((4, 4), (2, 2), 3, 3)
+
+        self.assertIsNotNone(cache.get((1, 1), (2, 2)))
+        self.assertIsNone(cache.get((3, 3), (2, 2)))
+
+    def test_expired_entries_are_ignored(self):
+        cache = DistanceCache(store=DatabaseDistanceStore(), ttl=-1)
+        cache.set((1, 1), (2, 2), 1, 1)
+
+        self.assertIsNone(cache.get((1, 1), (2, 2)))
+
+
+class RouteMergerTests(SimpleTestCase):
+    def setUp(self):
+        self.orders = make_orders(4)
+        self.truck = SimpleNamespace(id=1, capacity_kg=1500, driver=None)
+
+    def sequence(self, merger):
+        return [[order.id for order in route] for route, _ in merger.routes()]
+
+    def test_merges_join_route_endpoints(self):
+        merger = RouteMerger([[order] for order in self.orders], [self.truck])
+
+        merger.merge_all([(1, 2), (3, 4), (1, 4)])
+
+        self.assertEqual(self.sequence(merger), [[2, 1, 4, 3]])
+        self.assertEqual(merger.load[merger.find(0)], 400)
+
+    def test_interior_orders_are_not_linked(self):
+        merger = RouteMerger([[order] for order in self.orders], [self.truck])
+
+        merger.merge_all([(1, 2), (2, 3), (2, 4)])
+
+        self.assertEqual(self.sequence(merger), [[1, 2, 3], [4]])
+
+    def test_merges_respect_truck_capacity(self):
+        truck = SimpleNamespace(id=1, capacity_kg=250, driver=None)
+        merger = RouteMerger([[order] for order in self.orders], [truck])
+
+        merger.merge_all([(1, 2), (2, 3)])
+
+        self.assertEqual(self.sequence(merger), [[1, 2], [3], [4]])
+
+    def test_routes_are_packed_first_fit_decreasing(self):
+        for order, weight in zip(self.orders, [100, 400, 300, 200]):
+            order.weight_kg = weight
+        small = SimpleNamespace(id=1, capacity_kg=300, driver=None)
+        large = SimpleNamespace(id=2, capacity_kg=600, driver=None)
+
+        merger = RouteMerger([[order] for order in self.orders], [small, large])
+
+        trucks = {route[0].id: truck and truck.id for route, truck in merger.routes()}
+        # 400 and 200 fill the large truck, 300 takes the small one, 100 fits nowhere
+        self.assertEqual(trucks, {1: None, 2: 2, 3: 1, 4: 2})
+
+    def test_merges_across_trucks_move_to_the_fuller_truck(self):
+        trucks = [SimpleNamespace(id=1, capacity_kg=1000, driver=None),
+                  SimpleNamespace(id=2, capacity_kg=1000, driver=None)]
+        for order, weight in zip(self.orders, [500, 500, 300, 100]):
+            order.weight_kg = weight
+        merger = RouteMerger([[order] for order in self.orders], trucks)
+
+        merger.merge_all([(3, 4), (1, 3)])
+
+        routes = {tuple(order.id for order in route): truck.id for route, truck in merger.routes()}
+        self.assertEqual(len(routes), 2)
+        self.assertEqual(sum(merger.utilization.values()), 1400)
+        self.assertEqual(max(merger.utilization.values()), 900)
+        self.assertEqual(len(set(routes.values())), 2)
+
+    def test_merges_that_make_priority_orders_late_are_rejected(self):
+        # Ten minutes between any two stops, no service time; orders 1 and 2 are due within 15 minutes
+        schedule = Schedule(lambda a, b: 0 if a == b else 600, [0] * 4, [900, 900, float('inf'), float('inf')],
+                            pickup_service=0, delivery_service=0)
+        merger = RouteMerger([[order] for order in self.orders], [self.truck])
+        merger.use_schedule(schedule)
+
+        merger.merge_all([(1, 2), (4, 2), (3, 1)])
+
+        # 1 and 2 cannot both come first; the others are driven after them
+        self.assertEqual(sorted(self.sequence(merger)), [[1, 3], [2, 4]])
+        self.assertEqual(merger.late_rejections, 1)
+
+
+class SchedulingTests(SimpleTestCase):
+    def test_deadlines_follow_priority_and_requested_date(self):
+        day = date(2025, 7, 1)
+        order = SimpleNamespace(priority='high', requested_delivery_date=day)
+        self.assertEqual(order_deadline(order, day, PRIORITY_DEADLINE_MINUTES), 4 * 3600)
+
+        order.requested_delivery_date = date(2025, 7, 2)
+        self.assertEqual(order_deadline(order, day, PRIORITY_DEADLINE_MINUTES), float('inf'))
+
+        # Overdue orders are urgent whatever their priority
+        overdue = SimpleNamespace(priority='low', requested_delivery_date=date(2025, 6, 30))
+        self.assertEqual(order_deadline(overdue, day, PRIORITY_DEADLINE_MINUTES), 2 * 3600)
+
+    def test_arrivals_add_service_times_and_the_way_back(self):
+        schedule = Schedule(lambda a, b: 0 if a == b else 600, [300, 300], [float('inf'), 100],
+                            pickup_service=60, delivery_service=120)
+
+        etas, total = schedule.arrivals([0, 1])
+
+        self.assertEqual(etas, [960, 2040])
+        self.assertEqual(total, 2760)
+        # Order 1 misses its deadline even on its own, so it does not constrain sequences
+        self.assertEqual(schedule.late([0, 1]), 1)
+        self.assertEqual(schedule.summary([0, 1])[1], float('inf'))
+
+
+def plane_legs(points):
+    """Straight-line distances between stops at (x, y); stop 0 (the depot) sits at the origin"""
+    points = np.array([(0.0, 0.0)] + list(points))
+    return lambda sources, destinations: np.hypot(*(points[sources][:, None] - points[destinations][None, :]).T).T
+
+
+class LocalSearchTests(SimpleTestCase):
+    def test_sequencing_moves_untangle_a_route(self):
+        search = LocalSearch([[3, 1, 5, 2, 4]], plane_legs([(1, 0), (2, 0), (3, 0), (4, 0), (5, 0)]), weights=[0] * 6, capacities=[100])
+
+        routes = search.run()
+
+        # Out to the far end and back is the shortest a line allows
+        self.assertEqual(sorted(routes[0]), [1, 2, 3, 4, 5])
+        self.assertEqual(search.total_cost(), 10)
+        self.assertGreater(search.moves['two_opt'] + search.moves['or_opt'], 0)
+
+    def test_prefix_sums_price_reversal_like_a_full_recount(self):
+        legs = plane_legs([(1, 0), (4, 2), (2, 5), (8, 1), (5, 5)])
+        search = LocalSearch([[1, 2, 3, 4, 5]], legs, weights=[0] * 6, capacities=[100])
+        search.run()
+
+        sequence = [0] + search.routes[0] + [0]
+        recount = sum(legs([a], [b])[0, 0] for a, b in zip(sequence, sequence[1:]))
+        self.assertAlmostEqual(search.total_cost(), recount)
+
+    def test_relocate_moves_stops_to_nearby_routes_with_capacity(self):
+        legs = plane_legs([(1, 0), (2, 0), (0, 10), (0, 11), (1.5, 0.5)])
+        neighbours = {5: [1, 2]}
+
+        search = LocalSearch([[1, 2], [3, 4, 5]], legs, weights=[0, 1, 1, 1, 1, 1], capacities=[3, 3],
+                             neighbours=neighbours)
+        self.assertEqual(sorted(search.run()[0]), [1, 2, 5])
+
+        full = LocalSearch([[1, 2], [3, 4, 5]], legs, weights=[0, 1, 1, 1, 1, 1], capacities=[2, 3],
+                           neighbours=neighbours)
+        self.assertEqual(sorted(full.run()[0]), [1, 2])
+
+
+class OrderFixturesMixin:
+    def setUp(self):
+        driver = User.objects.create_user('driver', password='x', role='driver')
+        self.truck = Truck.objects.create(license_plate='B-DM-1', driver=driver)
+        self.customer = Customer.objects.create(address='Alexanderplatz', latitude=52.52, longitude=13.41, phone='1')
+        self.service = RouteOptimizationService(routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+
+    def create_orders(self, count):
+        return [
+            DeliveryOrder.objects.create(
+                order_number=f'ORD-{i}',
+                customer=self.customer,
+                weight_kg=order.weight_kg,
+                pickup_address='Pickup',
+                pickup_latitude=order.pickup_latitude,
+                pickup_longitude=order.pickup_longitude,
+                delivery_address='Delivery',
+                delivery_latitude=order.delivery_latitude,
+                delivery_longitude=order.delivery_longitude,
+                requested_delivery_date=date(2025, 7, 1)
+            )
+            for i, order in enumerate(make_orders(count))
+        ]
+
+
+class RoutePersistenceTests(OrderFixturesMixin, TestCase):
+    def test_write_queries_do_not_grow_with_stops(self):
+        for count in (3, 12):
+            orders = self.create_orders(count)
+            with self.assertNumQueries(5):
+                # savepoint, route insert, stops insert, order update, release
+                routes = self.service._create_routes(date(2025, 7, 1), [('Route', self.truck, orders)])
+
+            self.assertEqual(routes[0].stops.count(), count)
+            self.assertFalse(DeliveryOrder.objects.filter(id__in=[o.id for o in orders]).exclude(status='assigned').exists())
+            DeliveryOrder.objects.all().delete()
+
+    def test_stops_get_arrival_times_and_routes_a_duration(self):
+        orders = self.create_orders(4)
+
+        route = self.service._create_routes(date(2025, 7, 1), [('Route', self.truck, orders)])[0]
+
+        arrivals = list(route.stops.order_by('stop_number').values_list('estimated_arrival_time', flat=True))
+        departure = datetime(2025, 7, 1, 8, 0, tzinfo=dt_timezone.utc)
+        self.assertGreater(arrivals[0], departure)
+        self.assertEqual(arrivals, sorted(arrivals))
+        route.refresh_from_db()
+        self.assertGreater(route.estimated_duration_minutes * 60, (arrivals[-1] - departure).total_seconds())
+
+    def test_routes_are_planned_from_order_records(self):
+        orders = self.create_orders(6)
+        DeliveryOrder.objects.filter(id=orders[0].id).update(priority='urgent')
+
+        with self.assertNumQueries(1):
+            records = order_records(DeliveryOrder.objects.order_by('id'))
+        self.assertEqual(records[0].priority, 'urgent')
+        self.assertEqual(records[0].pickup_point, orders[0].pickup_point)
+        with self.assertRaises(AttributeError):
+            records[0].special_instructions = 'no such field'
+
+        routes = self.service.optimize_daily_routes(date(2025, 7, 1), [self.truck], records)
+
+        stops = RouteStop.objects.filter(route__in=routes)
+        self.assertEqual(sorted(stops.values_list('delivery_order_id', flat=True)), [o.id for o in orders])
+        self.assertTrue(all(record.status == 'assigned' for record in records))
+
+    def test_failed_run_leaves_nothing_behind(self):
+        orders = self.create_orders(4)
+
+        with mock.patch.object(RouteStop.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.service.optimize_daily_routes(date(2025, 7, 1), [self.truck], orders)
+
+        self.assertFalse(Route.objects.exists())
+        self.assertFalse(DeliveryOrder.objects.exclude(status='pending').exists())
+
+    def test_optimize_daily_routes_persists_every_order_once(self):
+        orders = self.create_orders(8)
+
+        routes = self.service.optimize_daily_routes(date(2025, 7, 1), [self.truck], orders)
+
+        stops = RouteStop.objects.filter(route__in=routes)
+        self.assertEqual(sorted(stops.values_list('delivery_order_id', flat=True)), sorted(o.id for o in orders))
+        self.assertTrue(all(route.total_distance_km > 0 for route in routes))
+
+
+class RouteEditorTests(OrderFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.editor = RouteEditor(self.service)
+
+    def plan(self, orders):
+        return self.service._create_routes(date(2025, 7, 1), [('Route', self.truck, orders)])[0]
+
+    def late_order(self, like, number='ORD-LATE'):
+        return DeliveryOrder.objects.create(
+            order_number=number, customer=self.customer, weight_kg=50,
+            pickup_address='Pickup', pickup_latitude=like.pickup_latitude, pickup_longitude=like.pickup_longitude,
+            delivery_address='Delivery', delivery_latitude=like.delivery_latitude,
+            delivery_longitude=like.delivery_longitude, requested_delivery_date=date(2025, 7, 1)
+        )
+
+    def sequence(self, route):
+        return list(route.stops.order_by('stop_number').values_list('delivery_order_id', flat=True))
+
+    def test_insert_picks_the_cheapest_position(self):
+        orders = self.create_orders(6)
+        route = self.plan(orders)
+        late = self.late_order(orders[3])
+
+        stop = self.editor.insert_order(late)
+
+        by_id = {order.id: order for order in orders + [late]}
+        sequence = self.sequence(route)
+        self.assertEqual(stop.route_id, route.id)
+        self.assertEqual(list(route.stops.values_list('stop_number', flat=True)), list(range(1, 8)))
+        cheapest = min(
+            self.service._route_distance(orders[:k] + [late] + orders[k:]) for k in range(len(orders) + 1)
+        )
+        self.assertAlmostEqual(self.service._route_distance([by_id[i] for i in sequence]), cheapest, places=6)
+        route.refresh_from_db()
+        self.assertAlmostEqual(float(route.total_distance_km), cheapest, places=1)
+        self.assertEqual(DeliveryOrder.objects.get(pk=late.pk).status, 'assigned')
+
+    def test_insert_queries_do_not_grow_with_stops(self):
+        for count, number in ((4, 'ORD-LATE-1'), (12, 'ORD-LATE-2')):
+            orders = self.create_orders(count)
+            self.plan(orders)
+            # An order at the factory costs nothing to serve first
+            factory = SimpleNamespace(pickup_latitude=52.52, pickup_longitude=13.405,
+                                      delivery_latitude=52.52, delivery_longitude=13.405)
+            late = self.late_order(factory, number)
+            # exists check, routes, stops, savepoint, renumber x2, stop insert, ETAs, route, order, release
+            with self.assertNumQueries(11):
+                stop = self.editor.insert_order(late)
+            self.assertEqual(stop.stop_number, 1)
+            Route.objects.all().delete()
+            DeliveryOrder.objects.all().delete()
+
+    def test_nothing_is_inserted_before_completed_stops(self):
+        orders = self.create_orders(5)
+        route = self.plan(orders)
+        route.stops.filter(stop_number__lte=3).update(is_completed=True)
+
+        stop = self.editor.insert_order(self.late_order(orders[0]))
+
+        self.assertGreater(stop.stop_number, 3)
+        self.assertEqual(self.sequence(route)[:3], [order.id for order in orders[:3]])
+
+    def test_insert_respects_truck_capacity(self):
+        orders = self.create_orders(3)
+        self.plan(orders)
+        late = self.late_order(orders[0])
+        late.weight_kg = self.truck.capacity_kg
+
+        with self.assertRaises(ValueError):
+            self.editor.insert_order(late)
+        self.assertFalse(RouteStop.objects.filter(delivery_order=late).exists())
+
+    def test_cancel_removes_the_stop_and_closes_the_gap(self):
+        orders = self.create_orders(6)
+        route = self.plan(orders)
+        route.stops.filter(stop_number=1).update(is_completed=True)
+        before = float(route.total_distance_km)
+
+        self.editor.cancel_order(orders[2])
+
+        self.assertEqual(list(route.stops.values_list('stop_number', flat=True)), list(range(1, 6)))
+        self.assertEqual(self.sequence(route)[0], orders[0].id)
+        self.assertNotIn(orders[2].id, self.sequence(route))
+        route.refresh_from_db()
+        self.assertLess(float(route.total_distance_km), before)
+        self.assertEqual(DeliveryOrder.objects.get(pk=orders[2].pk).status, 'cancelled')
+
+    def test_completed_orders_cannot_be_cancelled(self):
+        orders = self.create_orders(3)
+        route = self.plan(orders)
+        route.stops.filter(stop_number=1).update(is_completed=True)
+
+        with self.assertRaises(ValueError):
+            self.editor.cancel_order(orders[0])
+        self.assertEqual(route.stops.count(), 3)
+
+    def assert_timetable_is_current(self, route):
+        route.refresh_from_db()
+        stops = list(route.stops.select_related('delivery_order').order_by('stop_number'))
+        etas, minutes, _ = self.editor._timetable(route, [stop.delivery_order for stop in stops])
+        self.assertEqual([stop.estimated_arrival_time for stop in stops], etas)
+        self.assertEqual(route.estimated_duration_minutes, minutes)
+
+    def test_edits_keep_arrival_times_current(self):
+        orders = self.create_orders(5)
+        route = self.plan(orders)
+
+        self.editor.insert_order(self.late_order(orders[2]))
+        self.assert_timetable_is_current(route)
+
+        self.editor.cancel_order(orders[1])
+        self.assert_timetable_is_current(route)
+
+    def test_timetable_uses_road_durations(self):
+        provider = HaversineProvider()
+        provider.road_distances = True
+        # Every road leg takes ten minutes, far from the straight-line estimate
+        provider._fill_cells = lambda points, rows, cols: (
+            np.ones(len(rows)), np.full(len(rows), 600.0), np.ones(len(rows), dtype=bool)
+        )
+        service = RouteOptimizationService(routing_provider=provider, distance_cache=DistanceCache())
+        orders = self.create_orders(3)
+
+        etas, minutes, _ = RouteEditor(service)._timetable(SimpleNamespace(date=date(2025, 7, 1)), orders)
+
+        pickup, delivery = service.pickup_service_minutes * 60, service.delivery_service_minutes * 60
+        departure = service.departure(date(2025, 7, 1))
+        expected = [600 + pickup + 600 + k * (delivery + 600 + pickup + 600) for k in range(3)]
+        self.assertEqual(etas, [departure + timedelta(seconds=seconds) for seconds in expected])
+        self.assertEqual(minutes, round((expected[-1] + delivery + 600) / 60))
+
+    def test_insert_keeps_priority_orders_on_time(self):
+        orders = self.create_orders(3)
+        DeliveryOrder.objects.filter(pk=orders[0].pk).update(priority='urgent')
+        orders[0].priority = 'urgent'
+        route = self.plan(orders)
+        first = route.stops.get(stop_number=1)
+        deadline = (first.estimated_arrival_time - self.service.departure(route.date)).total_seconds() / 60 + 1
+        self.service.priority_deadlines = {'urgent': deadline}
+        # Served first, an order at the factory would cost nothing but delay the urgent one
+        factory = SimpleNamespace(pickup_latitude=52.52, pickup_longitude=13.405,
+                                  delivery_latitude=52.52, delivery_longitude=13.405)
+
+        stop = self.editor.insert_order(self.late_order(factory))
+
+        self.assertGreater(stop.stop_number, 1)
+        first.refresh_from_db()
+        self.assertLessEqual(first.estimated_arrival_time,
+                             self.service.departure(route.date) + timedelta(minutes=deadline))
+
+    def test_only_pending_or_assigned_orders_are_edited(self):
+        orders = self.create_orders(3)
+        route = self.plan(orders[:2])
+        delivered = orders[2]
+        delivered.status = 'delivered'
+        delivered.save()
+
+        with self.assertRaises(ValueError):
+            self.editor.insert_order(delivered)
+        self.assertEqual(route.stops.count(), 2)
+
+        route.status = 'completed'
+        route.save()
+        DeliveryOrder.objects.filter(pk=orders[0].pk).update(status='delivered')
+        with self.assertRaises(ValueError):
+            self.editor.cancel_order(DeliveryOrder.objects.get(pk=orders[0].pk))
+        self.assertEqual(DeliveryOrder.objects.get(pk=orders[0].pk).status, 'delivered')
+
+    def test_edit_endpoints_are_for_dispatchers(self):
+        orders = self.create_orders(1)
+        self.client.force_login(User.objects.create_user('customer', password='x', role='customer'))
+
+        for name in ('routes:order_insert', 'routes:order_cancel'):
+            response = self.client.post(reverse(name, kwargs={'order_id': orders[0].id}))
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(DeliveryOrder.objects.get(pk=orders[0].pk).status, 'pending')
+
+    @override_settings(ROUTING_PROVIDER={'BACKEND': 'haversine'})
+    def test_insert_endpoint(self):
+        orders = self.create_orders(3)
+        route = self.plan(orders)
+        late = self.late_order(orders[1])
+        self.client.force_login(User.objects.create_user('dispatcher', password='x', role='admin'))
+
+        response = self.client.post(reverse('routes:order_insert', kwargs={'order_id': late.id}))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['route'], route.id)
+        self.assertEqual(route.stops.count(), 4)
+
+
+class OptimizationRunTests(OrderFixturesMixin, TestCase):
+    def test_run_records_phases_and_counters(self):
+        orders = self.create_orders(8)
+
+        routes = self.service.optimize_daily_routes(date(2025, 7, 1), [self.truck], orders)
+
+        run = self.service.last_run
+        self.assertEqual(set(run.phases), {'assignment', 'savings', 'merge', 'improve', 'persist'})
+        self.assertEqual(run.routing_provider, 'haversine')
+        self.assertEqual((run.order_count, run.route_count), (8, len(routes)))
+        self.assertEqual(run.phase_queries['savings'], 0)
+        self.assertEqual(run.query_count, sum(run.phase_queries.values()))
+        self.assertGreater(run.routing_calls, 0)
+        self.assertEqual(run.haversine_fallbacks, 0)
+        self.assertEqual(list(run.routes.all()), routes)
+
+    def test_local_search_shortens_routes(self):
+        orders = self.create_orders(30)
+        plain = RouteOptimizationService(
+            routing_provider=HaversineProvider(), distance_cache=DistanceCache(), local_search_budget=0
+        )
+
+        baseline = plain.optimize_daily_routes(date(2025, 7, 1), [self.truck], orders)
+        DeliveryOrder.objects.update(status='pending')
+        improved = self.service.optimize_daily_routes(date(2025, 7, 1), [self.truck], orders)
+
+        self.assertEqual(
+            sorted(stop.delivery_order_id for route in improved for stop in route.stops.all()),
+            sorted(stop.delivery_order_id for route in baseline for stop in route.stops.all())
+        )
+        self.assertLess(
+            sum(route.total_distance_km for route in improved),
+            sum(route.total_distance_km for route in baseline)
+        )
+
+    def test_run_list_filters_and_rejects_malformed_ones(self):
+        self.service.optimize_daily_routes(date(2025, 7, 1), [self.truck], self.create_orders(4))
+        run = self.service.last_run
+        self.client.force_login(User.objects.create_user('manager', password='x', role='manager'))
+        url = reverse('routes:run_list')
+
+        by_date = self.client.get(url, {'date': '2025-07-01'}).json()['runs']
+        by_route = self.client.get(url, {'route': run.routes.first().id}).json()['runs']
+
+        self.assertEqual([row['id'] for row in by_date], [run.id])
+        self.assertEqual([row['id'] for row in by_route], [run.id])
+        for query in ({'date': 'yesterday'}, {'date': '2025-02-30'}, {'route': 'abc'}):
+            self.assertEqual(self.client.get(url, query).status_code, 400)
+
+    def test_failed_provider_lookups_count_as_fallbacks(self):
+        provider = HaversineProvider()
+        provider.cache_results, provider.road_distances = True, True
+        provider._fill_cells = lambda points, rows, cols: (np.zeros(len(rows)), np.zeros(len(rows)), np.zeros(len(rows), dtype=bool))
+        service = RouteOptimizationService(routing_provider=provider, distance_cache=DistanceCache())
+
+        coordinates = [(52.5, 13.4), (52.6, 13.5), (52.7, 13.6)]
+        service._leg_distances([a for a in coordinates for b in coordinates if a != b],
+                               [b for a in coordinates for b in coordinates if a != b])
+
+        self.assertEqual(service.metrics.counters['haversine_fallbacks'], 6)
+
+
+@override_settings(ROUTE_OPTIMIZATION_JOBS={'EAGER': True})
+class OptimizationJobTests(OrderFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_user('manager', password='x', role='manager')
+        self.client.force_login(self.manager)
+
+    def submit(self, orders):
+        service = partial(RouteOptimizationService, routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+        with mock.patch('routes.jobs.RouteOptimizationService', service):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('routes:optimize'), {
+                    'date': '2025-07-01',
+                    'num_trucks': 1,
+                    'orders': [order.id for order in orders],
+                })
+        self.assertRedirects(response, reverse('routes:list'), fetch_redirect_response=False)
+        return OptimizationJob.objects.get()
+
+    def test_optimization_runs_as_job(self):
+        orders = self.create_orders(5)
+
+        job = self.submit(orders)
+
+        status = self.client.get(reverse('routes:job_status', kwargs={'pk': job.id})).json()
+        self.assertEqual(status['status'], 'completed')
+        self.assertEqual(status['progress'], 100)
+
+        result = self.client.get(reverse('routes:job_result', kwargs={'pk': job.id})).json()
+        route_ids = [route['id'] for route in result['routes']]
+        self.assertEqual(RouteStop.objects.filter(route_id__in=route_ids).count(), 5)
+
+        run = self.client.get(result['run_url']).json()
+        self.assertEqual(run['order_count'], 5)
+        self.assertEqual(run['route_ids'], route_ids)
+
+    def test_orders_no_longer_pending_are_skipped(self):
+        orders = self.create_orders(4)
+        service = partial(RouteOptimizationService, routing_provider=HaversineProvider(), distance_cache=DistanceCache())
+        with mock.patch('routes.jobs.RouteOptimizationService', service):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.client.post(reverse('routes:optimize'), {
+                    'date': '2025-07-01',
+                    'num_trucks': 1,
+                    'orders': [order.id for order in orders],
+                })
+            DeliveryOrder.objects.filter(id=orders[1].id).update(status='cancelled')
+            for callback in callbacks:
+                callback()
+        job = OptimizationJob.objects.get()
+
+        result = self.client.get(reverse('routes:job_result', kwargs={'pk': job.id})).json()
+
+        self.assertEqual(result['skipped_order_ids'], [orders[1].id])
+        route_ids = [route['id'] for route in result['routes']]
+        self.assertEqual(
+            sorted(RouteStop.objects.filter(route_id__in=route_ids).values_list('delivery_order_id', flat=True)),
+            sorted(order.id for order in orders if order.id != orders[1].id),
+        )
+        self.assertEqual(DeliveryOrder.objects.get(id=orders[1].id).status, 'cancelled')
+
+    def test_result_is_pending_until_job_finishes(self):
+        job = OptimizationJob.objects.create(date=date(2025, 7, 1))
+
+        response = self.client.get(reverse('routes:job_result', kwargs={'pk': job.id}))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], 'queued')
+
+
+class BatchPlanningTests(OrderFixturesMixin, TestCase):
+    def test_partitions_split_orders_by_date_and_nearest_depot(self):
+        self.create_orders(6)
+        DeliveryOrder.objects.filter(order_number__in=['ORD-0', 'ORD-1']).update(requested_delivery_date=date(2025, 7, 2))
+        depots = {'west': (52.5, 13.3), 'east': (52.5, 13.6)}
+
+        partitions = build_partitions([date(2025, 7, 1), date(2025, 7, 2)], depots)
+
+        counts = {(p['date'], p['depot']): len(p['orders']) for p in partitions}
+        self.assertEqual(sum(counts.values()), 6)
+        self.assertEqual(sum(n for (day, _), n in counts.items() if day == date(2025, 7, 2)), 2)
+        for partition in partitions:
+            for order in partition['orders']:
+                nearest = min(depots, key=lambda name: haversine_distance(order.pickup_point, depots[name]))
+                self.assertEqual(partition['depot'], nearest)
+
+    def test_each_partition_fetches_only_its_own_cells(self):
+        self.create_orders(6)
+        DeliveryOrder.objects.filter(order_number__in=['ORD-0', 'ORD-1']).update(requested_delivery_date=date(2025, 7, 2))
+        depot = (52.52, 13.405)
+        asked = []
+
+        def road_provider(backend):
+            # Each worker gets its own provider and asks for the cells it needs itself
+            provider = HaversineProvider()
+            provider.road_distances = True
+            fill = provider._fill_cells
+
+            def answer(points, rows, cols):
+                asked.append({tuple(point) for point in points[np.concatenate([rows, cols])].tolist()})
+                distances, durations, _ = fill(points, rows, cols)
+                return distances, durations, np.ones(len(rows), dtype=bool)
+
+            provider._fill_cells = answer
+            return provider
+
+        class InlineExecutor:
+            def __init__(self, **kwargs):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            map = staticmethod(map)
+
+        with mock.patch('routes.batch.get_routing_provider', road_provider), \
+                mock.patch('routes.batch.ProcessPoolExecutor', InlineExecutor):
+            results = plan_batch([date(2025, 7, 1), date(2025, 7, 2)], {'factory': depot},
+                                 routing_backend='haversine')
+
+        self.assertEqual(set(results), {(date(2025, 7, 1), 'factory'), (date(2025, 7, 2), 'factory')})
+        # Depot plus pickup and delivery of the partition's orders, never the other date's orders
+        locations = [
+            {depot} | {point for order in DeliveryOrder.objects.filter(requested_delivery_date=day)
+                       for point in (order.pickup_point, order.delivery_point)}
+            for day in (date(2025, 7, 1), date(2025, 7, 2))
+        ]
+        self.assertTrue(asked)
+        for points in asked:
+            self.assertTrue(any(points <= own for own in locations))
+        self.assertFalse(DeliveryOrder.objects.filter(status='pending').exists())
+
+    def test_service_reuses_covering_shared_matrix(self):
+        orders = make_orders(5)
+        provider = HaversineProvider()
+        provider.road_distances = True
+        service = RouteOptimizationService(routing_provider=provider, distance_cache=DistanceCache())
+        pickups, deliveries = service._order_coordinates(orders)
+        coordinates = [service.factory_location] + [tuple(c) for c in pickups.tolist() + deliveries.tolist()]
+        shared = DistanceMatrix(coordinates)
+        HaversineProvider().fill(shared)
+
+        with tempfile.TemporaryDirectory() as directory:
+            shared.save(directory)
+            service.shared_matrix = DistanceMatrix.load(directory)
+            with mock.patch.object(service.routing_provider, 'fill_cells') as fill_cells:
+                service._calculate_savings_matrix(orders)
+
+        fill_cells.assert_not_called()
+        self.assertIs(service.distance_matrix.base, service.shared_matrix)
+        self.assertEqual(service.distance_matrix.stored_cells, 0)
+
+
+class RoutePageTests(OrderFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.manager = User.objects.create_user('manager', password='x', role='manager')
+        self.orders = self.create_orders(12)
+
+    def create_route(self, orders):
+        self.service._create_routes(date(2025, 7, 1), [(f'Route {orders[0].id}', self.truck, orders)])
+        return Route.objects.order_by('-id').first()
+
+    def list_rows(self):
+        request = RequestFactory().get(reverse('routes:list'))
+        request.user = self.manager
+        view = RouteListView()
+        view.setup(request)
+        return [
+            (route.stop_count, route.total_weight_kg, route.truck.license_plate, route.driver.get_full_name())
+            for route in view.get_queryset()
+        ]
+
+    def test_list_rows_come_from_one_query(self):
+        # What route_list.html reads per row; rendering it needs crispy_forms
+        self.create_route(self.orders[:2])
+        with self.assertNumQueries(1):
+            self.list_rows()
+
+        for start in range(2, 12, 2):
+            self.create_route(self.orders[start:start + 2])
+        with self.assertNumQueries(1):
+            rows = self.list_rows()
+
+        self.assertEqual([count for count, *_ in rows], [2] * 6)
+        self.assertEqual(sum(weight for _, weight, *_ in rows), sum(order.weight_kg for order in self.orders))
+
+    def test_detail_queries_do_not_grow_with_stops(self):
+        short, long = self.create_route(self.orders[:2]), self.create_route(self.orders[2:])
+
+        # Route with counts, load, truck and driver; stops with their orders
+        with self.assertNumQueries(2):
+            self.client.get(reverse('routes:detail', args=[short.pk]))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('routes:detail', args=[long.pk]))
+
+        self.assertEqual(response.context['route'].stop_count, 10)
+        self.assertEqual(response.context['route'].total_weight_kg, sum(order.weight_kg for order in self.orders[2:]))
+        self.assertContains(response, 'Order #ORD-11')
+        self.assertContains(response, reverse('routes:map', args=[long.pk]))
+
+    def test_map_is_rendered_once_per_stop_state(self):
+        cache.clear()
+        route = self.create_route(self.orders[:3])
+        url = reverse('routes:map', args=[route.pk])
+
+        with mock.patch('routes.maps.render_route_map', wraps=render_route_map) as render:
+            first, second = self.client.get(url), self.client.get(url)
+            self.assertEqual(render.call_count, 1)
+            self.assertEqual(first.content, second.content)
+            self.assertContains(first, 'ORD-2')
+
+            route.stops.filter(stop_number=3).delete()
+            self.assertNotContains(self.client.get(url), 'ORD-2')
+            self.assertEqual(render.call_count, 2)
+
+        self.assertEqual(self.client.get(reverse('routes:map', args=[route.pk + 100])).status_code, 404)
+
+
+class PrecomputedMatrixTests(OrderFixturesMixin, TestCase):
+    @staticmethod
+    def answering(points, rows, cols):
+        # A road server that answers every cell, with straight-line values
+        distances, durations = estimate_cells(points, rows, cols)
+        return distances, durations, np.ones(len(rows), dtype=bool)
+
+    def test_command_builds_float32_matrix_and_only_fetches_new_customers(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch.object(HaversineProvider, '_fill_cells', side_effect=self.answering):
+            output = f'{directory}/matrix'
+            call_command('build_distance_matrix', output=output, routing='haversine', stdout=StringIO())
+            matrix = DistanceMatrix.load(output)
+            self.assertEqual(matrix.distances.dtype, np.float32)
+            self.assertEqual(len(matrix), 2)
+            self.assertIn((52.52, 13.41), matrix)
+
+            Customer.objects.create(address='Potsdamer Platz', latitude=52.51, longitude=13.38, phone='2')
+            Customer.objects.create(address='Closed', latitude=52.4, longitude=13.2, phone='3', is_active=False)
+            with mock.patch.object(HaversineProvider, 'fill', autospec=True, side_effect=HaversineProvider.fill) as fill:
+                stdout = StringIO()
+                call_command('build_distance_matrix', output=output, routing='haversine', stdout=stdout)
+
+            # Only the new customer's row and column, without its diagonal cell
+            missing = fill.call_args.args[2]
+            self.assertEqual(int(missing.sum()), 4)
+            self.assertIn('fetched 4 cells', stdout.getvalue())
+            matrix = DistanceMatrix.load(output)
+            self.assertEqual(len(matrix), 3)
+            self.assertGreater(matrix.distance((52.51, 13.38), (52.52, 13.41)), 0)
+
+    def test_unanswered_cells_are_saved_as_missing_and_fetched_again(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = f'{directory}/matrix'
+            stdout, stderr = StringIO(), StringIO()
+            # The straight-line provider answers no cell by road
+            call_command('build_distance_matrix', output=output, routing='haversine', stdout=stdout, stderr=stderr)
+
+            self.assertIn('fetched 0 cells', stdout.getvalue())
+            self.assertIn('2 cells got no road distance', stderr.getvalue())
+            matrix = DistanceMatrix.load(output)
+            self.assertTrue(np.isnan(matrix.distances[0, 1]) and np.isnan(matrix.durations[1, 0]))
+            sparse = SparseDistanceMatrix(matrix.coordinates, base=matrix)
+            self.assertFalse(sparse.cell(0, 1)[2])
+            self.assertFalse(sparse.lookup([0, 1], [1, 0])[2].any())
+
+            with mock.patch.object(HaversineProvider, '_fill_cells', side_effect=self.answering) as fill_cells:
+                _, fetched, failed = build_precomputed_matrix(output, HaversineProvider())
+
+            self.assertEqual((fetched, failed), (2, 0))
+            self.assertEqual(len(fill_cells.call_args.args[1]), 2)
+            matrix = DistanceMatrix.load(output)
+            self.assertGreater(matrix.distance(matrix.coordinates[0], matrix.coordinates[1]), 0)
+
+    def test_service_loads_precomputed_matrix_and_looks_up_only_new_coordinates(self):
+        orders = make_orders(4)
+        service = RouteOptimizationService(distance_cache=DistanceCache())
+        pickups, deliveries = service._order_coordinates(orders)
+        known = [service.factory_location] + [tuple(c) for c in pickups.tolist()[:3] + deliveries.tolist()[:3]]
+
+        with tempfile.TemporaryDirectory() as directory:
+            precomputed = DistanceMatrix(known)
+            HaversineProvider().fill(precomputed)
+            precomputed.save(directory)
+            with override_settings(ROUTING_PROVIDER={'BACKEND': 'haversine', 'PRECOMPUTED_MATRIX_PATH': directory}):
+                service = RouteOptimizationService(distance_cache=DistanceCache())
+            self.assertIsInstance(service.shared_matrix.distances, np.memmap)
+
+            provider = service.routing_provider
+            provider.road_distances = True
+            with mock.patch.object(provider, 'fill_cells', wraps=provider.fill_cells) as fill_cells:
+                service._calculate_savings_matrix(orders)
+
+        # The fourth order's pickup and delivery are new: their rows and columns are all that is asked for
+        index = service.distance_matrix.index
+        new = [index[tuple(pickups[3])], index[tuple(deliveries[3])]]
+        expected = np.zeros((len(index), len(index)), dtype=bool)
+        expected[new, :] = expected[:, new] = True
+        np.fill_diagonal(expected, False)
+        _, rows, cols = fill_cells.call_args.args
+        asked = np.zeros_like(expected)
+        asked[rows, cols] = True
+        np.testing.assert_array_equal(asked, expected)
+
+
+class OptimizerBenchmarkTests(TestCase):
+    def test_generators_are_seeded(self):
+        customers = generate_customers(5, seed=3, distribution='clustered')
+        first = generate_orders(20, customers, seed=3, distribution='heavy_tail')
+        DeliveryOrder.objects.all().delete()
+        second = generate_orders(20, customers, seed=3, distribution='heavy_tail')
+
+        self.assertEqual([o.weight_kg for o in first], [o.weight_kg for o in second])
+        self.assertEqual([o.pickup_latitude for o in first], [o.pickup_latitude for o in second])
+
+    def test_benchmark_reports_phases_and_rolls_back(self):
+        result = benchmark_optimizer(30, 'uniform', seed=1)
+
+        self.assertEqual(set(result['phases']), {'savings', 'merge', 'improve', 'create_routes'})
+        self.assertEqual(result['phases']['savings']['queries'], 0)
+        self.assertGreater(result['phases']['create_routes']['queries'], 0)
+        self.assertGreater(result['km'], 0)
+        self.assertFalse(DeliveryOrder.objects.exists())
+        self.assertFalse(Route.objects.exists())
+
+    def test_coordinate_benchmark_rolls_back(self):
+        results = compare_coordinate_loading(40, seed=1)
+
+        self.assertEqual(set(results), {'decimals', 'points', 'records'})
+        self.assertEqual(results['records']['queries'], 1)
+        self.assertFalse(DeliveryOrder.objects.exists())
+
+    def test_compare_flags_slower_phases(self):
+        baseline = [{'orders': 50, 'distribution': 'uniform', 'seed': 0, 'km': 100.0,
+                     'phases': {'merge': {'seconds': 0.5, 'peak_kb': 100.0, 'queries': 0}}}]
+        slower = [{'orders': 50, 'distribution': 'uniform', 'seed': 0, 'km': 101.0,
+                   'phases': {'merge': {'seconds': 0.9, 'peak_kb': 120.0, 'queries': 0}}}]
+
+        self.assertEqual(compare_to_baseline(slower, baseline), ["50 uniform merge seconds: 0.500 -> 0.900"])
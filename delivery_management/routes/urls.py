@@ -6,6 +6,13 @@ app_name = 'routes'
 urlpatterns = [
     path('', views.RouteListView.as_view(), name='list'),
     path('create/', views.RouteCreateView.as_view(), name='create'),
-    path('optimize/', views.optimize_routes, name='optimize'),
+    path('optimize/', views.ManualOptimizationView.as_view(), name='optimize'),
+    path('jobs/<int:pk>/', views.OptimizationJobStatusView.as_view(), name='job_status'),
+    path('jobs/<int:pk>/result/', views.OptimizationJobResultView.as_view(), name='job_result'),
+    path('runs/', views.OptimizationRunListView.as_view(), name='run_list'),
+    path('runs/<int:pk>/', views.OptimizationRunDetailView.as_view(), name='run_detail'),
+    path('orders/<int:order_id>/insert/', views.OrderInsertView.as_view(), name='order_insert'),
+    path('orders/<int:order_id>/cancel/', views.OrderCancelView.as_view(), name='order_cancel'),
     path('<int:pk>/', views.RouteDetailView.as_view(), name='detail'),
+    path('<int:pk>/map/', views.RouteMapView.as_view(), name='map'),
 ]
\ No newline at end of file
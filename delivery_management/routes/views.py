@@ -1,13 +1,19 @@
-from django.shortcuts import render
-from django.views.generic import FormView
-from django.urls import reverse_lazy
+from django.shortcuts import render, get_object_or_404
+from django.views.generic import FormView, ListView, CreateView, View
+from django.urls import reverse, reverse_lazy
 from django.contrib import messages
-from deliveries.models import Truck
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
+from django.http import HttpResponse, JsonResponse
+from accounts.decorators import dispatcher_required
+from deliveries.models import DeliveryOrder, Truck, Route
 from .forms import ManualOptimizationForm
-from .services import RouteOptimizationService
-from .models import Route
+from .incremental import RouteEditor
+from .jobs import enqueue_optimization
+from .models import OptimizationJob, OptimizationRun
 
-class ManualOptimizationView(FormView):
+class ManualOptimizationView(LoginRequiredMixin, FormView):
     template_name = 'routes/manual_optimize.html'
     form_class = ManualOptimizationForm
     success_url = reverse_lazy('routes:list')
@@ -15,20 +21,21 @@ class ManualOptimizationView(FormView):
     def form_valid(self, form):
         date = form.cleaned_data['date']
         num_trucks = form.cleaned_data['num_trucks']
-        orders = form.cleaned_data['orders']
+        # Only ids go into the job; the worker loads what it plans with
+        orders = list(form.cleaned_data['orders'].only('id'))
         
-        trucks = Truck.objects.filter(is_active=True)[:num_trucks]
+        trucks = Truck.objects.filter(is_active=True).order_by('-capacity_kg', 'id')[:num_trucks]
         
         if not trucks.exists():
             messages.error(self.request, "No active trucks available")
             return self.form_invalid(form)
         
-        optimizer = RouteOptimizationService(truck_capacity=1500)
-        routes = optimizer.optimize_daily_routes(date, list(trucks), list(orders))
+        # The optimization runs in the background worker pool
+        job = enqueue_optimization(date, list(trucks), orders, user=self.request.user)
         
         messages.success(
             self.request,
-            f"Created {len(routes)} optimized routes for {len(orders)} orders using {len(trucks)} trucks"
+            f"Optimization job #{job.id} queued for {len(orders)} orders using {len(trucks)} trucks"
         )
         return super().form_valid(form)
 
@@ -37,72 +44,164 @@ class ManualOptimizationView(FormView):
         kwargs['user'] = self.request.user
         return kwargs
 
-import folium
+
+class OptimizationJobStatusView(LoginRequiredMixin, View):
+    """Progress of a queued optimization job, polled by the browser"""
+
+    def get(self, request, pk):
+        job = get_object_or_404(OptimizationJob, pk=pk)
+        return JsonResponse({
+            'id': job.id,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message,
+            'result_url': reverse('routes:job_result', kwargs={'pk': job.id}),
+        })
+
+
+class OptimizationJobResultView(LoginRequiredMixin, View):
+    """Routes created by a finished optimization job"""
+
+    def get(self, request, pk):
+        job = get_object_or_404(OptimizationJob, pk=pk)
+        if not job.is_finished:
+            return JsonResponse({'id': job.id, 'status': job.status, 'progress': job.progress}, status=202)
+        if job.status == 'failed':
+            return JsonResponse({'id': job.id, 'status': job.status, 'error': job.message}, status=500)
+        
+        routes = Route.objects.filter(id__in=job.result.get('route_ids', [])).order_by('id')
+        return JsonResponse({
+            'id': job.id,
+            'status': job.status,
+            'message': job.message,
+            'skipped_order_ids': job.result.get('skipped_order_ids', []),
+            'routes': [
+                {
+                    'id': route.id,
+                    'name': route.name,
+                    'truck': route.truck_id,
+                    'total_distance_km': float(route.total_distance_km),
+                    'url': reverse('routes:detail', kwargs={'pk': route.id}),
+                }
+                for route in routes
+            ],
+            'run_url': (
+                reverse('routes:run_detail', kwargs={'pk': job.result['run_id']})
+                if job.result.get('run_id') else None
+            ),
+        })
+
+
+class OptimizationRunListView(LoginRequiredMixin, View):
+    """Metrics of recent optimizer runs, optionally for one date or route; 400 for a malformed filter"""
+
+    def get(self, request):
+        runs = OptimizationRun.objects.all()
+        if request.GET.get('date'):
+            try:
+                day = parse_date(request.GET['date'])
+            except ValueError:
+                day = None
+            if day is None:
+                return JsonResponse({'error': "date must be YYYY-MM-DD"}, status=400)
+            runs = runs.filter(date=day)
+        if request.GET.get('route'):
+            try:
+                route_id = int(request.GET['route'])
+            except ValueError:
+                return JsonResponse({'error': "route must be a route id"}, status=400)
+            runs = runs.filter(routes=route_id)
+        return JsonResponse({'runs': [run.as_dict() for run in runs[:50]]})
+
+
+class OptimizationRunDetailView(LoginRequiredMixin, View):
+    """Phase timings and counters of one optimizer run"""
+
+    def get(self, request, pk):
+        run = get_object_or_404(OptimizationRun, pk=pk)
+        data = run.as_dict()
+        data['route_ids'] = list(run.routes.values_list('id', flat=True))
+        return JsonResponse(data)
+
+
+@method_decorator(dispatcher_required, name='dispatch')
+class OrderInsertView(View):
+    """Insert a late order into the open routes of its date at the cheapest position"""
+
+    def post(self, request, order_id):
+        order = get_object_or_404(DeliveryOrder, pk=order_id)
+        try:
+            stop = RouteEditor().insert_order(order)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=409)
+        return JsonResponse({
+            'route': stop.route_id,
+            'stop_number': stop.stop_number,
+            'total_distance_km': float(stop.route.total_distance_km),
+            'url': reverse('routes:detail', kwargs={'pk': stop.route_id}),
+        })
+
+
+@method_decorator(dispatcher_required, name='dispatch')
+class OrderCancelView(View):
+    """Cancel an order and take it off its open route"""
+
+    def post(self, request, order_id):
+        order = get_object_or_404(DeliveryOrder, pk=order_id)
+        try:
+            route = RouteEditor().cancel_order(order)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=409)
+        return JsonResponse({
+            'status': order.status,
+            'route': route.id if route else None,
+            'total_distance_km': float(route.total_distance_km) if route else None,
+        })
+
+
+class RouteListView(LoginRequiredMixin, ListView):
+    model = Route
+    template_name = 'routes/route_list.html'
+    context_object_name = 'routes'
+    paginate_by = 20
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        
+        # Filter by date if provided
+        date = self.request.GET.get('date')
+        if date:
+            queryset = queryset.filter(date=date)
+        
+        # Drivers only see their own routes
+        if self.request.user.role == 'driver':
+            queryset = queryset.filter(driver=self.request.user)
+        
+        # Counts and load come with the page's routes instead of one query per row
+        return queryset.with_stop_counts().with_load().select_related('truck', 'driver').order_by('-date', 'name')
+
+
+class RouteCreateView(LoginRequiredMixin, CreateView):
+    model = Route
+    fields = ['name', 'truck', 'driver', 'date']
+    template_name = 'routes/route_form.html'
+    success_url = reverse_lazy('routes:list')
+
+
 from django.views.generic import DetailView
-from django.conf import settings
+from .maps import route_map_html
 
 class RouteDetailView(DetailView):
     model = Route
     template_name = 'routes/route_detail.html'
     context_object_name = 'route'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        route = self.get_object()
-        
-        # Create Folium map centered on factory
-        m = folium.Map(
-            location=[52.5200, 13.4050],  # Berlin coordinates
-            zoom_start=12,
-            tiles='OpenStreetMap'
-        )
-        
-        # Add factory marker
-        folium.Marker(
-            location=[52.5200, 13.4050],
-            popup='Factory',
-            icon=folium.Icon(color='red', icon='industry')
-        ).add_to(m)
-        
-        # Prepare route coordinates
-        route_coords = [(52.5200, 13.4050)]  # Start at factory
-        
-        for stop in route.stops.all().order_by('stop_number'):
-            # Pickup location
-            pickup_coord = (float(stop.delivery_order.pickup_latitude), 
-                           float(stop.delivery_order.pickup_longitude))
-            folium.Marker(
-                location=pickup_coord,
-                popup=f'Pickup: {stop.delivery_order.order_number}',
-                icon=folium.Icon(color='blue', icon='arrow-up')
-            ).add_to(m)
-            route_coords.append(pickup_coord)
-            
-            # Delivery location
-            delivery_coord = (float(stop.delivery_order.delivery_latitude), 
-                             float(stop.delivery_order.delivery_longitude))
-            folium.Marker(
-                location=delivery_coord,
-                popup=f'Delivery: {stop.delivery_order.order_number}',
-                icon=folium.Icon(color='green', icon='arrow-down')
-            ).add_to(m)
-            route_coords.append(delivery_coord)
-        
-        # Return to factory
-        route_coords.append((52.5200, 13.4050))
-        
-        # Draw the route
-        folium.PolyLine(
-            route_coords,
-            color='red',
-            weight=3,
-            opacity=0.8
-        ).add_to(m)
-        
-        # Fit map to bounds
-        m.fit_bounds(route_coords)
-        
-        # Get HTML representation
-        context['map_html'] = m._repr_html_()
-        
-        return context
+    def get_queryset(self):
+        # The map is fetched separately from routes:map once the page has loaded
+        return super().get_queryset().with_stop_counts().with_load().with_stops()
+
+
+class RouteMapView(View):
+    def get(self, request, pk):
+        get_object_or_404(Route.objects.only('id'), pk=pk)
+        return HttpResponse(route_map_html(pk))